@@ -0,0 +1,156 @@
+"""
+Benchmark số kết nối đồng thời: so sánh server một-luồng-mỗi-kết-nối với server asyncio.
+
+Người nhận chạy trong một tiến trình riêng (để đếm đúng số luồng của server); N người gửi
+kết nối cùng lúc, giữ kết nối mở cho tới khi tất cả đã kết nối, rồi mỗi người gửi một file nhỏ.
+
+Ví dụ:
+    python benchmarks/bench_connections.py --counts 10,50,100 --output bench_connections.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import generate_rsa_keys
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _receiver_process(key_dir, work_dir, port, mode, max_connections, control):
+    os.chdir(work_dir)
+    from receiver_engine import ReceiverEngine
+    receiver = ReceiverEngine()
+    receiver.load_receiver_private_key(os.path.join(key_dir, "receiver_private_key.pem"))
+    receiver.load_sender_public_key(os.path.join(key_dir, "sender_public_key.pem"))
+    success, message = receiver.start_server(port, mode, max_connections)
+    peak = {"threads": threading.active_count()}
+
+    def sample():
+        while True:
+            peak["threads"] = max(peak["threads"], threading.active_count())
+            time.sleep(0.01)
+
+    threading.Thread(target=sample, daemon=True).start()
+    control.send((success, message))
+    while True:
+        command = control.recv()
+        if command == "peak":
+            control.send(peak["threads"])
+            peak["threads"] = threading.active_count()
+        elif command == "stop":
+            receiver.stop_server()
+            control.send(True)
+            return
+
+
+def _run_clients(key_dir, port, count, payload):
+    from sender_engine import SenderEngine
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def client(index):
+        sender = SenderEngine()
+        sender.load_sender_private_key(os.path.join(key_dir, "sender_private_key.pem"))
+        sender.load_receiver_public_key(os.path.join(key_dir, "receiver_public_key.pem"))
+        start = time.perf_counter()
+        connected, _ = sender.connect_to_receiver('127.0.0.1', port)
+        try:
+            barrier.wait(timeout=120)
+        except threading.BrokenBarrierError:
+            pass
+        sent = False
+        if connected:
+            sent, _ = sender.send_contract_file(payload, f"bench_{index}.bin")
+            sender.disconnect()
+        results[index] = (connected and sent, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    latencies = sorted(r[1] for r in results if r and r[0])
+    return {
+        "connections": count,
+        "succeeded": len(latencies),
+        "wall_seconds": round(wall, 4),
+        "latency_p50": round(statistics.median(latencies), 4) if latencies else None,
+        "latency_p95": round(latencies[int(len(latencies) * 0.95) - 1], 4) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="10,50,100", help="Danh sách số kết nối đồng thời, cách nhau bởi dấu phẩy")
+    parser.add_argument("--modes", default="thread,asyncio", help="Các kiểu server cần đo")
+    parser.add_argument("--file-size", type=int, default=4096, help="Kích thước file mỗi người gửi (bytes)")
+    parser.add_argument("--max-connections", type=int, default=1024, help="Giới hạn kết nối của server asyncio")
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file thay vì in ra màn hình")
+    args = parser.parse_args()
+
+    counts = [int(c) for c in args.counts.split(",")]
+    payload = os.urandom(args.file_size)
+    results = []
+    with tempfile.TemporaryDirectory() as key_dir, tempfile.TemporaryDirectory() as work_dir:
+        generate_rsa_keys(os.path.join(key_dir, "sender_private_key.pem"), os.path.join(key_dir, "sender_public_key.pem"))
+        generate_rsa_keys(os.path.join(key_dir, "receiver_private_key.pem"), os.path.join(key_dir, "receiver_public_key.pem"))
+        for mode in args.modes.split(","):
+            port = _free_port()
+            control, child_control = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_receiver_process,
+                args=(key_dir, work_dir, port, mode, args.max_connections, child_control),
+                daemon=True,
+            )
+            process.start()
+            success, message = control.recv()
+            if not success:
+                print(f"Không khởi động được server {mode}: {message}", file=sys.stderr)
+                process.terminate()
+                continue
+            for count in counts:
+                control.send("peak")
+                control.recv()
+                result = _run_clients(key_dir, port, count, payload)
+                control.send("peak")
+                result["server_mode"] = mode
+                result["server_peak_threads"] = control.recv()
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+            control.send("stop")
+            control.recv()
+            process.join(timeout=5)
+
+    report = {
+        "benchmark": "connections",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpu_count": os.cpu_count(),
+        "file_size": args.file_size,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
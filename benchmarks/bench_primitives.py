@@ -0,0 +1,220 @@
+"""
+Microbenchmark các hàm nền trong utils.py: mã hóa/giải mã đối xứng, SHA-512, ký/xác minh RSA,
+RSA mã hóa/giải mã và đóng gói/nhận gói qua socket (khung JSON và khung nhị phân).
+
+Mỗi phép đo được lặp đủ nhiều lần để một lượt kéo dài ít nhất --min-time giây, chạy --repeat lượt
+và lấy trung vị. Dữ liệu đầu vào sinh từ --seed nên hai lần chạy trên cùng máy so sánh được với nhau
+(xem benchmarks/compare.py).
+
+Ví dụ:
+    python benchmarks/bench_primitives.py --sizes 1K,64K,1M --output bench_primitives.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (
+    CIPHER_SUITES,
+    compute_sha512,
+    decrypt_triple_des,
+    encrypt_triple_des,
+    generate_rsa_keys,
+    load_rsa_private_key,
+    load_rsa_public_key,
+    receive_data_packet,
+    rsa_decrypt,
+    rsa_encrypt,
+    send_binary_packet,
+    send_data_packet,
+    sign_data,
+    verify_signature,
+)
+
+
+def parse_size(text):
+    # "1K", "64K", "1M", "1G" hoặc số byte
+    text = text.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, factor in (("G", 1024 ** 3), ("M", 1024 ** 2), ("K", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return str(size)
+
+
+def _b64(data):
+    return b64encode(data).decode('utf-8')
+
+
+def _measure(function, min_time, repeat):
+    # Ước lượng số lần gọi mỗi lượt để một lượt kéo dài ít nhất min_time
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)) + 1)
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        samples.append((time.perf_counter() - start) / loops)
+    return samples, loops
+
+
+def _result(name, samples, loops, size=None):
+    seconds = statistics.median(samples)
+    result = {
+        "name": name,
+        "size": size,
+        "loops": loops,
+        "seconds": seconds,
+        "seconds_min": min(samples),
+        "ops_per_second": round(1 / seconds, 2) if seconds else None,
+    }
+    if size:
+        result["mb_per_second"] = round(size / seconds / 1e6, 2) if seconds else None
+    return result
+
+
+def _framing_case(send_function, packet, count):
+    # Gửi count gói qua socketpair, một luồng khác nhận; thời gian tính tới khi gói cuối được giải mã
+    left, right = socket.socketpair()
+    done = threading.Event()
+
+    def reader():
+        for _ in range(count):
+            if receive_data_packet(right) is None:
+                break
+        done.set()
+
+    try:
+        thread = threading.Thread(target=reader, daemon=True)
+        start = time.perf_counter()
+        thread.start()
+        for _ in range(count):
+            send_function(left, packet)
+        done.wait()
+        return (time.perf_counter() - start) / count
+    finally:
+        left.close()
+        right.close()
+
+
+def run_benchmarks(sizes, min_time, repeat, seed, only=None):
+    rng = random.Random(seed)
+    results = []
+
+    def wanted(name):
+        return not only or any(name.startswith(prefix) for prefix in only)
+
+    def record(name, function, size=None):
+        if not wanted(name):
+            return
+        samples, loops = _measure(function, min_time, repeat)
+        result = _result(name, samples, loops, size)
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        private_path = os.path.join(key_dir, "private_key.pem")
+        public_path = os.path.join(key_dir, "public_key.pem")
+        generate_rsa_keys(private_path, public_path)
+        private_key = load_rsa_private_key(private_path)
+        public_key = load_rsa_public_key(public_path)
+
+    digest = compute_sha512(rng.randbytes(64))
+    signature = sign_data(digest, private_key)
+    session_key = rng.randbytes(24)
+    encrypted_key = rsa_encrypt(session_key, public_key)
+    record("sign_data", lambda: sign_data(digest, private_key))
+    record("verify_signature", lambda: verify_signature(digest, signature, public_key))
+    record("rsa_encrypt", lambda: rsa_encrypt(session_key, public_key))
+    record("rsa_decrypt", lambda: rsa_decrypt(encrypted_key, private_key))
+
+    for size in sizes:
+        label = format_size(size)
+        data = rng.randbytes(size)
+        key, iv = rng.randbytes(24), rng.randbytes(8)
+        encrypted = encrypt_triple_des(data, key, iv)
+        record(f"compute_sha512[{label}]", lambda: compute_sha512(data), size)
+        record(f"encrypt_triple_des[{label}]", lambda: encrypt_triple_des(data, key, iv), size)
+        record(f"decrypt_triple_des[{label}]", lambda: decrypt_triple_des(encrypted, key, iv, unpad_output=True), size)
+        for suite in CIPHER_SUITES.values():
+            if not suite.aead:
+                continue
+            suite_key, nonce, aad = rng.randbytes(suite.key_size), rng.randbytes(suite.iv_size), b"bench|0"
+            sealed = suite.encrypt(data, suite_key, nonce, aad)
+            record(f"encrypt[{suite.name}][{label}]", lambda: suite.encrypt(data, suite_key, nonce, aad), size)
+            record(f"decrypt[{suite.name}][{label}]", lambda: suite.decrypt(sealed, suite_key, nonce, aad), size)
+
+        # Gói file_chunk điển hình: khung JSON mang base64, khung nhị phân mang dữ liệu thô
+        json_packet = {"type": "file_chunk", "file_id": "bench", "part_number": 0,
+                       "iv": _b64(iv), "cipher": _b64(data), "hash": _b64(digest), "sig": _b64(signature)}
+        binary_packet = {"type": "file_chunk", "file_id": "bench", "part_number": 0,
+                         "iv": iv, "cipher": data, "hash": digest, "sig": signature}
+        count = max(4, min(1000, (64 * 1024 * 1024) // max(size, 1)))
+        for name, send_function, packet in (
+            (f"framing_json[{label}]", send_data_packet, json_packet),
+            (f"framing_binary[{label}]", lambda sock, packet: send_binary_packet(sock, packet, "cipher"), binary_packet),
+        ):
+            if wanted(name):
+                samples = [_framing_case(send_function, packet, count) for _ in range(repeat)]
+                result = _result(name, samples, count, size)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1K,64K,1M,16M", help="Kích thước dữ liệu cho các phép đo theo byte (hậu tố K/M/G), cách nhau bởi dấu phẩy")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Thời gian tối thiểu (giây) của mỗi lượt đo")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lượt đo mỗi phép, lấy trung vị")
+    parser.add_argument("--seed", type=int, default=0, help="Hạt giống sinh dữ liệu đầu vào")
+    parser.add_argument("--only", help="Chỉ chạy các phép đo có tên bắt đầu bằng một trong các tiền tố (cách nhau bởi dấu phẩy)")
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file thay vì in ra màn hình")
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    only = args.only.split(",") if args.only else None
+    results = run_benchmarks(sizes, args.min_time, args.repeat, args.seed, only)
+
+    report = {
+        "benchmark": "primitives",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"sizes": sizes, "min_time": args.min_time, "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
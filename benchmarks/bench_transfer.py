@@ -0,0 +1,208 @@
+"""
+Benchmark truyền file đầu-cuối qua localhost: SenderApp -> ReceiverApp.
+
+Người nhận chạy trong một tiến trình riêng; Người gửi giữ một kết nối (pool) và gửi đồng thời
+N bản của cùng một file nguồn bằng send_contract_path. Mỗi tổ hợp (kích thước, số phần, số luồng
+đồng thời) được chạy --repeat lần, lấy trung vị thời gian. File nguồn được sinh trên đĩa từ --seed
+nên file 1 GB không cần nằm trong bộ nhớ; file đã nhận bị xóa sau mỗi lượt.
+
+Số phần "auto" dùng chính sách chia phần mặc định của Người gửi; một số nguyên N dùng chế độ
+"parts" với N phần mục tiêu (bị giới hạn bởi MIN_CHUNK_SIZE/MAX_CHUNK_SIZE).
+
+Ví dụ:
+    python benchmarks/bench_transfer.py --sizes 1K,1M,64M,1G --parts auto,16 --concurrency 1,4 --output bench_transfer.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import CHUNK_MODE_AUTO, CHUNK_MODE_PARTS, generate_rsa_keys
+from bench_primitives import format_size, parse_size
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _receiver_process(key_dir, work_dir, port, mode, control):
+    os.chdir(work_dir)
+    from receiver_engine import ReceiverEngine
+    receiver = ReceiverEngine()
+    receiver.load_receiver_private_key(os.path.join(key_dir, "receiver_private_key.pem"))
+    receiver.load_sender_public_key(os.path.join(key_dir, "sender_public_key.pem"))
+    control.send(receiver.start_server(port, mode))
+    while True:
+        command = control.recv()
+        if command == "clean":
+            shutil.rmtree(receiver.save_dir, ignore_errors=True)
+            control.send(True)
+        elif command == "stop":
+            receiver.stop_server()
+            control.send(True)
+            return
+
+
+def _write_source_file(path, size, seed):
+    rng = random.Random(seed)
+    block = 1024 * 1024
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(rng.randbytes(min(block, remaining)))
+            remaining -= block
+
+
+def _run_transfers(sender, source_path, concurrency):
+    results = [None] * concurrency
+
+    def transfer(index):
+        start = time.perf_counter()
+        success, message = sender.send_contract_path(source_path)
+        results[index] = (success, time.perf_counter() - start, message)
+
+    threads = [threading.Thread(target=transfer, args=(i,)) for i in range(concurrency)]
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - wall_start, results
+
+
+def run_case(sender, control, source_path, size, parts, concurrency, repeat):
+    if parts == CHUNK_MODE_AUTO:
+        sender.set_chunking_policy(CHUNK_MODE_AUTO)
+    else:
+        sender.set_chunking_policy(CHUNK_MODE_PARTS, num_parts=parts)
+    walls, latencies, failures = [], [], []
+    for _ in range(repeat):
+        wall, results = _run_transfers(sender, source_path, concurrency)
+        control.send("clean")
+        control.recv()
+        walls.append(wall)
+        latencies.extend(r[1] for r in results if r[0])
+        failures.extend(r[2] for r in results if not r[0])
+    seconds = statistics.median(walls)
+    latencies.sort()
+    return {
+        "name": f"transfer[size={format_size(size)},parts={parts},concurrency={concurrency}]",
+        "size": size,
+        "parts": parts,
+        "concurrency": concurrency,
+        "repeat": repeat,
+        "succeeded": len(latencies),
+        "failed": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "seconds": seconds,
+        "seconds_min": min(walls),
+        "mb_per_second": round(size * concurrency / seconds / 1e6, 2) if seconds else None,
+        "latency_p50": round(statistics.median(latencies), 4) if latencies else None,
+        "latency_p95": round(latencies[math.ceil(len(latencies) * 0.95) - 1], 4) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1K,64K,1M,16M,128M", help="Kích thước file (hậu tố K/M/G, ví dụ 1K,1M,1G), cách nhau bởi dấu phẩy")
+    parser.add_argument("--parts", default="auto,16", help="Số phần mỗi file: 'auto' hoặc số nguyên, cách nhau bởi dấu phẩy")
+    parser.add_argument("--concurrency", default="1,4", help="Số file gửi đồng thời, cách nhau bởi dấu phẩy")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lượt chạy mỗi tổ hợp, lấy trung vị")
+    parser.add_argument("--server-mode", default="thread", help="Kiểu server của Người nhận (thread hoặc asyncio)")
+    parser.add_argument("--seed", type=int, default=0, help="Hạt giống sinh nội dung file nguồn")
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file thay vì in ra màn hình")
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    parts_list = [p if p == CHUNK_MODE_AUTO else int(p) for p in args.parts.split(",")]
+    concurrency_list = [int(c) for c in args.concurrency.split(",")]
+    results = []
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as key_dir, tempfile.TemporaryDirectory() as work_dir:
+        generate_rsa_keys(os.path.join(key_dir, "sender_private_key.pem"), os.path.join(key_dir, "sender_public_key.pem"))
+        generate_rsa_keys(os.path.join(key_dir, "receiver_private_key.pem"), os.path.join(key_dir, "receiver_public_key.pem"))
+        receiver_dir = os.path.join(work_dir, "receiver")
+        sender_dir = os.path.join(work_dir, "sender")
+        os.makedirs(receiver_dir)
+        os.makedirs(sender_dir)
+        port = _free_port()
+        control, child_control = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=_receiver_process,
+            args=(key_dir, receiver_dir, port, args.server_mode, child_control),
+            daemon=True,
+        )
+        process.start()
+        success, message = control.recv()
+        if not success:
+            print(f"Không khởi động được Người nhận: {message}", file=sys.stderr)
+            process.terminate()
+            sys.exit(1)
+
+        # Người gửi ghi manifest đã gửi vào thư mục hiện hành, nên chạy trong thư mục tạm
+        os.chdir(sender_dir)
+        try:
+            from sender_engine import SenderEngine
+            sender = SenderEngine()
+            sender.load_sender_private_key(os.path.join(key_dir, "sender_private_key.pem"))
+            sender.load_receiver_public_key(os.path.join(key_dir, "receiver_public_key.pem"))
+            success, message = sender.connect_to_receiver('127.0.0.1', port)
+            if not success:
+                print(f"Không kết nối được Người nhận: {message}", file=sys.stderr)
+                sys.exit(1)
+            sender.set_pool_settings(max_transfers=max(concurrency_list))
+            # Cùng một file được gửi nhiều lần: tắt khử trùng lặp để đo truyền thật, không đo liên kết từ kho
+            sender.set_dedup(False)
+            source_path = os.path.join(sender_dir, "bench_source.bin")
+            for size in sizes:
+                _write_source_file(source_path, size, args.seed)
+                for parts in parts_list:
+                    for concurrency in concurrency_list:
+                        result = run_case(sender, control, source_path, size, parts, concurrency, args.repeat)
+                        result["server_mode"] = args.server_mode
+                        results.append(result)
+                        print(json.dumps(result), file=sys.stderr)
+                        shutil.rmtree("sent_manifests", ignore_errors=True)
+                os.remove(source_path)
+            sender.disconnect()
+        finally:
+            os.chdir(original_dir)
+            control.send("stop")
+            control.recv()
+            process.join(timeout=5)
+
+    report = {
+        "benchmark": "transfer",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"sizes": sizes, "parts": parts_list, "concurrency": concurrency_list,
+                     "repeat": args.repeat, "server_mode": args.server_mode, "seed": args.seed},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
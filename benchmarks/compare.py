@@ -0,0 +1,91 @@
+"""
+So sánh hai file kết quả benchmark (bench_primitives.py hoặc bench_transfer.py) để phát hiện suy giảm hiệu năng.
+
+Các phép đo được ghép theo trường "name" và so sánh trường "seconds" (trung vị, càng nhỏ càng tốt).
+Phép đo chậm hơn mốc quá --threshold (mặc định 10%) bị đánh dấu REGRESSION; khi có ít nhất một
+suy giảm, chương trình thoát với mã 1 để dùng được trong CI.
+
+Ví dụ:
+    python benchmarks/compare.py baseline.json bench_primitives.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return report, {result["name"]: result for result in report.get("results", [])}
+
+
+def compare(baseline, current, threshold):
+    rows = []
+    for name, result in current.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append({"name": name, "status": "new", "current": result.get("seconds")})
+            continue
+        if not base.get("seconds") or result.get("seconds") is None or result.get("failed"):
+            rows.append({"name": name, "status": "failed" if result.get("failed") else "invalid",
+                         "baseline": base.get("seconds"), "current": result.get("seconds")})
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append({"name": name, "status": status, "baseline": base["seconds"], "current": result["seconds"],
+                     "change": round(ratio - 1, 4)})
+    for name, base in baseline.items():
+        if name not in current:
+            rows.append({"name": name, "status": "missing", "baseline": base.get("seconds")})
+    return rows
+
+
+def _format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1e-3:
+        return f"{value * 1e6:.1f}us"
+    if value < 1:
+        return f"{value * 1e3:.2f}ms"
+    return f"{value:.3f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", help="File JSON kết quả mốc (ví dụ từ bản phát hành trước)")
+    parser.add_argument("current", help="File JSON kết quả cần so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Tỷ lệ chậm đi tối đa được chấp nhận (0.10 = 10%%)")
+    parser.add_argument("--json", action="store_true", help="In kết quả so sánh dạng JSON")
+    args = parser.parse_args()
+
+    baseline_report, baseline = load_results(args.baseline)
+    current_report, current = load_results(args.current)
+    if baseline_report.get("benchmark") != current_report.get("benchmark"):
+        print(f"Hai file thuộc hai loại benchmark khác nhau: {baseline_report.get('benchmark')} và {current_report.get('benchmark')}", file=sys.stderr)
+        sys.exit(2)
+    for field in ("platform", "python", "cpu_count"):
+        if baseline_report.get(field) != current_report.get(field):
+            print(f"Cảnh báo: {field} khác nhau ({baseline_report.get(field)} / {current_report.get(field)}), kết quả có thể không so sánh được.", file=sys.stderr)
+
+    rows = compare(baseline, current, args.threshold)
+    regressions = [row for row in rows if row["status"] in ("regression", "failed")]
+    if args.json:
+        print(json.dumps({"threshold": args.threshold, "regressions": len(regressions), "results": rows}, indent=2))
+    else:
+        width = max((len(row["name"]) for row in rows), default=4)
+        print(f"{'name':<{width}}  {'baseline':>10}  {'current':>10}  {'change':>8}  status")
+        for row in rows:
+            change = f"{row['change'] * 100:+.1f}%" if "change" in row else "-"
+            print(f"{row['name']:<{width}}  {_format_seconds(row.get('baseline')):>10}  "
+                  f"{_format_seconds(row.get('current')):>10}  {change:>8}  {row['status'].upper()}")
+        print(f"\n{len(regressions)} phép đo chậm hơn mốc quá {args.threshold * 100:.0f}% hoặc bị lỗi.")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Dòng lệnh gửi/nhận hợp đồng không cần Flask hay trình duyệt: dùng trực tiếp SenderEngine/ReceiverEngine
+với đường dẫn khóa và đường dẫn file trên đĩa.
+
+Ví dụ:
+    python cli.py serve --private-key keys/receiver_private_key.pem --sender-key keys/sender_public_key.pem --port 5001
+    python cli.py send --private-key keys/sender_private_key.pem --receiver-key keys/receiver_public_key.pem \\
+        --host 127.0.0.1 --port 5001 contract.txt other.pdf
+
+Thư mục trong danh sách được gửi thành một lô (mọi file trong cây thư mục trên một kết nối, một manifest
+đã ký); --batch TÊN gom các file còn lại thành một lô cùng tên.
+
+Mã thoát của send là 0 khi mọi file được gửi thành công, 1 nếu có file lỗi.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+# Các module engine (PyCryptodome, socket, pool...) chỉ được import trong từng lệnh, để --help và lỗi
+# tham số trả về ngay mà không phải nạp thư viện mật mã.
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+
+def _follow_log(activity_log, min_level, stop):
+    # In các mục nhật ký mới ra stderr cho tới khi stop được đặt và đã in hết
+    threshold = LOG_LEVELS.index(min_level)
+    seq = 0
+    while True:
+        entries, dropped = activity_log.since(seq)
+        if dropped:
+            print(f"... bỏ qua {dropped} dòng nhật ký cũ", file=sys.stderr)
+        for entry in entries:
+            if LOG_LEVELS.index(entry["level"]) >= threshold:
+                print(f"[{entry['timestamp']}] {entry['level']:<7} {entry['message']}", file=sys.stderr, flush=True)
+        if entries:
+            seq = entries[-1]["seq"]
+        elif stop.is_set():
+            return
+        else:
+            activity_log.wait(seq, 0.2)
+
+
+def _start_log_thread(activity_log, args):
+    stop = threading.Event()
+    min_level = "DEBUG" if args.verbose else ("ERROR" if args.quiet else "INFO")
+    thread = threading.Thread(target=_follow_log, args=(activity_log, min_level, stop), daemon=True)
+    thread.start()
+
+    def finish():
+        stop.set()
+        thread.join(timeout=2)
+    return finish
+
+
+def _missing_files(paths, allow_dirs=False):
+    missing = [path for path in paths if not (os.path.isfile(path) or (allow_dirs and os.path.isdir(path)))]
+    if missing:
+        print(f"Không tìm thấy file: {', '.join(missing)}", file=sys.stderr)
+    return missing
+
+
+def _check(result):
+    # Các phương thức engine trả về (success, message); dừng ngay với mã 2 nếu cấu hình không hợp lệ
+    success, message = result
+    if not success:
+        print(message, file=sys.stderr)
+        sys.exit(2)
+
+
+def cmd_send(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from sender_engine import SenderEngine
+    from utils import CHUNK_MODE_FIXED
+
+    if _missing_files([args.private_key, args.receiver_key]) or _missing_files(args.files, allow_dirs=True):
+        return 2
+    sender = SenderEngine(manifest_dir=args.manifest_dir)
+    directories = [path for path in args.files if os.path.isdir(path)]
+    files = [path for path in args.files if not os.path.isdir(path)]
+    # Mỗi việc gửi trả về (nhãn, success, message, báo cáo từng file của lô hoặc None)
+    jobs = [lambda path=path: (path, *sender.send_contract_directory(path)) for path in directories]
+    if args.batch and files:
+        jobs.append(lambda: (args.batch, *sender.send_contract_batch(files, args.batch)))
+    else:
+        jobs.extend(lambda path=path: (path, *sender.send_contract_path(path), None) for path in files)
+    finish_log = _start_log_thread(sender.activity_log, args)
+    try:
+        _check(sender.load_sender_private_key(args.private_key))
+        _check(sender.load_receiver_public_key(args.receiver_key))
+        if args.cipher_suites:
+            _check(sender.set_cipher_suites([name.strip() for name in args.cipher_suites.split(",") if name.strip()]))
+        if args.key_exchange:
+            _check(sender.set_key_exchange_mode(args.key_exchange))
+        if args.compression:
+            _check(sender.set_compression(args.compression))
+        if args.no_dedup:
+            _check(sender.set_dedup(False))
+        if args.delta:
+            _check(sender.set_delta(True))
+        if args.chunk_size:
+            _check(sender.set_chunking_policy(CHUNK_MODE_FIXED, args.chunk_size))
+        _check(sender.set_pool_settings(max_transfers=args.jobs))
+        _check(sender.connect_to_receiver(args.host, args.port))
+
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(lambda job: job(), jobs))
+    finally:
+        if sender.is_connected:
+            sender.disconnect()
+        finish_log()
+
+    failed = 0
+    for label, success, message, report in results:
+        if success:
+            print(f"OK\t{label}")
+        else:
+            failed += 1
+            print(f"FAIL\t{label}\t{message}")
+        for entry in report or ():
+            status = "OK" if entry.get("status") == "OK" else "FAIL"
+            print(f"{status}\t{label}/{entry.get('path')}" + ("" if status == "OK" else f"\t{entry.get('message', '')}"))
+    return 1 if failed else 0
+
+
+def cmd_serve(args):
+    from receiver_engine import ReceiverEngine
+
+    if _missing_files([args.private_key, args.sender_key]):
+        return 2
+    receiver = ReceiverEngine(save_dir=args.save_dir)
+    finish_log = _start_log_thread(receiver.activity_log, args)
+    stop = threading.Event()
+    # SIGTERM (ví dụ từ systemd hoặc docker stop) dừng server gọn gàng như Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        _check(receiver.load_receiver_private_key(args.private_key))
+        _check(receiver.load_sender_public_key(args.sender_key))
+        if args.worker_mode or args.workers:
+            _check(receiver.set_worker_settings(args.worker_mode, args.workers))
+        _check(receiver.start_server(args.port, args.server_mode, args.max_connections))
+        try:
+            while not stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        receiver.stop_server()
+    finally:
+        finish_log()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_log_options(command):
+        group = command.add_mutually_exclusive_group()
+        group.add_argument("-v", "--verbose", action="store_true", help="In cả nhật ký mức DEBUG (từng phần file)")
+        group.add_argument("-q", "--quiet", action="store_true", help="Chỉ in nhật ký mức ERROR")
+
+    send = commands.add_parser("send", help="Gửi một hoặc nhiều file tới Người nhận")
+    send.add_argument("files", nargs="+", help="Các file hoặc thư mục cần gửi (mỗi thư mục là một lô)")
+    send.add_argument("--private-key", required=True, help="Khóa riêng tư của Người gửi (.pem)")
+    send.add_argument("--receiver-key", required=True, help="Khóa công khai của Người nhận (.pem)")
+    send.add_argument("--host", default="127.0.0.1", help="Địa chỉ Người nhận")
+    send.add_argument("--port", type=int, required=True, help="Cổng của Người nhận")
+    send.add_argument("--jobs", type=int, default=1, help="Số file gửi đồng thời")
+    send.add_argument("--batch", metavar="NAME", help="Gửi các file (không phải thư mục) thành một lô tên NAME trên Người nhận")
+    send.add_argument("--chunk-size", type=int, help="Kích thước phần cố định (bytes); mặc định tự chọn theo file")
+    send.add_argument("--compression", help="Nén từng phần: none, zlib, lzma, zstd hoặc auto")
+    send.add_argument("--cipher-suites", help="Thứ tự ưu tiên bộ mã hóa, cách nhau bởi dấu phẩy")
+    send.add_argument("--key-exchange", help="Cách trao đổi khóa phiên: oaep-hkdf, oaep-wrap hoặc split")
+    send.add_argument("--no-dedup", action="store_true", help="Luôn gửi toàn bộ file, kể cả khi Người nhận đã có cùng nội dung")
+    send.add_argument("--delta", action="store_true", help="Chỉ gửi phần khác biệt so với bản cũ cùng tên Người nhận đang giữ")
+    send.add_argument("--manifest-dir", default="sent_manifests", help="Thư mục lưu manifest đã ký của file đã gửi")
+    add_log_options(send)
+    send.set_defaults(handler=cmd_send)
+
+    serve = commands.add_parser("serve", help="Chạy Người nhận và lưu các file nhận được")
+    serve.add_argument("--private-key", required=True, help="Khóa riêng tư của Người nhận (.pem)")
+    serve.add_argument("--sender-key", required=True, help="Khóa công khai của Người gửi (.pem)")
+    serve.add_argument("--port", type=int, default=5001, help="Cổng lắng nghe")
+    serve.add_argument("--save-dir", default="received_files", help="Thư mục lưu file đã nhận")
+    serve.add_argument("--server-mode", choices=("thread", "asyncio"), help="Kiểu server")
+    serve.add_argument("--max-connections", type=int, help="Số kết nối tối đa (chế độ asyncio)")
+    serve.add_argument("--worker-mode", choices=("thread", "process"), help="Loại pool xác minh/giải mã")
+    serve.add_argument("--workers", type=int, help="Số worker xác minh/giải mã")
+    add_log_options(serve)
+    serve.set_defaults(handler=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if getattr(args, "jobs", 1) < 1:
+        print("--jobs phải lớn hơn 0.", file=sys.stderr)
+        return 2
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
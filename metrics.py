@@ -0,0 +1,171 @@
+import time
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Mốc (giây) mặc định của histogram: từ thao tác băm vài chục micro giây tới truyền cả file
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    # Bộ đếm chỉ tăng; nhãn được truyền theo vị trí, đúng thứ tự label_names
+    type_name = "counter"
+
+    def __init__(self, name, documentation, label_names=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.label_names, label_values), value
+
+class Gauge:
+    # Giá trị hiện tại; nếu có function thì giá trị được đọc lại mỗi lần xuất /metrics
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, function=None, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.value = 0
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        value = self.function() if self.function is not None else self.value
+        yield self.name, "", value
+
+class Histogram:
+    # Phân bố thời gian theo các mốc cố định (kiểu Prometheus: mỗi mốc đếm số quan sát <= mốc)
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label_values -> [số đếm theo từng mốc (chưa cộng dồn) + mốc +Inf, tổng, số lần]
+        self.lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self.lock:
+            values = {label_values: (list(state[0]), state[1], state[2]) for label_values, state in self.values.items()}
+        for label_values, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", _format_labels(self.label_names, label_values, ("le", _format_value(bound))), cumulative
+            labels = _format_labels(self.label_names, label_values)
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, count
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric đã được đăng ký: {metric.name}")
+            self.metrics[metric.name] = metric
+
+    def unregister(self, name):
+        with self.lock:
+            self.metrics.pop(name, None)
+
+    def render(self):
+        """Xuất mọi metric theo định dạng văn bản của Prometheus (text/plain; version=0.0.4)."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def timed(histogram, *label_values):
+    """Decorator đo thời gian mỗi lần gọi hàm vào histogram với các nhãn cố định."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *label_values)
+        return wrapper
+    return decorator
+
+# Các metric dùng chung cho Người gửi và Người nhận (mỗi ứng dụng là một tiến trình riêng).
+# Với pool tiến trình của Người nhận, thao tác trong tiến trình con không được tính vào đây.
+CRYPTO_SECONDS = Histogram("contract_crypto_seconds", "Thời gian các thao tác mật mã",
+                           ("operation", "algorithm"))
+PACKET_SECONDS = Histogram("contract_packet_seconds", "Thời gian gửi/nhận (và mã hóa/giải mã khung) một gói",
+                           ("direction", "format"))
+PACKETS = Counter("contract_packets_total", "Số gói đã gửi/nhận", ("direction", "format"))
+PACKET_BYTES = Counter("contract_packet_bytes_total", "Số byte gói (gồm tiền tố độ dài) đã gửi/nhận", ("direction",))
+CHUNKS = Counter("contract_chunks_total", "Số phần file theo kết quả xử lý", ("direction", "result"))
+FILE_BYTES = Counter("contract_file_bytes_total", "Số byte nội dung file (bản rõ) đã gửi/nhận thành công", ("direction",))
+FILES = Counter("contract_files_total", "Số file theo kết quả", ("direction", "result"))
+FILE_TRANSFER_SECONDS = Histogram("contract_file_transfer_seconds", "Thời gian gửi/nhận trọn một file", ("direction",))
@@ -0,0 +1,1287 @@
+import socket
+import os
+import shutil
+import json
+import time
+from base64 import b64encode, b64decode
+import threading
+import select
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from Crypto.PublicKey import RSA
+from metrics import CHUNKS, FILES, FILE_BYTES, FILE_TRANSFER_SECONDS
+
+from utils import (
+    load_rsa_private_key, load_rsa_public_key,
+    rsa_decrypt,
+    verify_signature, send_data_packet, receive_data_packet,
+    BUFFER_SIZE, generate_rsa_keys,
+    compute_sha512, part_length, packet_bytes, negotiate_wire_format,
+    build_merkle_tree, merkle_root, AUTH_MODES, AUTH_MODE_PER_CHUNK, AUTH_MODE_MERKLE,
+    DEFAULT_CRYPTO_WORKERS, DEFAULT_PIPELINE_DEPTH, async_receive_data_packet,
+    SUPPORTED_CIPHER_SUITES, CIPHER_SUITE_3DES_CBC, get_cipher_suite, chunk_digest, chunk_aad,
+    get_random_bytes, public_key_fingerprint, session_proof, verify_session_proof,
+    seal_session_ticket, open_session_ticket, SESSION_TICKET_TTL, SESSION_TICKET_CACHE_SIZE,
+    rsa_oaep_decrypt, derive_session_material, key_material_digest, KEY_EXCHANGE_MODES,
+    KEY_EXCHANGE_SPLIT, KEY_EXCHANGE_OAEP_WRAP, SESSION_SECRET_SIZE, MAX_SEND_WINDOW, MAX_PART_RETRANSMITS, MAX_CHUNK_SIZE,
+    COMPRESSION_NONE, COMPRESSION_CODECS, get_compression_codec, decompress_chunk,
+    MANIFEST_SUFFIX, verify_transfer_manifest, BATCH_VERSION, MAX_BATCH_FILES, batch_relative_path,
+    CONTENT_HASH_FIELD, stream_sha512, DELTA_VERSION, DELTA_MAX_FILE_SIZE, delta_block_size, delta_signatures,
+    ActivityLog, LOG_DEBUG, LOG_WARNING, LOG_ERROR
+)
+
+# Thư mục lưu file đã nhận; file đang nhận được ghi vào file tạm trong cùng thư mục
+SAVE_DIR = "received_files"
+# File tạm và nhật ký tiến độ của lần nhận dở dang được giữ lại để tiếp tục, sau thời gian này thì bị xóa
+RESUME_JOURNAL_TTL = 24 * 3600 # giây
+# Kho nội dung trong thư mục lưu: mỗi nội dung đã nhận được liên kết cứng tại <kho>/<2 ký tự đầu>/<SHA-512 hex>,
+# đường dẫn theo hash chính là chỉ mục. Nhận lại cùng nội dung chỉ cần liên kết từ kho, không truyền phần nào.
+CONTENT_STORE_DIR = ".store"
+
+# Loại pool dùng để xác minh và giải mã các phần file
+WORKER_MODE_THREAD = "thread"
+WORKER_MODE_PROCESS = "process"
+
+# Kiểu server: một luồng cho mỗi kết nối, hoặc một vòng lặp asyncio cho mọi kết nối
+SERVER_MODE_THREAD = "thread"
+SERVER_MODE_ASYNCIO = "asyncio"
+# Số kết nối đồng thời tối đa ở chế độ asyncio; kết nối vượt quá bị từ chối ngay
+DEFAULT_MAX_CONNECTIONS = 256
+
+_public_key_cache = {}
+
+class _ReplyBuffer:
+    # Thay cho socket ở chế độ asyncio: send_data_packet chỉ gọi sendall(), các gói trả lời
+    # được gom lại để coroutine ghi ra StreamWriter và chờ drain() (áp lực ngược).
+    def __init__(self):
+        self.chunks = []
+
+    def sendall(self, data):
+        self.chunks.append(bytes(data))
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class SessionTicketCache:
+    # Trạng thái các phiên có thể nối lại, theo ticket_id; giới hạn số mục và thời gian sống.
+    # Dùng chung giữa các luồng kết nối nên mọi thao tác đều giữ khóa.
+    def __init__(self, ttl=SESSION_TICKET_TTL, max_entries=SESSION_TICKET_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, ticket_id, state):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._purge_expired()
+            self.entries[ticket_id] = (expires_at, state)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False) # Bỏ phiên cũ nhất
+        return expires_at
+
+    def get(self, ticket_id):
+        with self.lock:
+            entry = self.entries.get(ticket_id)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[1]
+
+    def pop(self, ticket_id):
+        with self.lock:
+            entry = self.entries.pop(ticket_id, None)
+        return entry[1] if entry and entry[0] >= time.time() else None
+
+    def _purge_expired(self):
+        now = time.time()
+        while self.entries:
+            ticket_id, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at >= now:
+                break
+            del self.entries[ticket_id]
+
+def verify_and_decrypt_chunk(session_key, cipher_suite, public_key, auth_mode, file_id, part_number, iv_bytes, cipher_bytes, received_hash_bytes, signature_bytes,
+                             compression=COMPRESSION_NONE, expected_length=None):
+    # Chạy trong pool: kiểm tra hash, xác minh chữ ký (chế độ per_chunk), giải mã rồi giải nén một phần file.
+    # Với ProcessPoolExecutor, khóa công khai được truyền dạng DER vì đối tượng RsaKey không pickle được.
+    # Với bộ AEAD, hash chỉ phủ (IV || tag); chính tag được kiểm tra khi giải mã bảo đảm toàn vẹn ciphertext.
+    if isinstance(public_key, bytes):
+        if public_key not in _public_key_cache:
+            _public_key_cache[public_key] = RSA.import_key(public_key)
+        public_key = _public_key_cache[public_key]
+    suite = get_cipher_suite(cipher_suite)
+    re_computed_hash = chunk_digest(suite, iv_bytes, cipher_bytes)
+    if re_computed_hash != received_hash_bytes:
+        raise ValueError(f"Hash của phần {part_number} KHÔNG khớp. File có thể bị thay đổi.")
+    if auth_mode != AUTH_MODE_MERKLE and not verify_signature(re_computed_hash, signature_bytes, public_key):
+        raise ValueError(f"Chữ ký của phần {part_number} KHÔNG hợp lệ. Xác thực thất bại.")
+    try:
+        decrypted_chunk = suite.decrypt(cipher_bytes, session_key, iv_bytes, chunk_aad(file_id, part_number))
+    except ValueError as e:
+        raise ValueError(f"Giải mã phần {part_number} thất bại ({suite.name}): {e}")
+    codec = get_compression_codec(compression)
+    if codec is not None:
+        try:
+            decrypted_chunk = decompress_chunk(codec, decrypted_chunk, expected_length)
+        except Exception as e:
+            raise ValueError(f"Giải nén phần {part_number} thất bại ({compression}): {e}")
+    return re_computed_hash, decrypted_chunk
+
+class ReceiverEngine:
+    def __init__(self, save_dir=SAVE_DIR):
+        self.save_dir = save_dir  # Thư mục lưu file đã nhận
+        self.receiver_private_key = None
+        self.sender_public_key = None
+        self.server_socket = None
+        self.running = False
+        self.client_sessions = {}
+        self.activity_log = ActivityLog()  # Nhật ký hoạt động (vòng đệm, xem utils.ActivityLog)
+        # Pool xác minh/giải mã: luồng kết nối chỉ đọc gói và giao việc, kết quả được áp dụng theo thứ tự
+        self.worker_mode = WORKER_MODE_THREAD
+        self.verify_workers = DEFAULT_CRYPTO_WORKERS
+        self.max_inflight_chunks = DEFAULT_PIPELINE_DEPTH  # Số phần đang xử lý tối đa trên mỗi kết nối
+        self.executor = None
+        self.server_mode = SERVER_MODE_THREAD
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+        self.async_loop = None
+        self.async_server = None
+        self.handler_executor = None  # Luồng chạy phần xử lý gói (đồng bộ) cho chế độ asyncio
+        # Vé phiên: khóa vé chỉ nằm trong bộ nhớ, khởi động lại Người nhận làm mọi vé cũ mất hiệu lực
+        self.ticket_key = get_random_bytes(32)
+        self.session_cache = SessionTicketCache()
+        # File tạm đang được một kết nối ghi; không cho kết nối khác tiếp tục cùng file đó
+        self.active_transfers = set()
+        self.transfers_lock = threading.Lock()
+
+    def generate_keys(self, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        private_path = os.path.join(output_dir, "receiver_private_key.pem")
+        public_path = os.path.join(output_dir, "receiver_public_key.pem")
+        try:
+            generate_rsa_keys(private_path, public_path)
+            message = f"Đã tạo khóa tại: {output_dir}"
+            self.activity_log.append(message)
+            return True, message
+        except Exception as e:
+            message = f"Lỗi khi tạo khóa: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+
+    def load_receiver_private_key(self, file_path):
+        key = load_rsa_private_key(file_path)
+        if key:
+            self.receiver_private_key = key
+            message = f"Đã tải khóa riêng tư người nhận từ: {file_path}"
+            self.activity_log.append(message)
+            return True, message
+        message = f"Không thể tải khóa riêng tư người nhận từ: {file_path}"
+        self.activity_log.append(message, level=LOG_ERROR)
+        return False, message
+
+    def load_sender_public_key(self, file_path):
+        key = load_rsa_public_key(file_path)
+        if key:
+            self.sender_public_key = key
+            message = f"Đã tải khóa công khai người gửi từ: {file_path}"
+            self.activity_log.append(message)
+            return True, message
+        message = f"Không thể tải khóa công khai người gửi từ: {file_path}"
+        self.activity_log.append(message, level=LOG_ERROR)
+        return False, message
+
+    def start_server(self, port, server_mode=None, max_connections=None):
+        if self.running:
+            message = "Server đang chạy."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if not self.receiver_private_key or not self.sender_public_key:
+            message = "Thiếu khóa RSA để khởi động server."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if server_mode is not None:
+            if server_mode not in (SERVER_MODE_THREAD, SERVER_MODE_ASYNCIO):
+                message = f"Kiểu server không hợp lệ: {server_mode}"
+                self.activity_log.append(message, level=LOG_ERROR)
+                return False, message
+            self.server_mode = server_mode
+        if max_connections is not None:
+            if max_connections < 1:
+                message = "Số kết nối tối đa phải lớn hơn 0."
+                self.activity_log.append(message, level=LOG_ERROR)
+                return False, message
+            self.max_connections = max_connections
+        self._purge_stale_transfers()
+        if self.server_mode == SERVER_MODE_ASYNCIO:
+            return self._start_async_server(port)
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.settimeout(1.0)
+            self.server_socket.bind(('', port))
+            self.server_socket.listen(5)
+            self._start_executor()
+            self.running = True
+            threading.Thread(target=self._start_server_task, daemon=True).start()
+            message = f"Server đang lắng nghe tại cổng {port}..."
+            self.activity_log.append(message)
+            return True, message
+        except Exception as e:
+            message = f"Lỗi khởi động server: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+
+    def stop_server(self):
+        if not self.running:
+            message = "Server không chạy."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.running = False
+        if self.async_loop:
+            self._stop_async_server()
+        self._stop_executor()
+        if self.server_socket:
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+                self.server_socket.close()
+            except OSError as e:
+                message = f"Lỗi khi đóng server socket: {e}"
+                self.activity_log.append(message, level=LOG_ERROR)
+                return False, message
+            finally:
+                self.server_socket = None
+        message = "Server đã dừng."
+        self.activity_log.append(message)
+        return True, message
+
+    def set_worker_settings(self, worker_mode=None, verify_workers=None, max_inflight_chunks=None):
+        if self.running:
+            message = "Hãy dừng server trước khi thay đổi pool xác minh."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if worker_mode is not None and worker_mode not in (WORKER_MODE_THREAD, WORKER_MODE_PROCESS):
+            message = f"Loại pool không hợp lệ: {worker_mode}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if (verify_workers is not None and verify_workers < 1) or (max_inflight_chunks is not None and max_inflight_chunks < 1):
+            message = "Số worker và số phần đang xử lý phải lớn hơn 0."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if worker_mode is not None:
+            self.worker_mode = worker_mode
+        if verify_workers is not None:
+            self.verify_workers = verify_workers
+        if max_inflight_chunks is not None:
+            self.max_inflight_chunks = max_inflight_chunks
+        message = f"Đã đặt pool xác minh: {self.worker_mode}, {self.verify_workers} worker, tối đa {self.max_inflight_chunks} phần mỗi kết nối"
+        self.activity_log.append(message)
+        return True, message
+
+    def _start_executor(self):
+        if self.worker_mode == WORKER_MODE_PROCESS:
+            self.executor = ProcessPoolExecutor(max_workers=self.verify_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.verify_workers)
+
+    def _stop_executor(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _start_server_task(self):
+        while self.running:
+            try:
+                conn, addr = self.server_socket.accept()
+                self.activity_log.append(f"Đã chấp nhận kết nối từ {addr}")
+                client_thread = threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True)
+                client_thread.start()
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            except Exception as e:
+                if self.running:
+                    self.activity_log.append(f"Lỗi chấp nhận kết nối: {e}", level=LOG_ERROR)
+        self.activity_log.append("Server đã dừng.")
+
+    def _start_async_server(self, port):
+        # asyncio chỉ cần cho chế độ này; import muộn để CLI và chế độ luồng khởi động nhanh
+        import asyncio
+        started = threading.Event()
+        errors = []
+
+        def run_loop():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                server = loop.run_until_complete(
+                    asyncio.start_server(self._handle_async_client, '', port, backlog=self.max_connections)
+                )
+            except Exception as e:
+                errors.append(e)
+                loop.close()
+                started.set()
+                return
+            # _stop_async_server xóa self.async_server trước khi vòng lặp dừng, nên giữ tham chiếu riêng
+            self.async_server = server
+            self.async_loop = loop
+            started.set()
+            try:
+                loop.run_forever()
+            finally:
+                server.close()
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                loop.close()
+                self.activity_log.append("Server asyncio đã dừng.")
+
+        # Phần xử lý gói là mã đồng bộ (RSA, chờ pool giải mã, ghi file) nên chạy trong pool luồng riêng,
+        # vòng lặp sự kiện chỉ đọc/ghi socket
+        self.handler_executor = ThreadPoolExecutor(max_workers=max(4, self.verify_workers * 2))
+        self._start_executor()
+        threading.Thread(target=run_loop, daemon=True).start()
+        started.wait()
+        if errors:
+            self._stop_executor()
+            self.handler_executor.shutdown(wait=False)
+            self.handler_executor = None
+            message = f"Lỗi khởi động server: {errors[0]}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.running = True
+        message = f"Server (asyncio) đang lắng nghe tại cổng {port}, tối đa {self.max_connections} kết nối..."
+        self.activity_log.append(message)
+        return True, message
+
+    def _stop_async_server(self):
+        loop = self.async_loop
+        self.async_loop = None
+        self.async_server = None
+        loop.call_soon_threadsafe(loop.stop)
+        if self.handler_executor:
+            self.handler_executor.shutdown(wait=False, cancel_futures=True)
+            self.handler_executor = None
+
+    async def _handle_async_client(self, reader, writer):
+        import asyncio
+        addr = writer.get_extra_info('peername')
+        if len(self.client_sessions) >= self.max_connections:
+            # Vượt giới hạn kết nối: trả lời lỗi ngay thay vì nhận thêm việc
+            writer.write(self._reply_bytes({"type": "handshake", "status": "ERROR", "message": "Server đang quá tải, vui lòng thử lại sau."}))
+            await writer.drain()
+            writer.close()
+            self.activity_log.append(f"Từ chối kết nối từ {addr}: đã đạt {self.max_connections} kết nối")
+            return
+        self.activity_log.append(f"Đã chấp nhận kết nối từ {addr}")
+        loop = asyncio.get_running_loop()
+        replies = _ReplyBuffer()
+        pending = deque()
+        self._open_session(addr)
+        read_task = None
+        try:
+            while True:
+                read_task = asyncio.ensure_future(async_receive_data_packet(reader))
+                if pending:
+                    done, _ = await asyncio.wait({read_task}, timeout=0.001)
+                    if not done:
+                        # Chưa có gói mới: áp dụng các phần đang chờ (việc đọc vẫn tiếp tục) để gửi ACK
+                        await loop.run_in_executor(self.handler_executor, self._flush_pending, replies, addr, pending)
+                        data = replies.take()
+                        if data:
+                            writer.write(data)
+                            await writer.drain()
+                data_packet = await read_task
+                if not data_packet:
+                    break
+                # Gói tiếp theo chỉ được đọc khi gói hiện tại xử lý xong: bên gửi bị chặn bởi TCP khi xử lý chậm
+                keep_open = await loop.run_in_executor(self.handler_executor, self._handle_packet, replies, addr, data_packet, pending)
+                data = replies.take()
+                if data:
+                    writer.write(data)
+                    await writer.drain()
+                if not keep_open:
+                    break
+        except (ConnectionError, OSError):
+            self.activity_log.append(f"Kết nối với {addr} đã đóng.")
+        except asyncio.CancelledError:
+            # stop_server hủy mọi tác vụ của vòng lặp: kết thúc bình thường để asyncio không in traceback
+            # (StreamReaderProtocol gọi task.exception() trên tác vụ xử lý kết nối đã bị hủy)
+            self.activity_log.append(f"Đóng kết nối với {addr} do server dừng.")
+        finally:
+            if read_task is not None and not read_task.done():
+                read_task.cancel()
+            writer.close()
+            self._close_session(addr)
+
+    def _reply_bytes(self, data_dict):
+        replies = _ReplyBuffer()
+        send_data_packet(replies, data_dict)
+        return replies.take()
+
+    def handle_client(self, conn, addr):
+        self._open_session(addr)
+        pending = deque()  # Các phần đã giao cho pool, chờ áp dụng theo thứ tự
+        try:
+            while True:
+                if pending and not select.select([conn], [], [], 0)[0]:
+                    # Chưa có gói mới: áp dụng các phần đang chờ để gửi ACK, Người gửi có thể đang chờ cửa sổ
+                    self._flush_pending(conn, addr, pending)
+                data_packet = receive_data_packet(conn)
+                if not data_packet:
+                    break
+                if not self._handle_packet(conn, addr, data_packet, pending):
+                    break
+        except socket.error:
+            self.activity_log.append(f"Kết nối với {addr} đã đóng.")
+        finally:
+            conn.close()
+            self._close_session(addr)
+
+    def _open_session(self, addr):
+        self.client_sessions[addr] = {
+            "session_key": None,
+            "session_iv": None,
+            "cipher_suite": None,
+            "receiving_files": {}
+        }
+
+    def _close_session(self, addr):
+        if addr in self.client_sessions:
+            for file_id in list(self.client_sessions[addr]["receiving_files"]):
+                # Mất kết nối giữa chừng: giữ file tạm và nhật ký để Người gửi tiếp tục sau
+                self._discard_file(addr, file_id, keep_progress=True)
+            del self.client_sessions[addr]
+
+    def _flush_pending(self, conn, addr, pending):
+        while pending:
+            self._apply_chunk(conn, addr, *pending.popleft())
+
+    def _handle_packet(self, conn, addr, data_packet, pending):
+        # Xử lý một gói đã nhận; conn chỉ cần có sendall(). Trả về False nếu phải đóng kết nối.
+        packet_type = data_packet.get("type")
+        # Áp dụng các phần đã xử lý xong; gói điều khiển phải chờ mọi phần trước nó
+        while pending and (packet_type != "file_chunk" or pending[0][1] is None or pending[0][1].done()):
+            self._apply_chunk(conn, addr, *pending.popleft())
+        if packet_type == "handshake":
+            message = data_packet.get("message")
+            if message == "Hello!":
+                wire_format = negotiate_wire_format(data_packet.get("wire_formats"))
+                # Báo lại các bộ mã hóa hai bên cùng hỗ trợ; Người gửi chọn và ký lựa chọn trong key_exchange
+                offered_suites = data_packet.get("cipher_suites") or [CIPHER_SUITE_3DES_CBC]
+                cipher_suites = [name for name in SUPPORTED_CIPHER_SUITES if name in offered_suites]
+                send_data_packet(conn, {"type": "handshake", "message": "Ready!", "wire_format": wire_format,
+                                        "cipher_suites": cipher_suites, "multiplex": True,
+                                        "key_exchange_modes": list(KEY_EXCHANGE_MODES),
+                                        "compression_codecs": list(COMPRESSION_CODECS),
+                                        "batch_version": BATCH_VERSION, "dedup": True, "delta_version": DELTA_VERSION})
+                self.activity_log.append(f"Handshake thành công với {addr} (định dạng khung: {wire_format})")
+            else:
+                send_data_packet(conn, {"type": "handshake", "status": "ERROR", "message": "Invalid handshake message."})
+                self.activity_log.append(f"Handshake thất bại với {addr}: Invalid handshake message")
+        elif packet_type == "key_exchange":
+            metadata = data_packet.get("metadata")
+            signed_metadata_b64 = data_packet.get("signed_metadata")
+            try:
+                signed_metadata = b64decode(signed_metadata_b64)
+                metadata_json = json.dumps(metadata, sort_keys=True).encode('utf-8')
+                if not verify_signature(compute_sha512(metadata_json), signed_metadata, self.sender_public_key):
+                    raise ValueError("Xác minh chữ ký metadata trao đổi khóa KHÔNG thành công.")
+                # Người gửi cũ không khai báo key_material_digest: các trường RSA không được gắn vào chữ ký
+                if "key_material_digest" in metadata and metadata["key_material_digest"] != key_material_digest(data_packet):
+                    raise ValueError("Khóa phiên đã mã hóa không khớp với metadata đã ký.")
+                # Người gửi cũ không khai báo cipher_suite: dùng 3DES-CBC như trước
+                suite = get_cipher_suite(metadata.get("cipher_suite", CIPHER_SUITE_3DES_CBC))
+                session_key, session_iv = self._unwrap_session_material(data_packet, metadata.get("key_exchange", KEY_EXCHANGE_SPLIT), suite)
+                if len(session_key) != suite.key_size:
+                    raise ValueError(f"Độ dài khóa phiên {len(session_key)} bytes không đúng với {suite.name}.")
+                self.client_sessions[addr]["session_key"] = session_key
+                self.client_sessions[addr]["session_iv"] = session_iv
+                self.client_sessions[addr]["cipher_suite"] = suite.name
+                send_data_packet(conn, {"status": "OK", "message": "Xác thực và trao đổi khóa phiên thành công.",
+                                        **self._issue_session_ticket(session_key, session_iv, suite.name)})
+                self.activity_log.append(f"Trao đổi khóa phiên thành công với {addr} (bộ mã hóa: {suite.name})")
+            except Exception as e:
+                send_data_packet(conn, {"status": "ERROR", "message": f"Lỗi trao đổi khóa: {e}"})
+                self.activity_log.append(f"Lỗi trao đổi khóa với {addr}: {e}", level=LOG_ERROR, addr=addr)
+                return False
+        elif packet_type == "session_resume":
+            # Nối lại phiên bằng vé: không có thao tác RSA nào. Lỗi không đóng kết nối,
+            # Người gửi chuyển sang trao đổi khóa đầy đủ.
+            try:
+                ticket = packet_bytes(data_packet, "session_ticket")
+                client_nonce = packet_bytes(data_packet, "nonce")
+                proof = packet_bytes(data_packet, "proof")
+                if not ticket or not client_nonce or not proof:
+                    raise ValueError("Thiếu vé phiên, nonce hoặc bằng chứng.")
+                try:
+                    ticket_state = open_session_ticket(self.ticket_key, ticket)
+                except ValueError:
+                    raise ValueError("Vé phiên không hợp lệ.")
+                if ticket_state.get("sender_key") != public_key_fingerprint(self.sender_public_key):
+                    raise ValueError("Vé phiên không thuộc khóa công khai người gửi hiện tại.")
+                state = self.session_cache.get(ticket_state.get("ticket_id"))
+                if state is None:
+                    raise ValueError("Vé phiên đã hết hạn hoặc đã được sử dụng.")
+                if not verify_session_proof(state["session_key"], proof, b"session-resume", ticket, client_nonce):
+                    raise ValueError("Bằng chứng khóa phiên KHÔNG hợp lệ.")
+                # Mỗi vé chỉ dùng một lần; kiểm tra bằng chứng trước để vé bị lộ không thể bị đốt bởi người khác
+                if self.session_cache.pop(ticket_state["ticket_id"]) is None:
+                    raise ValueError("Vé phiên đã được sử dụng.")
+                self.client_sessions[addr]["session_key"] = state["session_key"]
+                self.client_sessions[addr]["session_iv"] = state["session_iv"]
+                self.client_sessions[addr]["cipher_suite"] = state["cipher_suite"]
+                send_data_packet(conn, {
+                    "status": "OK",
+                    "message": "Nối lại phiên thành công.",
+                    "proof": b64encode(session_proof(state["session_key"], b"session-resumed", ticket, client_nonce)).decode('utf-8'),
+                    **self._issue_session_ticket(state["session_key"], state["session_iv"], state["cipher_suite"])
+                })
+                self.activity_log.append(f"Nối lại phiên với {addr} bằng vé phiên (bộ mã hóa: {state['cipher_suite']})")
+            except Exception as e:
+                send_data_packet(conn, {"status": "ERROR", "message": f"Không thể nối lại phiên: {e}"})
+                self.activity_log.append(f"Không thể nối lại phiên với {addr}: {e}")
+        # Các trả lời liên quan tới file đều kèm file_id để Người gửi ghép kênh nhiều file trên một kết nối
+        elif packet_type == "delta_request":
+            file_id = data_packet.get("file_id")
+            try:
+                if self.client_sessions[addr]["session_key"] is None:
+                    raise ValueError("Khóa phiên chưa được thiết lập cho client này.")
+                reply = {"file_id": file_id, "status": "OK"}
+                content_hash = data_packet.get(CONTENT_HASH_FIELD)
+                content_path = self._content_path(content_hash) if content_hash is not None else None
+                if content_path and os.path.isfile(content_path) and os.path.getsize(content_path) == data_packet.get("file_size"):
+                    # Đã có đúng nội dung này: Người gửi gửi file_init bình thường và được liên kết từ kho
+                    reply["have_content"] = True
+                else:
+                    base = self._delta_base(data_packet.get("filename"), data_packet.get("base_sha512"))
+                    if base is not None:
+                        reply.update(self._seal_delta_base(addr, file_id, base))
+                        self.activity_log.append(f"Gửi chữ ký {len(base['weak'])} khối của bản cũ '{data_packet.get('filename')}' cho {addr}",
+                                                 addr=addr, file_id=file_id)
+                send_data_packet(conn, reply)
+            except Exception as e:
+                send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": f"Lỗi chuẩn bị phần khác biệt: {e}"})
+                self.activity_log.append(f"Lỗi chuẩn bị phần khác biệt '{file_id}' cho {addr}: {e}", level=LOG_ERROR, addr=addr, file_id=file_id)
+        elif packet_type == "file_init":
+            metadata = data_packet.get("metadata")
+            signed_metadata_b64 = data_packet.get("signed_metadata")
+            file_id = metadata.get("file_id")
+            if not file_id:
+                send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": "Gói khởi tạo file không hợp lệ: thiếu file_id."})
+                self.activity_log.append(f"Lỗi khởi tạo file từ {addr}: Thiếu file_id", level=LOG_ERROR)
+                return True
+            try:
+                signed_metadata = b64decode(signed_metadata_b64)
+                metadata_json = json.dumps(metadata, sort_keys=True).encode('utf-8')
+                if not verify_signature(compute_sha512(metadata_json), signed_metadata, self.sender_public_key):
+                    raise ValueError("Xác minh chữ ký metadata file tổng quát KHÔNG thành công.")
+                file_size = int(metadata["file_size"])
+                num_parts = int(metadata["num_parts"])
+                # Người gửi cũ không gửi chunk_size: suy ra từ số phần như cách chia trước đây
+                chunk_size = int(metadata.get("chunk_size") or -(-file_size // num_parts))
+                if file_size < 0 or num_parts < 1 or num_parts != max(1, -(-file_size // max(1, chunk_size))):
+                    raise ValueError("Kích thước file, kích thước phần và số phần không khớp nhau.")
+                if chunk_size > MAX_CHUNK_SIZE:
+                    raise ValueError(f"Kích thước phần {chunk_size} vượt quá giới hạn {MAX_CHUNK_SIZE} bytes.")
+                # Người gửi cũ không khai báo auth_mode: mỗi phần có chữ ký riêng
+                auth_mode = metadata.get("auth_mode", AUTH_MODE_PER_CHUNK)
+                if auth_mode not in AUTH_MODES:
+                    raise ValueError(f"Chế độ xác thực không được hỗ trợ: {auth_mode}")
+                # Người gửi cũ không khai báo compression: các phần không được nén
+                compression = metadata.get("compression", COMPRESSION_NONE)
+                get_compression_codec(compression)
+                # Lô nhiều file: nội dung các file nối liền, được tách ra thư mục cùng tên khi hoàn tất
+                batch_files = self._check_batch(metadata["batch"], file_size) if "batch" in metadata else None
+                # Phần khác biệt: file_size là tổng các đoạn mới, bản mới được dựng lại từ bản cũ trong kho khi hoàn tất
+                delta_base_path = self._check_delta(metadata["delta"], file_size) if "delta" in metadata else None
+                save_path = self._save_path(metadata["filename"])
+                content_hash = metadata.get(CONTENT_HASH_FIELD) if batch_files is None else None
+                if content_hash is not None:
+                    self._content_path(content_hash)
+                    if self._link_from_store(content_hash, file_size, save_path):
+                        if file_id in self.client_sessions[addr]["receiving_files"]:
+                            self._discard_file(addr, file_id)
+                        FILES.inc(1, "received", "dedup")
+                        send_data_packet(conn, {"file_id": file_id, "status": "OK", "deduplicated": True,
+                                                "message": f"File '{metadata['filename']}' đã có sẵn và đã được lưu, không cần gửi."})
+                        self.activity_log.append(f"File '{metadata['filename']}' (ID: {file_id}) từ {addr} đã có trong kho nội dung, lưu vào {save_path} mà không cần nhận phần nào.",
+                                                 addr=addr, file_id=file_id)
+                        return True
+                # Cửa sổ không thuộc metadata đã ký: có thể khác nhau giữa các lần tiếp tục cùng một file
+                window = data_packet.get("window")
+                window = max(1, min(int(window), MAX_SEND_WINDOW)) if window else None
+                if file_id in self.client_sessions[addr]["receiving_files"]:
+                    self._discard_file(addr, file_id)
+                # File tạm và nhật ký được đặt tên theo file_id và hash của metadata đã ký: chỉ đúng lần gửi
+                # này (cùng metadata, cùng chữ ký của người gửi) mới tiếp tục được phần đã nhận.
+                metadata_hash = compute_sha512(metadata_json).hex()
+                transfer_key = compute_sha512(file_id.encode('utf-8'), metadata_hash.encode('utf-8')).hex()[:16]
+                temp_path = os.path.join(self.save_dir, f".{os.path.basename(save_path)}.{transfer_key}.part")
+                journal_path = temp_path + ".journal"
+                with self.transfers_lock:
+                    if temp_path in self.active_transfers:
+                        # Thường là kết nối cũ của Người gửi chưa được phát hiện đã đóng
+                        raise BlockingIOError("File đang được nhận trên một kết nối khác, hãy thử lại sau.")
+                    self.active_transfers.add(temp_path)
+                temp_file = journal_file = delta_base = None
+                try:
+                    # Mở sẵn bản cũ: nếu nó bị thay bằng file mới (đổi tên) trong lúc nhận thì vẫn đọc được nội dung cũ
+                    delta_base = open(delta_base_path, "rb") if delta_base_path else None
+                    received, leaf_hashes = self._load_journal(journal_path, metadata_hash, num_parts) if os.path.exists(temp_path) else (set(), {})
+                    if received:
+                        temp_file = open(temp_path, "r+b")
+                        journal_file = open(journal_path, "a", encoding="utf-8")
+                    else:
+                        # Cấp phát trước file tạm đúng kích thước file đã ký, mỗi phần được ghi vào đúng vị trí
+                        temp_file = open(temp_path, "w+b")
+                        temp_file.truncate(file_size)
+                        journal_file = open(journal_path, "w", encoding="utf-8")
+                        journal_file.write(json.dumps({"file_id": file_id, "metadata_hash": metadata_hash}) + "\n")
+                        journal_file.flush()
+                except Exception:
+                    for handle in (temp_file, journal_file, delta_base):
+                        if handle is not None:
+                            handle.close()
+                    with self.transfers_lock:
+                        self.active_transfers.discard(temp_path)
+                    raise
+                self.client_sessions[addr]["receiving_files"][file_id] = {
+                    "metadata": metadata,
+                    "chunk_size": chunk_size,
+                    "save_path": save_path,
+                    "temp_path": temp_path,
+                    "temp_file": temp_file,
+                    "journal_path": journal_path,
+                    "journal_file": journal_file,
+                    "received": received,
+                    "dispatched": set(received),
+                    "received_parts": len(received),
+                    "auth_mode": auth_mode,
+                    "compression": compression,
+                    "batch": batch_files,
+                    "delta": metadata["delta"] if delta_base_path else None,
+                    "delta_base": delta_base,
+                    "content_hash": metadata["delta"]["target_sha512"] if delta_base_path else content_hash,
+                    # Hash của từng phần, dùng để dựng lại cây Merkle và đối chiếu manifest khi nhận file_end_signal
+                    "leaf_hashes": [leaf_hashes.get(i) for i in range(num_parts)],
+                    "manifest": None,
+                    # Cửa sổ trượt (None với Người gửi cũ): mỗi phần được ACK/NACK, phần lỗi được gửi lại
+                    "window": window,
+                    "failures": {},
+                    "next_expected": 0,
+                    "started_at": time.perf_counter()
+                }
+                reply = {"file_id": file_id, "status": "OK", "message": "Thông tin file khởi tạo đã được nhận và xác minh."}
+                if window:
+                    reply["window"] = window
+                if received:
+                    reply["missing_parts"] = [i for i in range(num_parts) if i not in received]
+                    self.activity_log.append(f"Tiếp tục nhận file '{metadata['filename']}' (ID: {file_id}) từ {addr}: đã có {len(received)}/{num_parts} phần", addr=addr, file_id=file_id)
+                else:
+                    compression_note = f" (nén: {compression})" if compression != COMPRESSION_NONE else ""
+                    if batch_files is not None:
+                        kind_note = f" (lô {len(batch_files)} file)"
+                    elif delta_base_path:
+                        kind_note = f" (phần khác biệt: {file_size}/{metadata['delta']['target_size']} bytes mới)"
+                    else:
+                        kind_note = ""
+                    self.activity_log.append(f"Khởi tạo file '{metadata['filename']}' (ID: {file_id}) từ {addr}{kind_note}{compression_note}", addr=addr, file_id=file_id)
+                send_data_packet(conn, reply)
+            except BlockingIOError as e:
+                send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "retry": True, "message": f"Lỗi khởi tạo file: {e}"})
+                self.activity_log.append(f"Lỗi khởi tạo file '{file_id}' từ {addr}: {e}", level=LOG_ERROR, addr=addr, file_id=file_id)
+            except Exception as e:
+                send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": f"Lỗi khởi tạo file: {e}"})
+                self.activity_log.append(f"Lỗi khởi tạo file '{file_id}' từ {addr}: {e}", level=LOG_ERROR, addr=addr, file_id=file_id)
+                self._discard_file(addr, file_id)
+        elif packet_type == "file_chunk":
+            # Giao việc cho pool rồi đọc gói tiếp theo; kết quả được áp dụng theo đúng thứ tự nhận
+            pending.append((data_packet, self._dispatch_chunk(addr, data_packet)))
+            if len(pending) >= self.max_inflight_chunks:
+                self._apply_chunk(conn, addr, *pending.popleft())
+        elif packet_type == "file_end_signal":
+            file_id = data_packet.get("file_id")
+            if file_id in self.client_sessions[addr]["receiving_files"]:
+                file_info = self.client_sessions[addr]["receiving_files"][file_id]
+                total_parts = file_info["metadata"]["num_parts"]
+                received_parts = file_info["received_parts"]
+                if received_parts == total_parts:
+                    try:
+                        if file_info["auth_mode"] == AUTH_MODE_MERKLE:
+                            self._verify_merkle_root(file_info, data_packet)
+                        # Người gửi cũ không gửi manifest
+                        if data_packet.get("manifest"):
+                            file_info["manifest"] = self._open_manifest(addr, file_id, file_info, data_packet)
+                    except Exception as e:
+                        message = f"Xác thực file '{file_info['metadata']['filename']}' thất bại: {e}"
+                        send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": message})
+                        self.activity_log.append(message)
+                        self._discard_file(addr, file_id)
+                        return True
+                    success, message = self.complete_file_reception(conn, addr, file_id)
+                    self.activity_log.append(message)
+                else:
+                    message = f"File '{file_info['metadata']['filename']}' bị thiếu phần."
+                    send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": message})
+                    self.activity_log.append(message)
+                    self._discard_file(addr, file_id)
+            else:
+                message = f"File ID {file_id} không tồn tại hoặc đã xử lý."
+                send_data_packet(conn, {"file_id": file_id, "status": "OK", "message": message})
+                self.activity_log.append(message)
+        return True
+
+    def _unwrap_session_material(self, data_packet, key_exchange_mode, suite):
+        # Lấy lại khóa phiên và IV theo chế độ trao đổi khóa Người gửi đã ký; split cần hai lần giải mã RSA,
+        # hai chế độ OAEP chỉ cần một.
+        if key_exchange_mode not in KEY_EXCHANGE_MODES:
+            raise ValueError(f"Chế độ trao đổi khóa không được hỗ trợ: {key_exchange_mode}")
+        if key_exchange_mode == KEY_EXCHANGE_SPLIT:
+            session_key = rsa_decrypt(b64decode(data_packet.get("encrypted_session_key")), self.receiver_private_key)
+            session_iv = rsa_decrypt(b64decode(data_packet.get("encrypted_session_iv")), self.receiver_private_key)
+            if session_key is None or session_iv is None:
+                raise ValueError("Không thể giải mã khóa phiên hoặc IV.")
+            return session_key, session_iv
+        material = rsa_oaep_decrypt(b64decode(data_packet.get("encrypted_session_material")), self.receiver_private_key)
+        if material is None:
+            raise ValueError("Không thể giải mã dữ liệu khóa phiên.")
+        if key_exchange_mode == KEY_EXCHANGE_OAEP_WRAP:
+            if len(material) != suite.key_size + suite.iv_size:
+                raise ValueError(f"Dữ liệu khóa phiên dài {len(material)} bytes, không đúng với {suite.name}.")
+            return material[:suite.key_size], material[suite.key_size:]
+        if len(material) != SESSION_SECRET_SIZE:
+            raise ValueError(f"Bí mật phiên dài {len(material)} bytes (dự kiến {SESSION_SECRET_SIZE}).")
+        return derive_session_material(material, suite.key_size, suite.iv_size, suite.name.encode('utf-8'))
+
+    def _issue_session_ticket(self, session_key, session_iv, cipher_suite):
+        # Trạng thái phiên nằm trong bộ đệm; vé chỉ mang ticket_id và dấu vân tay khóa người gửi, được mã hóa
+        # bằng khóa vé nên Người gửi không đọc/sửa được và không dùng được với khóa người gửi khác.
+        ticket_id = get_random_bytes(16).hex()
+        expires_at = self.session_cache.put(ticket_id, {
+            "session_key": session_key,
+            "session_iv": session_iv,
+            "cipher_suite": cipher_suite
+        })
+        ticket = seal_session_ticket(self.ticket_key, {
+            "ticket_id": ticket_id,
+            "sender_key": public_key_fingerprint(self.sender_public_key),
+            "expires_at": expires_at
+        })
+        return {"session_ticket": b64encode(ticket).decode('utf-8'), "ticket_lifetime": self.session_cache.ttl}
+
+    def _save_path(self, filename):
+        # Chỉ giữ tên file, không cho phép đường dẫn thoát khỏi thư mục lưu
+        safe_name = os.path.basename(str(filename).replace("\\", "/"))
+        if safe_name in ("", ".", ".."):
+            raise ValueError(f"Tên file không hợp lệ: {filename}")
+        os.makedirs(self.save_dir, exist_ok=True)
+        return os.path.join(self.save_dir, safe_name)
+
+    def _check_batch(self, batch, file_size):
+        # Danh sách file của lô nằm trong metadata đã ký; trả về [(đường dẫn, kích thước), ...]
+        if not isinstance(batch, dict) or batch.get("version") != BATCH_VERSION:
+            raise ValueError("Phiên bản lô không được hỗ trợ.")
+        entries = batch.get("files")
+        if not isinstance(entries, list) or not 0 < len(entries) <= MAX_BATCH_FILES:
+            raise ValueError(f"Lô phải có từ 1 tới {MAX_BATCH_FILES} file.")
+        files, seen = [], set()
+        for entry in entries:
+            path = batch_relative_path(entry.get("path", ""))
+            size = entry.get("size")
+            if not isinstance(size, int) or size < 0:
+                raise ValueError(f"Kích thước file '{path}' trong lô không hợp lệ.")
+            if path in seen:
+                raise ValueError(f"File trùng tên trong lô: {path}")
+            seen.add(path)
+            files.append((path, size))
+        if sum(size for _, size in files) != file_size:
+            raise ValueError("Tổng kích thước các file trong lô không khớp với kích thước đã ký.")
+        return files
+
+    def _unpack_batch(self, temp_path, batch_dir, files):
+        # Tách file tạm (nội dung các file nối liền) thành từng file trong batch_dir. Mỗi file được ghi qua
+        # file tạm rồi đổi tên, nên lỗi ở một file không để lại file ghi dở và không ảnh hưởng các file khác.
+        report = []
+        offset = 0
+        with open(temp_path, "rb") as source:
+            for path, size in files:
+                target = os.path.join(batch_dir, *path.split("/"))
+                partial = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.unpack")
+                try:
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(partial, "wb") as f:
+                        self._copy_range(source, f, offset, size)
+                    os.replace(partial, target)
+                    report.append({"path": path, "size": size, "status": "OK"})
+                except OSError as e:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                    report.append({"path": path, "size": size, "status": "ERROR", "message": str(e)})
+                    self.activity_log.append(f"Không lưu được file '{path}' của lô: {e}", level=LOG_ERROR)
+                offset += size
+        return report
+
+    def _copy_range(self, source, target, offset, size):
+        # copy_file_range chép trong nhân hệ điều hành, không đi qua bộ nhớ của Python
+        if hasattr(os, "copy_file_range"):
+            try:
+                while size > 0:
+                    copied = os.copy_file_range(source.fileno(), target.fileno(), size, offset)
+                    if copied == 0:
+                        raise OSError("File tạm của lô ngắn hơn kích thước đã khai báo.")
+                    offset += copied
+                    size -= copied
+                return
+            except OSError as e:
+                if e.errno is None:
+                    raise
+                # Hệ thống file không hỗ trợ: chép tiếp phần còn lại bằng read/write
+        source.seek(offset)
+        while size > 0:
+            data = source.read(min(size, BUFFER_SIZE))
+            if not data:
+                raise OSError("File tạm của lô ngắn hơn kích thước đã khai báo.")
+            target.write(data)
+            size -= len(data)
+        # Lần chép sau có thể dùng copy_file_range (ghi thẳng vào fd) nên không để dữ liệu nằm lại trong bộ đệm
+        target.flush()
+
+    def _write_at(self, temp_file, offset, data):
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(temp_file.fileno(), view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            temp_file.seek(offset)
+            temp_file.write(data)
+
+    def _discard_file(self, addr, file_id, keep_progress=False):
+        file_info = self.client_sessions[addr]["receiving_files"].pop(file_id, None)
+        if file_info is None:
+            return
+        for handle in ("temp_file", "journal_file", "delta_base"):
+            if file_info.get(handle):
+                file_info[handle].close()
+        with self.transfers_lock:
+            self.active_transfers.discard(file_info["temp_path"])
+        FILES.inc(1, "received", "interrupted" if keep_progress else "error")
+        if keep_progress and file_info["received_parts"] > 0:
+            self.activity_log.append(f"Giữ {file_info['received_parts']}/{file_info['metadata']['num_parts']} phần của file '{file_info['metadata']['filename']}' để tiếp tục sau.")
+            return
+        for path in (file_info["temp_path"], file_info["journal_path"]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load_journal(self, journal_path, metadata_hash, num_parts):
+        # Đọc nhật ký tiến độ: dòng đầu là metadata_hash, mỗi dòng sau là một phần đã xác minh và đã ghi.
+        # Dòng cuối có thể bị cắt dở nếu tiến trình dừng đột ngột, khi đó bỏ qua.
+        received, leaf_hashes = set(), {}
+        try:
+            with open(journal_path, encoding="utf-8") as journal:
+                header = json.loads(journal.readline())
+                if header.get("metadata_hash") != metadata_hash:
+                    return set(), {}
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    part_number = entry.get("part")
+                    if isinstance(part_number, int) and 0 <= part_number < num_parts:
+                        received.add(part_number)
+                        leaf_hashes[part_number] = b64decode(entry["hash"])
+        except (OSError, ValueError, KeyError):
+            return set(), {}
+        return received, leaf_hashes
+
+    def _record_progress(self, file_info, part_number, part_hash):
+        # Chỉ ghi sau khi phần đã được xác minh và ghi vào file tạm
+        file_info["journal_file"].write(json.dumps({"part": part_number, "hash": b64encode(part_hash).decode('utf-8')}) + "\n")
+        file_info["journal_file"].flush()
+
+    def _purge_stale_transfers(self):
+        # Xóa file tạm/nhật ký của các lần nhận dở dang quá RESUME_JOURNAL_TTL
+        if not os.path.isdir(self.save_dir):
+            return
+        cutoff = time.time() - RESUME_JOURNAL_TTL
+        for name in os.listdir(self.save_dir):
+            # .link/.part.store: bản liên kết tạm tới kho nội dung còn sót lại khi tiến trình bị dừng giữa chừng
+            if name.startswith(".") and name.endswith((".part", ".part.journal", ".link", ".part" + CONTENT_STORE_DIR)):
+                path = os.path.join(self.save_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+        # Nội dung trong kho không còn file đã nhận nào liên kết tới (đã bị xóa hoặc ghi đè) thì bỏ khỏi kho
+        store_dir = os.path.join(self.save_dir, CONTENT_STORE_DIR)
+        for root, _, names in os.walk(store_dir):
+            for name in names:
+                if name.endswith(MANIFEST_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_nlink <= 1:
+                        os.remove(path)
+                        if os.path.exists(path + MANIFEST_SUFFIX):
+                            os.remove(path + MANIFEST_SUFFIX)
+                except OSError:
+                    pass
+
+    def _check_chunk(self, addr, file_info, part_number, seen_parts):
+        if self.client_sessions[addr]["session_key"] is None:
+            raise ValueError("Khóa phiên chưa được thiết lập cho client này.")
+        if not isinstance(part_number, int) or not 0 <= part_number < file_info["metadata"]["num_parts"]:
+            raise ValueError(f"Số thứ tự phần {part_number} nằm ngoài phạm vi.")
+        if part_number in seen_parts:
+            raise ValueError(f"Phần {part_number} đã được nhận trước đó.")
+
+    def _dispatch_chunk(self, addr, data_packet):
+        # Trả về future của pool, hoặc None nếu phần này không hợp lệ (lỗi được báo khi áp dụng theo thứ tự)
+        file_id = data_packet.get("file_id")
+        part_number = data_packet.get("part_number")
+        file_info = self.client_sessions[addr]["receiving_files"].get(file_id)
+        if file_info is None:
+            return None
+        try:
+            self._check_chunk(addr, file_info, part_number, file_info["dispatched"])
+        except ValueError:
+            return None
+        file_info["dispatched"].add(part_number)
+        # Khung nhị phân trả về bytes/memoryview, gói JSON trả về chuỗi base64
+        iv_bytes = packet_bytes(data_packet, "iv")
+        cipher_bytes = packet_bytes(data_packet, "cipher")
+        received_hash_bytes = packet_bytes(data_packet, "hash")
+        signature_bytes = packet_bytes(data_packet, "signature")
+        if self.executor is None:
+            self._start_executor()
+        public_key = self.sender_public_key
+        if self.worker_mode == WORKER_MODE_PROCESS:
+            # Dữ liệu gửi sang tiến trình khác phải pickle được
+            public_key = public_key.export_key(format='DER')
+            cipher_bytes = bytes(cipher_bytes)
+        return self.executor.submit(
+            verify_and_decrypt_chunk, self.client_sessions[addr]["session_key"], self.client_sessions[addr]["cipher_suite"],
+            public_key, file_info["auth_mode"], file_id, part_number, iv_bytes, cipher_bytes, received_hash_bytes, signature_bytes,
+            file_info["compression"], part_length(file_info["metadata"]["file_size"], file_info["chunk_size"], part_number)
+        )
+
+    def _apply_chunk(self, conn, addr, data_packet, future):
+        file_id = data_packet.get("file_id")
+        part_number = data_packet.get("part_number")
+        if file_id not in self.client_sessions[addr]["receiving_files"]:
+            send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": "File ID không hợp lệ hoặc chưa khởi tạo."})
+            self.activity_log.append(f"Lỗi xử lý phần file từ {addr}: File ID {file_id} không hợp lệ", level=LOG_ERROR, addr=addr)
+            return
+        current_file_info = self.client_sessions[addr]["receiving_files"][file_id]
+        window = current_file_info["window"]
+        if window and part_number in current_file_info["received"]:
+            # Phần gửi lại đã có: chỉ xác nhận lại
+            self._send_ack(conn, file_id, current_file_info, part_number)
+            return
+        try:
+            self._check_chunk(addr, current_file_info, part_number, current_file_info["received"])
+            if future is None:
+                raise ValueError(f"Phần {part_number} không hợp lệ.")
+            re_computed_hash, decrypted_chunk = future.result()
+            # Với chế độ Merkle, chữ ký trên gốc cây được xác minh một lần khi nhận file_end_signal
+            current_file_info["leaf_hashes"][part_number] = re_computed_hash
+            chunk_size = current_file_info["chunk_size"]
+            expected_length = part_length(current_file_info["metadata"]["file_size"], chunk_size, part_number)
+            if len(decrypted_chunk) != expected_length:
+                raise ValueError(f"Kích thước phần {part_number} không đúng: {len(decrypted_chunk)} (dự kiến {expected_length}).")
+            offset = part_number * chunk_size
+            self._write_at(current_file_info["temp_file"], offset, decrypted_chunk)
+            current_file_info["received"].add(part_number)
+            current_file_info["received_parts"] += 1
+            self._record_progress(current_file_info, part_number, re_computed_hash)
+            CHUNKS.inc(1, "received", "ok")
+            self.activity_log.append(f"Đã nhận phần {part_number + 1}/{current_file_info['metadata']['num_parts']} của file '{current_file_info['metadata']['filename']}' từ {addr}",
+                                     level=LOG_DEBUG, addr=addr, file_id=file_id)
+            if window:
+                self._send_ack(conn, file_id, current_file_info, part_number)
+        except Exception as e:
+            failures = current_file_info["failures"]
+            if window and future is not None and failures.get(part_number, 0) < MAX_PART_RETRANSMITS:
+                # Chỉ phần này bị từ chối: yêu cầu gửi lại, các phần đã nhận được giữ nguyên
+                failures[part_number] = failures.get(part_number, 0) + 1
+                CHUNKS.inc(1, "received", "nack")
+                current_file_info["dispatched"].discard(part_number)
+                send_data_packet(conn, {"type": "nack", "file_id": file_id, "part": part_number, "status": "ERROR",
+                                        "message": f"Lỗi xử lý phần file {part_number}: {e}"})
+                self.activity_log.append(f"Phần {part_number} của file '{file_id}' từ {addr} bị từ chối ({e}), yêu cầu gửi lại (lần {failures[part_number]}/{MAX_PART_RETRANSMITS})",
+                                     level=LOG_WARNING, addr=addr, file_id=file_id)
+                return
+            CHUNKS.inc(1, "received", "error")
+            send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": f"Lỗi xử lý phần file {part_number}: {e}"})
+            self.activity_log.append(f"Lỗi xử lý phần {part_number} của file '{file_id}' từ {addr}: {e}", level=LOG_ERROR, addr=addr, file_id=file_id)
+            self._discard_file(addr, file_id)
+
+    def _send_ack(self, conn, file_id, file_info, part_number):
+        # ACK chọn lọc cho phần vừa nhận, kèm ACK tích lũy: mọi phần trước "cumulative" đều đã nhận
+        received = file_info["received"]
+        while file_info["next_expected"] in received:
+            file_info["next_expected"] += 1
+        send_data_packet(conn, {"type": "ack", "file_id": file_id, "status": "OK", "part": part_number,
+                                "cumulative": file_info["next_expected"]})
+
+    def _verify_merkle_root(self, file_info, end_packet):
+        root = packet_bytes(end_packet, "merkle_root")
+        root_signature = packet_bytes(end_packet, "root_signature")
+        if not root or not root_signature:
+            raise ValueError("Thiếu gốc Merkle hoặc chữ ký gốc Merkle.")
+        # Dựng lại cây từ hash của các phần đã nhận: khớp gốc đã ký nghĩa là mọi phần đều đúng của người gửi
+        if merkle_root(build_merkle_tree(file_info["leaf_hashes"])) != root:
+            raise ValueError("Gốc Merkle KHÔNG khớp với các phần đã nhận.")
+        if not verify_signature(root, root_signature, self.sender_public_key):
+            raise ValueError("Chữ ký gốc Merkle KHÔNG hợp lệ. Xác thực thất bại.")
+
+    def _open_manifest(self, addr, file_id, file_info, end_packet):
+        # Giải mã manifest bằng khóa phiên, xác minh chữ ký của người gửi và đối chiếu với chính các phần đã nhận
+        suite = get_cipher_suite(self.client_sessions[addr]["cipher_suite"])
+        try:
+            manifest_json = suite.decrypt(packet_bytes(end_packet, "manifest"), self.client_sessions[addr]["session_key"],
+                                          packet_bytes(end_packet, "manifest_iv"), chunk_aad(file_id, "manifest"))
+            signed_manifest = json.loads(bytes(manifest_json))
+        except ValueError as e:
+            raise ValueError(f"Không giải mã được manifest: {e}")
+        if not verify_transfer_manifest(signed_manifest, self.sender_public_key):
+            raise ValueError("Chữ ký manifest KHÔNG hợp lệ.")
+        manifest = signed_manifest["manifest"]
+        if manifest.get("file_id") != file_id or manifest.get("metadata") != file_info["metadata"]:
+            raise ValueError("Manifest không khớp với metadata đã ký của file.")
+        parts = manifest.get("parts") or []
+        if len(parts) != len(file_info["leaf_hashes"]):
+            raise ValueError(f"Manifest có {len(parts)} phần, file có {len(file_info['leaf_hashes'])} phần.")
+        for i, entry in enumerate(parts):
+            if entry.get("part") != i or b64decode(entry.get("hash", "")) != file_info["leaf_hashes"][i]:
+                raise ValueError(f"Hash phần {i} trong manifest không khớp với phần đã nhận.")
+        return signed_manifest
+
+    def _store_manifest(self, save_path, signed_manifest, temp_path):
+        # Ghi qua file tạm rồi đổi tên để không bao giờ có manifest ghi dở nằm cạnh file.
+        # File tạm đặt theo temp_path của lần nhận để hai lần nhận cùng tên file không ghi đè lẫn nhau.
+        manifest_path = save_path + MANIFEST_SUFFIX
+        temp_manifest_path = temp_path + MANIFEST_SUFFIX
+        with open(temp_manifest_path, "w", encoding="utf-8") as f:
+            json.dump(signed_manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_manifest_path, manifest_path)
+        return manifest_path
+
+    def _content_path(self, content_hash):
+        if not isinstance(content_hash, str) or len(content_hash) != 128 or content_hash.strip("0123456789abcdef"):
+            raise ValueError("Hash nội dung không hợp lệ (cần SHA-512 dạng hex chữ thường).")
+        return os.path.join(self.save_dir, CONTENT_STORE_DIR, content_hash[:2], content_hash)
+
+    def _link_into_place(self, source, target, staged_path):
+        # Liên kết cứng: cùng nội dung không tốn thêm chỗ trên đĩa; hệ thống file không hỗ trợ thì chép.
+        # Tạo ở staged_path (chưa tồn tại) rồi đổi tên nguyên tử, không bao giờ ghi vào file đang có.
+        try:
+            os.link(source, staged_path)
+        except FileExistsError:
+            raise
+        except OSError:
+            shutil.copyfile(source, staged_path)
+        os.replace(staged_path, target)
+        # rename không làm gì khi hai đường dẫn đã là liên kết cứng của cùng một file
+        if os.path.lexists(staged_path):
+            os.remove(staged_path)
+
+    def _add_to_store(self, content_hash, save_path, temp_path):
+        # Lỗi ở kho không làm hỏng lần nhận: file đã được lưu, chỉ là lần sau phải truyền lại
+        content_path = self._content_path(content_hash)
+        staged_path = temp_path + CONTENT_STORE_DIR
+        try:
+            os.makedirs(os.path.dirname(content_path), exist_ok=True)
+            self._link_into_place(save_path, content_path, staged_path)
+            if os.path.exists(save_path + MANIFEST_SUFFIX):
+                self._link_into_place(save_path + MANIFEST_SUFFIX, content_path + MANIFEST_SUFFIX, staged_path)
+            elif os.path.exists(content_path + MANIFEST_SUFFIX):
+                os.remove(content_path + MANIFEST_SUFFIX)
+        except OSError as e:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            self.activity_log.append(f"Không thể thêm file '{save_path}' vào kho nội dung: {e}", level=LOG_WARNING)
+
+    def _delta_base(self, filename, base_hash=None):
+        # Bản cũ để so khớp: nội dung trong kho theo hash Người gửi đã gửi lần trước, nếu không có thì file cùng tên.
+        # Bản cũ tìm theo tên được đưa vào kho, để file_init (có hash bản cũ đã ký) tìm lại đúng nội dung này.
+        candidates = []
+        if base_hash:
+            candidates.append(self._content_path(base_hash))
+        if filename:
+            candidates.append(self._save_path(filename))
+        for path in candidates:
+            if not os.path.isfile(path) or not 0 < os.path.getsize(path) <= DELTA_MAX_FILE_SIZE:
+                continue
+            with open(path, "rb") as f:
+                base_size = os.fstat(f.fileno()).st_size
+                block_size = delta_block_size(base_size)
+                weak, strong, content_hash = delta_signatures(f, block_size)
+            if path != self._content_path(content_hash):
+                if path == candidates[0] and base_hash:
+                    continue  # Nội dung trong kho đã bị sửa
+                temp_path = os.path.join(self.save_dir, f".{os.path.basename(path)}.{get_random_bytes(8).hex()}.part")
+                self._add_to_store(content_hash, path, temp_path)
+            return {"base_sha512": content_hash, "base_size": base_size, "block_size": block_size,
+                    "weak": weak, "strong": b64encode(strong).decode('utf-8')}
+        return None
+
+    def _seal_delta_base(self, addr, file_id, base):
+        # Chữ ký chứa hash từng khối bản rõ nên được mã hóa bằng khóa phiên như manifest
+        session = self.client_sessions[addr]
+        suite = get_cipher_suite(session["cipher_suite"])
+        iv = get_random_bytes(suite.iv_size)
+        sealed = suite.encrypt(json.dumps(base).encode('utf-8'), session["session_key"], iv, chunk_aad(file_id, "delta_base"))
+        return {"base_iv": b64encode(iv).decode('utf-8'), "base": b64encode(sealed).decode('utf-8')}
+
+    def _check_delta(self, delta, file_size):
+        # Các đoạn của bản mới nằm trong metadata đã ký; trả về đường dẫn bản cũ trong kho
+        if not isinstance(delta, dict) or delta.get("version") != DELTA_VERSION:
+            raise ValueError("Phiên bản gửi phần khác biệt không được hỗ trợ.")
+        base_path = self._content_path(delta.get("base_sha512"))
+        self._content_path(delta.get("target_sha512"))
+        base_size, ops = delta.get("base_size"), delta.get("ops")
+        if not os.path.isfile(base_path) or os.path.getsize(base_path) != base_size:
+            raise ValueError("Không còn bản cũ để dựng lại file.")
+        if not isinstance(ops, list):
+            raise ValueError("Danh sách đoạn của bản mới không hợp lệ.")
+        literal_size = target_size = 0
+        for op in ops:
+            if not isinstance(op, list) or len(op) != 2 or not isinstance(op[1], int) or op[1] <= 0:
+                raise ValueError("Danh sách đoạn của bản mới không hợp lệ.")
+            offset, length = op
+            if offset is None:
+                literal_size += length
+            elif not isinstance(offset, int) or offset < 0 or offset + length > base_size:
+                raise ValueError("Đoạn chép từ bản cũ nằm ngoài bản cũ.")
+            target_size += length
+        if literal_size != file_size or target_size != delta.get("target_size"):
+            raise ValueError("Các đoạn của bản mới không khớp với kích thước đã ký.")
+        return base_path
+
+    def _apply_delta(self, base_file, literal_path, target_path, ops):
+        with open(literal_path, "rb") as literal, open(target_path, "wb") as target:
+            literal_offset = 0
+            for offset, length in ops:
+                if offset is None:
+                    self._copy_range(literal, target, literal_offset, length)
+                    literal_offset += length
+                else:
+                    self._copy_range(base_file, target, offset, length)
+
+    def _link_from_store(self, content_hash, file_size, save_path):
+        # Trả về True nếu đã lưu save_path (và manifest) từ kho; False thì nhận file như bình thường
+        content_path = self._content_path(content_hash)
+        staged_path = os.path.join(self.save_dir, f".{os.path.basename(save_path)}.{get_random_bytes(8).hex()}.link")
+        try:
+            if not os.path.isfile(content_path) or os.path.getsize(content_path) != file_size:
+                return False
+            # File đã nhận là liên kết cứng tới kho: nếu bị sửa tại chỗ thì nội dung trong kho cũng đổi theo,
+            # nên băm lại (đọc đĩa cục bộ, rẻ hơn nhiều so với truyền và giải mã) trước khi dùng
+            with open(content_path, "rb") as f:
+                if stream_sha512(f) != content_hash:
+                    os.remove(content_path)
+                    if os.path.exists(content_path + MANIFEST_SUFFIX):
+                        os.remove(content_path + MANIFEST_SUFFIX)
+                    self.activity_log.append(f"Nội dung {content_hash[:16]}... trong kho đã bị sửa, đã xóa khỏi kho.", level=LOG_WARNING)
+                    return False
+            self._link_into_place(content_path, save_path, staged_path)
+            if os.path.exists(content_path + MANIFEST_SUFFIX):
+                # Manifest của lần nhận trước: chữ ký của người gửi trên đúng các byte này
+                self._link_into_place(content_path + MANIFEST_SUFFIX, save_path + MANIFEST_SUFFIX, staged_path)
+            elif os.path.exists(save_path + MANIFEST_SUFFIX):
+                os.remove(save_path + MANIFEST_SUFFIX)
+            return True
+        except OSError as e:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            self.activity_log.append(f"Không thể lấy file '{save_path}' từ kho nội dung, nhận lại từ đầu: {e}", level=LOG_WARNING)
+            return False
+
+    def complete_file_reception(self, conn, addr, file_id):
+        if file_id not in self.client_sessions[addr]["receiving_files"]:
+            send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": "File không tồn tại để hoàn tất."})
+            message = f"Không tìm thấy file ID {file_id} để hoàn tất từ {addr}."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        file_info = self.client_sessions[addr]["receiving_files"][file_id]
+        metadata = file_info["metadata"]
+        filename = metadata["filename"]
+        total_parts = metadata["num_parts"]
+        received_parts = file_info["received_parts"]
+        try:
+            if received_parts < total_parts:
+                message = f"Thiếu các phần file. Dự kiến {total_parts}, đã nhận {received_parts}."
+                send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": message})
+                self._discard_file(addr, file_id)
+                self.activity_log.append(message, level=LOG_ERROR)
+                return False, message
+            save_path = file_info["save_path"]
+            temp_file = file_info.pop("temp_file")
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            temp_file.close()
+            reply = {"file_id": file_id, "status": "OK", "message": f"File '{filename}' đã được nhận và lưu."}
+            if file_info["batch"] is not None:
+                # Lô: tách ra thư mục cùng tên, báo trạng thái từng file cho Người gửi
+                if os.path.isfile(save_path):
+                    raise ValueError(f"Đã có file trùng tên với thư mục lô: {save_path}")
+                report = self._unpack_batch(file_info["temp_path"], save_path, file_info["batch"])
+                os.remove(file_info["temp_path"])
+                saved = sum(1 for entry in report if entry["status"] == "OK")
+                reply["files"] = report
+                reply["message"] = f"Lô '{filename}': đã lưu {saved}/{len(report)} file."
+            elif file_info["delta"] is not None:
+                # Dựng bản mới từ bản cũ và các đoạn mới, chỉ thay file đích khi khớp SHA-512 đã ký của bản mới
+                rebuilt_path = file_info["temp_path"] + ".delta"
+                try:
+                    self._apply_delta(file_info["delta_base"], file_info["temp_path"], rebuilt_path, file_info["delta"]["ops"])
+                    with open(rebuilt_path, "rb") as f:
+                        if stream_sha512(f) != file_info["delta"]["target_sha512"]:
+                            raise ValueError("Bản dựng lại không khớp với hash đã ký của bản mới.")
+                    os.replace(rebuilt_path, save_path)
+                finally:
+                    if os.path.exists(rebuilt_path):
+                        os.remove(rebuilt_path)
+                file_info.pop("delta_base").close()
+                os.remove(file_info["temp_path"])
+            else:
+                if file_info["content_hash"] is not None:
+                    # Hash nội dung quyết định file nào được liên kết sau này: chỉ đưa vào kho khi khớp nội dung đã nhận
+                    with open(file_info["temp_path"], "rb") as f:
+                        if stream_sha512(f) != file_info["content_hash"]:
+                            raise ValueError("Nội dung file không khớp với hash nội dung đã ký.")
+                # Đổi tên nguyên tử: file đích chỉ xuất hiện khi đã nhận và xác minh đầy đủ
+                os.replace(file_info["temp_path"], save_path)
+            if file_info["manifest"] is not None:
+                self._store_manifest(save_path, file_info["manifest"], file_info["temp_path"])
+            elif os.path.exists(save_path + MANIFEST_SUFFIX):
+                # Manifest cũ của file cùng tên không còn đúng với nội dung mới
+                os.remove(save_path + MANIFEST_SUFFIX)
+            if file_info["content_hash"] is not None:
+                self._add_to_store(file_info["content_hash"], save_path, file_info["temp_path"])
+            file_info.pop("journal_file").close()
+            os.remove(file_info["journal_path"])
+            with self.transfers_lock:
+                self.active_transfers.discard(file_info["temp_path"])
+            FILES.inc(1, "received", "ok")
+            FILE_BYTES.inc(metadata["file_size"], "received")
+            FILE_TRANSFER_SECONDS.observe(time.perf_counter() - file_info["started_at"], "received")
+            message = f"File '{filename}' (ID: {file_id}) đã được nhận, giải mã và lưu vào: {save_path}"
+            send_data_packet(conn, reply)
+            del self.client_sessions[addr]["receiving_files"][file_id]
+            self.activity_log.append(message)
+            return True, message
+        except Exception as e:
+            message = f"Lỗi hoàn tất truyền file '{filename}' (ID: {file_id}): {e}"
+            send_data_packet(conn, {"file_id": file_id, "status": "ERROR", "message": message})
+            self._discard_file(addr, file_id)
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
@@ -1,304 +1,196 @@
-import socket
 import os
-import json
-import time
-from datetime import datetime
-from base64 import b64encode, b64decode
-import threading
-from flask import Flask, render_template, request, jsonify
-import math
-
-from utils import (
-    load_rsa_private_key, load_rsa_public_key,
-    compute_sha512,
-    encrypt_triple_des, rsa_encrypt,
-    sign_data, send_data_packet, receive_data_packet,
-    BUFFER_SIZE, RSA_KEY_SIZE, get_random_bytes, generate_rsa_keys
-)
-
-app = Flask(__name__, template_folder='templates')
-app.config['UPLOAD_FOLDER'] = 'keys'
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-class SenderApp:
-    def __init__(self):
-        self.contract_filepath = None
-        self.sender_private_key = None
-        self.receiver_public_key = None
-        self.socket_conn = None
-        self.session_key = None
-        self.session_iv = None
-        self.is_connected = False
-        self.activity_log = []  # Danh sách để lưu nhật ký hoạt động
-
-    def generate_keys(self, output_dir):
-        private_path = os.path.join(output_dir, "sender_private_key.pem")
-        public_path = os.path.join(output_dir, "sender_public_key.pem")
-        try:
-            generate_rsa_keys(private_path, public_path)
-            message = f"Đã tạo khóa tại: {output_dir}"
-            self.activity_log.append(message)
-            return True, message
-        except Exception as e:
-            message = f"Lỗi khi tạo khóa: {e}"
-            self.activity_log.append(message)
-            return False, message
-
-    def load_sender_private_key(self, file_path):
-        key = load_rsa_private_key(file_path)
-        if key:
-            self.sender_private_key = key
-            message = f"Đã tải khóa riêng tư người gửi từ: {file_path}"
-            self.activity_log.append(message)
-            return True, message
-        message = f"Không thể tải khóa riêng tư người gửi từ: {file_path}"
-        self.activity_log.append(message)
-        return False, message
-
-    def load_receiver_public_key(self, file_path):
-        key = load_rsa_public_key(file_path)
-        if key:
-            self.receiver_public_key = key
-            message = f"Đã tải khóa công khai người nhận từ: {file_path}"
-            self.activity_log.append(message)
-            return True, message
-        message = f"Không thể tải khóa công khai người nhận từ: {file_path}"
-        self.activity_log.append(message)
-        return False, message
-
-    def connect_to_receiver(self, host, port):
-        if self.is_connected:
-            message = "Đã kết nối rồi."
-            self.activity_log.append(message)
-            return False, message
-        if not self.sender_private_key or not self.receiver_public_key:
-            message = "Thiếu khóa RSA để kết nối."
-            self.activity_log.append(message)
-            return False, message
-        try:
-            self.socket_conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket_conn.connect((host, port))
-            self.is_connected = True
-            success, message = self._perform_handshake_and_key_exchange()
-            if not success:
-                self.is_connected = False
-                if self.socket_conn:
-                    self.socket_conn.close()
-                self.activity_log.append(message)
-                return False, message
-            message = f"Đã kết nối đến Người nhận tại {host}:{port}"
-            self.activity_log.append(message)
-            return True, message
-        except ConnectionRefusedError:
-            self.is_connected = False
-            message = "Người nhận không hoạt động hoặc địa chỉ/cổng không đúng."
-            self.activity_log.append(message)
-            return False, message
-        except Exception as e:
-            self.is_connected = False
-            message = f"Lỗi khi kết nối: {e}"
-            self.activity_log.append(message)
-            return False, message
-
-    def _perform_handshake_and_key_exchange(self):
-        try:
-            send_data_packet(self.socket_conn, {"type": "handshake", "message": "Hello!"})
-            response = receive_data_packet(self.socket_conn)
-            if response and response.get("type") == "handshake" and response.get("message") == "Ready!":
-                pass
-            else:
-                message = f"Handshake thất bại: {response}"
-                self.activity_log.append(message)
-                raise Exception(message)
-
-            self.session_key = get_random_bytes(24)
-            self.session_iv = get_random_bytes(8)
-            encrypted_session_key = rsa_encrypt(self.session_key, self.receiver_public_key)
-            encrypted_session_iv = rsa_encrypt(self.session_iv, self.receiver_public_key)
-
-            if encrypted_session_key is None or encrypted_session_iv is None:
-                message = "Không thể mã hóa khóa phiên hoặc IV bằng RSA."
-                self.activity_log.append(message)
-                raise ValueError(message)
-
-            metadata = {
-                "timestamp": datetime.now().isoformat(),
-                "sender": "SenderApp",
-                "key_size": len(self.session_key) * 8,
-                "iv_size": len(self.session_iv) * 8
-            }
-            metadata_json = json.dumps(metadata, sort_keys=True).encode('utf-8')
-            signature_on_metadata = sign_data(compute_sha512(metadata_json), self.sender_private_key)
-
-            send_data_packet(self.socket_conn, {
-                "type": "key_exchange",
-                "encrypted_session_key": b64encode(encrypted_session_key).decode('utf-8'),
-                "encrypted_session_iv": b64encode(encrypted_session_iv).decode('utf-8'),
-                "metadata": metadata,
-                "signed_metadata": b64encode(signature_on_metadata).decode('utf-8')
-            })
-
-            response = receive_data_packet(self.socket_conn)
-            if response and response.get("status") == "OK":
-                message = "Xác thực và trao đổi khóa phiên thành công!"
-                self.activity_log.append(message)
-                return True, message
-            else:
-                message = f"Trao đổi khóa phiên thất bại: {response.get('message', 'Không rõ lỗi')}"
-                self.activity_log.append(message)
-                raise Exception(message)
-        except Exception as e:
-            self.is_connected = False
-            if self.socket_conn:
-                self.socket_conn.close()
-            message = f"Lỗi trong quá trình Handshake hoặc Trao đổi Khóa: {e}"
-            self.activity_log.append(message)
-            return False, message
-
-    def send_contract_file(self, file_content, file_name):
-        if not self.is_connected or not self.socket_conn:
-            message = "Chưa kết nối đến Người nhận."
-            self.activity_log.append(message)
-            return False, message
-        if not self.sender_private_key or not self.receiver_public_key or not self.session_key:
-            message = "Thiếu khóa RSA hoặc khóa phiên."
-            self.activity_log.append(message)
-            return False, message
-        try:
-            file_size = len(file_content)
-            FORCED_NUM_PARTS = 3
-            if file_size == 0:
-                num_parts = 1
-                effective_chunk_size = 0
-            elif file_size < FORCED_NUM_PARTS:
-                num_parts = file_size
-                effective_chunk_size = 1
-            else:
-                num_parts = FORCED_NUM_PARTS
-                effective_chunk_size = (file_size + FORCED_NUM_PARTS - 1) // FORCED_NUM_PARTS
-            file_id = f"{file_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            file_metadata = {
-                "file_id": file_id,
-                "filename": file_name,
-                "file_size": file_size,
-                "num_parts": num_parts,
-                "timestamp": datetime.now().isoformat()
-            }
-            file_metadata_json = json.dumps(file_metadata, sort_keys=True).encode('utf-8')
-            signature_on_file_metadata = sign_data(compute_sha512(file_metadata_json), self.sender_private_key)
-            send_data_packet(self.socket_conn, {
-                "type": "file_init",
-                "metadata": file_metadata,
-                "signed_metadata": b64encode(signature_on_file_metadata).decode('utf-8')
-            })
-            response = receive_data_packet(self.socket_conn)
-            if response and response.get("status") == "OK":
-                pass
-            else:
-                message = f"Người nhận báo lỗi khi khởi tạo file: {response.get('message', 'Không rõ lỗi')}"
-                self.activity_log.append(message)
-                raise Exception(message)
-            for i in range(num_parts):
-                start_byte = i * effective_chunk_size
-                end_byte = min((i + 1) * effective_chunk_size, file_size)
-                chunk = file_content[start_byte:end_byte]
-                chunk_iv = get_random_bytes(8)
-                encrypted_chunk = encrypt_triple_des(chunk, self.session_key, chunk_iv)
-                hash_input = chunk_iv + encrypted_chunk
-                chunk_hash = compute_sha512(hash_input)
-                chunk_signature = sign_data(chunk_hash, self.sender_private_key)
-
-                # THÊM CÁC DÒNG NÀY ĐỂ GHI HASH VÀ CHỮ KÝ VÀO LOG
-                self.activity_log.append(f"----- GỬI PHẦN FILE {i+1} -----")
-                self.activity_log.append(f"Hash (Base64) phần {i+1}: {b64encode(chunk_hash).decode('utf-8')}")
-                self.activity_log.append(f"Chữ ký (Base64) phần {i+1}: {b64encode(chunk_signature).decode('utf-8')}")
-                self.activity_log.append(f"---------------------------------")
-                # KẾT THÚC PHẦN THÊM MỚI
-
-                send_data_packet(self.socket_conn, {
-                    "type": "file_chunk",
-                    "file_id": file_id,
-                    "part_number": i,
-                    "total_parts": num_parts,
-                    "iv": b64encode(chunk_iv).decode('utf-8'),
-                    "cipher": b64encode(encrypted_chunk).decode('utf-8'),
-                    "hash": b64encode(chunk_hash).decode('utf-8'),
-                    "signature": b64encode(chunk_signature).decode('utf-8')
-                })
-                time.sleep(0.01)
-            send_data_packet(self.socket_conn, {"type": "file_end_signal", "file_id": file_id})
-            final_response = receive_data_packet(self.socket_conn)
-            if final_response and final_response.get("status") == "OK":
-                message = f"File hợp đồng '{file_name}' (ID: {file_id}) đã được gửi và xác minh thành công!"
-                self.activity_log.append(message)
-                return True, message
-            else:
-                message = f"Người nhận báo lỗi khi hoàn tất file: {final_response.get('message', 'Không rõ lỗi')}"
-                self.activity_log.append(message)
-                return False, message
-        except Exception as e:
-            message = f"Lỗi trong quá trình gửi hợp đồng file: {e}"
-            self.activity_log.append(message)
-            return False, message
-
-sender = SenderApp()
-
-@app.route('/')
-def index():
-    return render_template('sender.html')
-
-@app.route('/generate_keys', methods=['POST'])
-def generate_keys():
-    success, message = sender.generate_keys(app.config['UPLOAD_FOLDER'])
-    return jsonify({'success': success, 'message': message})
-
-@app.route('/load_sender_private_key', methods=['POST'])
-def load_sender_private_key():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'message': 'Không có file được tải lên'})
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'Không có file được chọn'})
-    filename = os.path.join(app.config['UPLOAD_FOLDER'], 'sender_private_key.pem')
-    file.save(filename)
-    success, message = sender.load_sender_private_key(filename)
-    return jsonify({'success': success, 'message': message})
-
-@app.route('/load_receiver_public_key', methods=['POST'])
-def load_receiver_public_key():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'message': 'Không có file được tải lên'})
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'Không có file được chọn'})
-    filename = os.path.join(app.config['UPLOAD_FOLDER'], 'receiver_public_key.pem')
-    file.save(filename)
-    success, message = sender.load_receiver_public_key(filename)
-    return jsonify({'success': success, 'message': message})
-
-@app.route('/connect', methods=['POST'])
-def connect():
-    data = request.get_json()
-    host = data.get('host')
-    port = int(data.get('port'))
-    success, message = sender.connect_to_receiver(host, port)
-    return jsonify({'success': success, 'message': message})
-
-@app.route('/send_file', methods=['POST'])
-def send_file():
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'message': 'Không có file được tải lên'})
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'success': False, 'message': 'Không có file được chọn'})
-    file_content = file.read()
-    file_name = file.filename
-    success, message = sender.send_contract_file(file_content, file_name)
-    return jsonify({'success': success, 'message': message})
-
-@app.route('/get_logs', methods=['GET'])
-def get_logs():
-    return jsonify({'logs': sender.activity_log})
+from metrics import REGISTRY, CONTENT_TYPE, Gauge
+from utils import COMPRESSION_NONE, GET_LOGS_LIMIT, activity_log_events
+from sender_engine import SenderEngine
+
+# Tên cũ của lớp xử lý, giữ lại cho mã đang import từ sender_app
+SenderApp = SenderEngine
+
+KEYS_FOLDER = 'keys'
+
+def _register_gauges(sender):
+    # Giá trị đọc lại mỗi lần xuất /metrics. create_app có thể được gọi nhiều lần trong một tiến trình,
+    # gauge luôn trỏ tới engine của ứng dụng tạo sau cùng
+    for name in ('contract_receiver_connections', 'contract_sending_files'):
+        REGISTRY.unregister(name)
+    Gauge("contract_receiver_connections", "Số kết nối bền đang mở tới các Người nhận",
+          lambda: sum(len(pool.connections) for pool in list(sender.receiver_pools.values())))
+    Gauge("contract_sending_files", "Số file đang gửi",
+          lambda: sum(pool.active_transfers() for pool in list(sender.receiver_pools.values())))
+
+def create_app(sender=None):
+    """Tạo giao diện web Flask bọc quanh một SenderEngine (tạo mới nếu không truyền vào)."""
+    # Flask chỉ được import khi thực sự dựng giao diện web; CLI và mã dùng engine không cần tới
+    from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+    sender = sender or SenderEngine()
+    app = Flask(__name__, template_folder='templates')
+    app.config['UPLOAD_FOLDER'] = KEYS_FOLDER
+    app.sender = sender
+    _register_gauges(sender)
+
+    @app.route('/')
+    def index():
+        return render_template('sender.html')
+
+    @app.route('/generate_keys', methods=['POST'])
+    def generate_keys():
+        success, message = sender.generate_keys(app.config['UPLOAD_FOLDER'])
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/load_sender_private_key', methods=['POST'])
+    def load_sender_private_key():
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Không có file được tải lên'})
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'message': 'Không có file được chọn'})
+        filename = os.path.join(app.config['UPLOAD_FOLDER'], 'sender_private_key.pem')
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        file.save(filename)
+        success, message = sender.load_sender_private_key(filename)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/load_receiver_public_key', methods=['POST'])
+    def load_receiver_public_key():
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Không có file được tải lên'})
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'message': 'Không có file được chọn'})
+        filename = os.path.join(app.config['UPLOAD_FOLDER'], 'receiver_public_key.pem')
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        file.save(filename)
+        success, message = sender.load_receiver_public_key(filename)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/connect', methods=['POST'])
+    def connect():
+        data = request.get_json()
+        host = data.get('host')
+        port = int(data.get('port'))
+        success, message = sender.connect_to_receiver(host, port)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_chunking', methods=['POST'])
+    def set_chunking():
+        data = request.get_json()
+        mode = data.get('mode')
+        chunk_size = int(data['chunk_size']) if data.get('chunk_size') else None
+        num_parts = int(data['num_parts']) if data.get('num_parts') else None
+        success, message = sender.set_chunking_policy(mode, chunk_size, num_parts)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_pipeline', methods=['POST'])
+    def set_pipeline():
+        data = request.get_json()
+        crypto_workers = int(data['crypto_workers']) if data.get('crypto_workers') else None
+        pipeline_depth = int(data['pipeline_depth']) if data.get('pipeline_depth') else None
+        send_window = int(data['send_window']) if data.get('send_window') not in (None, '') else None
+        success, message = sender.set_pipeline_settings(crypto_workers, pipeline_depth, send_window)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_pool', methods=['POST'])
+    def set_pool():
+        data = request.get_json()
+        max_connections = int(data['max_connections']) if data.get('max_connections') else None
+        max_transfers = int(data['max_transfers']) if data.get('max_transfers') else None
+        success, message = sender.set_pool_settings(max_connections, max_transfers)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/disconnect', methods=['POST'])
+    def disconnect():
+        success, message = sender.disconnect()
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_key_exchange', methods=['POST'])
+    def set_key_exchange():
+        data = request.get_json()
+        success, message = sender.set_key_exchange_mode(data.get('mode'))
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_cipher_suites', methods=['POST'])
+    def set_cipher_suites():
+        data = request.get_json()
+        cipher_suites = data.get('cipher_suites') or []
+        if isinstance(cipher_suites, str):
+            cipher_suites = [name.strip() for name in cipher_suites.split(',') if name.strip()]
+        success, message = sender.set_cipher_suites(cipher_suites)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_compression', methods=['POST'])
+    def set_compression():
+        data = request.get_json()
+        success, message = sender.set_compression(data.get('compression') or COMPRESSION_NONE)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_dedup', methods=['POST'])
+    def set_dedup():
+        data = request.get_json()
+        success, message = sender.set_dedup(data.get('enabled', True))
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/set_delta', methods=['POST'])
+    def set_delta():
+        data = request.get_json()
+        success, message = sender.set_delta(data.get('enabled', False))
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/send_file', methods=['POST'])
+    def send_file():
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': 'Không có file được tải lên'})
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'message': 'Không có file được chọn'})
+        # Đọc trực tiếp từ luồng upload của Werkzeug thay vì file.read() toàn bộ vào bộ nhớ
+        file_name = file.filename
+        success, message = sender.send_contract_stream(file.stream, file_name)
+        return jsonify({'success': success, 'message': message})
+
+    @app.route('/send_batch', methods=['POST'])
+    def send_batch():
+        # Thư mục chọn từ trình duyệt (webkitdirectory): tên file tải lên là đường dẫn "thư_mục/con/file"
+        files = [file for file in request.files.getlist('files') if file.filename]
+        if not files:
+            return jsonify({'success': False, 'message': 'Không có file được chọn'})
+        names = [file.filename.replace('\\', '/') for file in files]
+        batch_name = request.form.get('batch_name', '').strip()
+        if not batch_name:
+            # Mặc định lấy thư mục gốc chung và bỏ nó khỏi đường dẫn từng file
+            roots = {name.split('/', 1)[0] for name in names}
+            if len(roots) != 1 or not all('/' in name for name in names):
+                return jsonify({'success': False, 'message': 'Vui lòng nhập tên lô'})
+            batch_name = roots.pop()
+            names = [name.split('/', 1)[1] for name in names]
+        success, message, report = sender.send_contract_batch(
+            [(name, file.stream) for name, file in zip(names, files)], batch_name)
+        return jsonify({'success': success, 'message': message, 'files': report})
+
+    @app.route('/get_logs', methods=['GET'])
+    def get_logs():
+        # ?since=<seq>: chỉ trả về các mục mới hơn seq; "logs" vẫn là danh sách thông điệp như trước
+        since = request.args.get('since', default=0, type=int)
+        limit = min(request.args.get('limit', default=GET_LOGS_LIMIT, type=int), GET_LOGS_LIMIT)
+        entries, dropped = sender.activity_log.since(since, limit)
+        return jsonify({
+            'logs': [entry['message'] for entry in entries],
+            'entries': entries,
+            'last_seq': entries[-1]['seq'] if entries else sender.activity_log.last_seq,
+            'dropped': dropped
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    @app.route('/stream_logs', methods=['GET'])
+    def stream_logs():
+        # Server-Sent Events thay cho việc hỏi /get_logs định kỳ; EventSource tự gửi Last-Event-ID khi kết nối lại
+        since = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', default=0, type=int)
+        return Response(stream_with_context(activity_log_events(sender.activity_log, since)),
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000, debug=True)
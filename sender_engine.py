@@ -0,0 +1,1269 @@
+import socket
+import os
+import io
+import json
+import time
+from datetime import datetime
+from base64 import b64encode, b64decode
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from metrics import CHUNKS, FILES, FILE_BYTES, FILE_TRANSFER_SECONDS
+
+from utils import (
+    load_rsa_private_key, load_rsa_public_key,
+    compute_sha512, rsa_encrypt,
+    sign_data, send_data_packet, receive_data_packet,
+    STREAM_CHUNK_SIZE, get_random_bytes, generate_rsa_keys,
+    plan_chunks, part_length, CHUNK_MODE_AUTO, CHUNK_MODE_FIXED, MIN_CHUNK_SIZE,
+    send_binary_packet, negotiate_wire_format,
+    SUPPORTED_WIRE_FORMATS, WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY,
+    build_merkle_tree, merkle_root, merkle_proof, encode_merkle_proof,
+    AUTH_MODE_MERKLE, DEFAULT_AUTH_MODE,
+    DEFAULT_CRYPTO_WORKERS, DEFAULT_PIPELINE_DEPTH, DEFAULT_SEND_WINDOW,
+    SUPPORTED_CIPHER_SUITES, CIPHER_SUITES, get_cipher_suite, negotiate_cipher_suite,
+    chunk_digest, chunk_aad, session_proof, verify_session_proof, SESSION_TICKET_TTL,
+    rsa_oaep_encrypt, derive_session_material, KEY_EXCHANGE_MODES, KEY_EXCHANGE_SPLIT,
+    KEY_EXCHANGE_OAEP_WRAP, DEFAULT_KEY_EXCHANGE_MODE, SESSION_SECRET_SIZE, key_material_digest,
+    COMPRESSION_NONE, COMPRESSION_AUTO, COMPRESSION_CODECS, AUTO_COMPRESSION_CODECS, COMPRESSION_SAMPLE_SIZE,
+    COMPRESSION_MAX_RATIO, get_compression_codec, compression_ratio, compress_chunk,
+    MANIFEST_VERSION, MANIFEST_SUFFIX, sign_transfer_manifest, BATCH_VERSION, MAX_BATCH_FILES,
+    batch_relative_path, BatchReader, CONTENT_HASH_FIELD, stream_sha512,
+    DELTA_VERSION, DELTA_MAX_FILE_SIZE, DELTA_MAX_LITERAL_RATIO, compute_delta, ActivityLog, LOG_DEBUG, LOG_WARNING, LOG_ERROR
+)
+from collections import deque, OrderedDict
+
+# Nhóm kết nối tới mỗi Người nhận: số kết nối bền tối đa và số file gửi đồng thời tối đa
+DEFAULT_MAX_CONNECTIONS_PER_RECEIVER = 2
+DEFAULT_MAX_TRANSFERS_PER_RECEIVER = 4
+# Số vé phiên giữ lại cho mỗi Người nhận (mỗi vé chỉ dùng một lần)
+SESSION_TICKETS_PER_RECEIVER = 8
+# Số lần kết nối lại để tiếp tục một file bị ngắt giữa chừng, và thời gian chờ giữa các lần (nhân theo số lần thử)
+DEFAULT_RESUME_ATTEMPTS = 3
+RESUME_RETRY_DELAY = 1.0 # giây
+# Thư mục lưu manifest đã ký của các file đã gửi thành công
+SENT_MANIFEST_DIR = "sent_manifests"
+# Số hash nội dung file giữ lại (theo thiết bị, inode, kích thước, thời điểm sửa), tránh băm lại file gửi nhiều lần
+CONTENT_HASH_CACHE_SIZE = 4096
+
+class TransferInterrupted(Exception):
+    # Mất kết nối giữa chừng: có thể kết nối lại và chỉ gửi các phần Người nhận còn thiếu
+    pass
+
+class ReceiverConnection:
+    # Một kết nối bền tới Người nhận cùng phiên đã thương lượng trên kết nối đó. Nhiều file có thể
+    # gửi xen kẽ: send_lock giữ cho mỗi gói được ghi liền một khối, luồng đọc chuyển từng trả lời
+    # tới đúng file theo file_id.
+    def __init__(self, address, sock):
+        self.address = address
+        self.sock = sock
+        self.session_key = None
+        self.session_iv = None
+        self.wire_format = WIRE_FORMAT_JSON  # Định dạng khung đã thương lượng với Người nhận
+        self.cipher_suite = None  # Bộ mã hóa của phiên (xem utils.get_cipher_suite)
+        self.multiplex = False  # Người nhận có gắn file_id vào trả lời hay không
+        self.compression_codecs = []  # Codec nén Người nhận giải nén được
+        self.batch_version = None  # Phiên bản gửi theo lô Người nhận hỗ trợ (None: không hỗ trợ)
+        self.dedup = False  # Người nhận có kho nội dung, bỏ qua được file đã có
+        self.delta_version = None  # Phiên bản gửi phần khác biệt Người nhận hỗ trợ (None: không hỗ trợ)
+        self.alive = True
+        self.reader_running = False
+        self.active_transfers = 0
+        self.send_lock = threading.Lock()
+        self.waiters = {}  # file_id -> hàng đợi trả lời của file đó
+        self.waiters_lock = threading.Lock()
+
+    def start_reader(self):
+        self.reader_running = True
+        threading.Thread(target=self._read_replies, daemon=True).start()
+
+    def send_packet(self, data_dict):
+        with self.send_lock:
+            send_data_packet(self.sock, data_dict)
+
+    def send_binary_packet(self, data_dict, payload_key):
+        with self.send_lock:
+            send_binary_packet(self.sock, data_dict, payload_key=payload_key)
+
+    def register(self, file_id):
+        replies = queue.Queue()
+        with self.waiters_lock:
+            self.waiters[file_id] = replies
+            self.active_transfers += 1
+        return replies
+
+    def unregister(self, file_id):
+        with self.waiters_lock:
+            if self.waiters.pop(file_id, None) is not None:
+                self.active_transfers -= 1
+
+    def _read_replies(self):
+        try:
+            while True:
+                response = receive_data_packet(self.sock)
+                if response is None:
+                    return
+                with self.waiters_lock:
+                    replies = self.waiters.get(response.get("file_id"))
+                    if replies is None and "file_id" not in response and len(self.waiters) == 1:
+                        # Người nhận cũ không gắn file_id: chỉ ghép được khi có đúng một file đang gửi
+                        replies = next(iter(self.waiters.values()))
+                # Trả lời của file đã kết thúc (ví dụ lỗi cho các phần gửi sau khi file bị hủy) được bỏ qua
+                if replies is not None:
+                    replies.put(response)
+        finally:
+            self.alive = False
+            self.sock.close()
+            with self.waiters_lock:
+                for replies in self.waiters.values():
+                    replies.put({"status": "ERROR", "connection_lost": True, "message": "Mất kết nối tới Người nhận."})
+
+    def close(self):
+        self.alive = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        # Khi luồng đọc đang chạy, shutdown làm nó thoát và tự đóng socket
+        if not self.reader_running:
+            self.sock.close()
+
+class SendWindow:
+    # Cửa sổ trượt của một lần gửi file: các phần đã gửi nhưng chưa được ACK, kèm bản rõ của chúng
+    # (tối đa size phần) để mã hóa và gửi lại khi Người nhận báo NACK. size None: Người nhận không gửi ACK.
+    def __init__(self, size):
+        self.size = size
+        self.in_flight = {}  # part_number -> bản rõ của phần
+        self.retransmit = deque()
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def next_action(self, need_slot):
+        # Chờ việc tiếp theo cho luồng ghi: ("resend", (part_number, chunk)), ("send", None) khi cửa sổ còn chỗ,
+        # ("done", None) khi mọi phần đã được ACK (need_slot=False), hoặc ("stop", None) khi phải dừng.
+        with self.condition:
+            while True:
+                if self.stopped:
+                    return "stop", None
+                if self.retransmit:
+                    part_number = self.retransmit.popleft()
+                    return "resend", (part_number, self.in_flight[part_number])
+                if need_slot and (self.size is None or len(self.in_flight) < self.size):
+                    return "send", None
+                if not need_slot and not self.in_flight:
+                    return "done", None
+                self.condition.wait()
+
+    def sent(self, part_number, chunk):
+        if self.size is None:
+            return
+        with self.condition:
+            self.in_flight[part_number] = chunk
+
+    def ack(self, part_number, cumulative):
+        with self.condition:
+            self.in_flight.pop(part_number, None)
+            for acked in [p for p in self.in_flight if p < cumulative]:
+                del self.in_flight[acked]
+            self.condition.notify_all()
+
+    def nack(self, part_number):
+        with self.condition:
+            if part_number in self.in_flight:
+                self.retransmit.append(part_number)
+                self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+class ReceiverPool:
+    # Các kết nối bền tới một Người nhận; condition dùng để chờ khi đã đạt giới hạn
+    def __init__(self, address, max_connections, max_transfers):
+        self.address = address
+        self.max_connections = max_connections
+        self.max_transfers = max_transfers
+        self.connections = []
+        self.compression_codecs = []  # Theo handshake của kết nối đầu tiên, dùng khi chọn codec cho file
+        self.batch_version = None
+        self.dedup = False
+        self.delta_version = None
+        self.opening = 0  # Số kết nối đang được mở (ngoài khóa), đã giữ chỗ trong giới hạn kết nối và số file
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def active_transfers(self):
+        return sum(connection.active_transfers for connection in self.connections)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+            self.condition.notify_all()
+
+class SenderEngine:
+    def __init__(self, manifest_dir=SENT_MANIFEST_DIR):
+        self.manifest_dir = manifest_dir  # Thư mục lưu manifest đã ký của các file đã gửi
+        self.contract_filepath = None
+        self.sender_private_key = None
+        self.receiver_public_key = None
+        self.is_connected = False
+        self.activity_log = ActivityLog()  # Nhật ký hoạt động (vòng đệm, xem utils.ActivityLog)
+        # Nhóm kết nối bền theo địa chỉ Người nhận; mỗi kết nối giữ phiên đã thương lượng của nó
+        self.receiver_pools = {}
+        self.default_receiver = None  # Địa chỉ (host, port) kết nối gần nhất, dùng khi không chỉ định Người nhận
+        self.max_connections_per_receiver = DEFAULT_MAX_CONNECTIONS_PER_RECEIVER
+        self.max_transfers_per_receiver = DEFAULT_MAX_TRANSFERS_PER_RECEIVER
+        self.cipher_suites = list(SUPPORTED_CIPHER_SUITES)  # Thứ tự ưu tiên bộ mã hóa khi thương lượng
+        # Vé phiên theo địa chỉ Người nhận: kết nối lại bằng vé bỏ qua được trao đổi khóa RSA
+        self.session_resumption = True
+        self.key_exchange_mode = DEFAULT_KEY_EXCHANGE_MODE  # Cách bọc khóa phiên (xem utils.KEY_EXCHANGE_MODES)
+        self.session_tickets = {}
+        # Chính sách chia phần file (xem utils.plan_chunks)
+        self.chunk_mode = CHUNK_MODE_AUTO
+        self.chunk_size = STREAM_CHUNK_SIZE
+        self.target_parts = 3
+        self.link_throughput = None  # Thông lượng đo được (bytes/giây), làm mượt qua các lần gửi
+        self.auth_mode = DEFAULT_AUTH_MODE  # Chế độ xác thực các phần file (xem utils.AUTH_MODES)
+        # Pipeline gửi: các luồng mã hóa/băm/ký chuẩn bị trước các phần file trong khi luồng ghi gửi qua socket
+        self.crypto_workers = DEFAULT_CRYPTO_WORKERS
+        self.pipeline_depth = DEFAULT_PIPELINE_DEPTH  # Số phần đã chuẩn bị tối đa chờ gửi
+        self.compression = COMPRESSION_NONE  # Codec nén từng phần trước khi mã hóa, hoặc auto
+        self.send_window = DEFAULT_SEND_WINDOW  # Số phần chưa được ACK tối đa; 0 là gửi liên tục không chờ ACK
+        self.resume_attempts = DEFAULT_RESUME_ATTEMPTS
+        # Khai báo hash nội dung trong file_init để Người nhận bỏ qua file đã có (một lượt hỏi-đáp, không gửi phần nào)
+        self.dedup = True
+        self.content_hashes = OrderedDict()
+        self.content_hashes_lock = threading.Lock()
+        # Gửi phần khác biệt so với bản Người nhận đang có (tắt mặc định: thêm một lượt hỏi-đáp lấy chữ ký bản cũ).
+        # sent_versions nhớ hash nội dung của bản gửi gần nhất theo (Người nhận, tên file) để Người nhận tìm bản cũ theo hash.
+        self.delta = False
+        self.sent_versions = OrderedDict()
+
+    def generate_keys(self, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        private_path = os.path.join(output_dir, "sender_private_key.pem")
+        public_path = os.path.join(output_dir, "sender_public_key.pem")
+        try:
+            generate_rsa_keys(private_path, public_path)
+            message = f"Đã tạo khóa tại: {output_dir}"
+            self.activity_log.append(message)
+            return True, message
+        except Exception as e:
+            message = f"Lỗi khi tạo khóa: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+
+    def load_sender_private_key(self, file_path):
+        key = load_rsa_private_key(file_path)
+        if key:
+            self.sender_private_key = key
+            self.session_tickets = {}  # Vé cũ gắn với khóa người gửi trước đó
+            message = f"Đã tải khóa riêng tư người gửi từ: {file_path}"
+            self.activity_log.append(message)
+            return True, message
+        message = f"Không thể tải khóa riêng tư người gửi từ: {file_path}"
+        self.activity_log.append(message, level=LOG_ERROR)
+        return False, message
+
+    def load_receiver_public_key(self, file_path):
+        key = load_rsa_public_key(file_path)
+        if key:
+            self.receiver_public_key = key
+            self.session_tickets = {}
+            message = f"Đã tải khóa công khai người nhận từ: {file_path}"
+            self.activity_log.append(message)
+            return True, message
+        message = f"Không thể tải khóa công khai người nhận từ: {file_path}"
+        self.activity_log.append(message, level=LOG_ERROR)
+        return False, message
+
+    def connect_to_receiver(self, host, port):
+        address = (host, port)
+        pool = self.receiver_pools.get(address)
+        if pool is not None and any(connection.alive for connection in pool.connections):
+            message = "Đã kết nối rồi."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if not self.sender_private_key or not self.receiver_public_key:
+            message = "Thiếu khóa RSA để kết nối."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        try:
+            # Mở sẵn kết nối đầu tiên để kiểm tra Người nhận; các kết nối khác được mở khi cần
+            connection = self._open_connection(address)
+        except ConnectionRefusedError:
+            message = "Người nhận không hoạt động hoặc địa chỉ/cổng không đúng."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        except Exception as e:
+            message = f"Lỗi khi kết nối: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        pool = ReceiverPool(address, self.max_connections_per_receiver, self.max_transfers_per_receiver)
+        pool.connections.append(connection)
+        pool.compression_codecs = connection.compression_codecs
+        pool.batch_version = connection.batch_version
+        pool.dedup = connection.dedup
+        pool.delta_version = connection.delta_version
+        self.receiver_pools[address] = pool
+        self.default_receiver = address
+        self.is_connected = True
+        message = f"Đã kết nối đến Người nhận tại {host}:{port}"
+        self.activity_log.append(message)
+        return True, message
+
+    def disconnect(self, host=None, port=None):
+        # Đóng nhóm kết nối tới một Người nhận, hoặc tới mọi Người nhận nếu không chỉ định
+        addresses = [(host, port)] if host is not None else list(self.receiver_pools)
+        for address in addresses:
+            pool = self.receiver_pools.pop(address, None)
+            if pool is not None:
+                pool.close()
+        if self.default_receiver not in self.receiver_pools:
+            self.default_receiver = next(iter(self.receiver_pools), None)
+        self.is_connected = bool(self.receiver_pools)
+        message = "Đã ngắt kết nối khỏi Người nhận."
+        self.activity_log.append(message)
+        return True, message
+
+    def set_pool_settings(self, max_connections=None, max_transfers=None):
+        if (max_connections is not None and max_connections < 1) or (max_transfers is not None and max_transfers < 1):
+            message = "Số kết nối và số file gửi đồng thời phải lớn hơn 0."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if max_connections is not None:
+            self.max_connections_per_receiver = max_connections
+        if max_transfers is not None:
+            self.max_transfers_per_receiver = max_transfers
+        for pool in self.receiver_pools.values():
+            with pool.condition:
+                pool.max_connections = self.max_connections_per_receiver
+                pool.max_transfers = self.max_transfers_per_receiver
+                pool.condition.notify_all()
+        message = f"Đã đặt nhóm kết nối: tối đa {self.max_connections_per_receiver} kết nối, {self.max_transfers_per_receiver} file đồng thời mỗi Người nhận"
+        self.activity_log.append(message)
+        return True, message
+
+    def _open_connection(self, address):
+        sock = socket.create_connection(address)
+        connection = ReceiverConnection(address, sock)
+        success, message = self._perform_handshake_and_key_exchange(connection)
+        if not success:
+            raise Exception(message)
+        # Từ đây mọi trả lời được luồng đọc chuyển tới file tương ứng
+        connection.start_reader()
+        return connection
+
+    def _acquire_connection(self, pool, file_id):
+        # Chọn kết nối ít file đang gửi nhất, mở thêm kết nối nếu tất cả đều bận và chưa đạt giới hạn,
+        # hoặc chờ khi Người nhận đã có đủ max_transfers file đang gửi.
+        with pool.condition:
+            while True:
+                pool.connections = [connection for connection in pool.connections if connection.alive]
+                if pool.active_transfers() + pool.opening < pool.max_transfers:
+                    # Kết nối tới Người nhận cũ (không gắn file_id vào trả lời) chỉ gửi một file mỗi lúc
+                    usable = [c for c in pool.connections if c.multiplex or c.active_transfers == 0]
+                    connection = min(usable, key=lambda c: c.active_transfers, default=None)
+                    if (connection is None or connection.active_transfers > 0) and len(pool.connections) + pool.opening < pool.max_connections:
+                        # Giữ chỗ rồi mở kết nối ngoài khóa: handshake và trao đổi khóa RSA chậm không chặn
+                        # các file khác dùng lại kết nối sẵn có hay trả kết nối
+                        pool.opening += 1
+                        break
+                    if connection is not None:
+                        return connection, connection.register(file_id)
+                pool.condition.wait()
+        try:
+            connection = self._open_connection(pool.address)
+        except Exception:
+            with pool.condition:
+                pool.opening -= 1
+                pool.condition.notify_all()
+            raise
+        with pool.condition:
+            pool.opening -= 1
+            pool.condition.notify_all()
+            if pool.closed:
+                connection.close()
+                raise ConnectionError("Đã ngắt kết nối tới Người nhận trong lúc mở kết nối mới.")
+            pool.connections.append(connection)
+            return connection, connection.register(file_id)
+
+    def _release_connection(self, pool, connection, file_id):
+        with pool.condition:
+            connection.unregister(file_id)
+            pool.condition.notify_all()
+
+    def _perform_handshake_and_key_exchange(self, connection):
+        try:
+            send_data_packet(connection.sock, {
+                "type": "handshake",
+                "message": "Hello!",
+                "wire_formats": list(SUPPORTED_WIRE_FORMATS),
+                "cipher_suites": list(self.cipher_suites)
+            })
+            response = receive_data_packet(connection.sock)
+            if response and response.get("type") == "handshake" and response.get("message") == "Ready!":
+                # Người nhận cũ không trả về wire_format: tiếp tục dùng JSON
+                connection.wire_format = negotiate_wire_format([response.get("wire_format", WIRE_FORMAT_JSON)])
+                # Người nhận cũ không trả về cipher_suites: chỉ hỗ trợ 3DES-CBC
+                connection.cipher_suite = get_cipher_suite(negotiate_cipher_suite(self.cipher_suites, response.get("cipher_suites")))
+                connection.multiplex = bool(response.get("multiplex"))
+                # Người nhận cũ không trả về compression_codecs: không nén
+                connection.compression_codecs = response.get("compression_codecs", [])
+                connection.batch_version = response.get("batch_version")
+                connection.dedup = bool(response.get("dedup"))
+                connection.delta_version = response.get("delta_version")
+                # Người nhận cũ không trả về key_exchange_modes: chỉ hiểu hai khóa RSA riêng
+                key_exchange_mode = self.key_exchange_mode
+                if key_exchange_mode not in response.get("key_exchange_modes", [KEY_EXCHANGE_SPLIT]):
+                    key_exchange_mode = KEY_EXCHANGE_SPLIT
+            else:
+                message = f"Handshake thất bại: {response}"
+                self.activity_log.append(message)
+                raise Exception(message)
+
+            if self.session_resumption and self._resume_session(connection):
+                return True, "Nối lại phiên thành công."
+
+            key_exchange_packet = self._wrap_session_material(connection, key_exchange_mode)
+
+            metadata = {
+                "timestamp": datetime.now().isoformat(),
+                "sender": "SenderApp",
+                "key_size": len(connection.session_key) * 8,
+                "iv_size": len(connection.session_iv) * 8,
+                # Nằm trong metadata đã ký nên không thể bị hạ cấp trên đường truyền
+                "cipher_suite": connection.cipher_suite.name,
+                "key_exchange": key_exchange_mode,
+                # Gắn phần đã mã hóa RSA vào chữ ký: không thể thay bằng khóa phiên của người khác
+                "key_material_digest": key_material_digest(key_exchange_packet)
+            }
+            metadata_json = json.dumps(metadata, sort_keys=True).encode('utf-8')
+            signature_on_metadata = sign_data(compute_sha512(metadata_json), self.sender_private_key)
+
+            send_data_packet(connection.sock, {
+                "type": "key_exchange",
+                **key_exchange_packet,
+                "metadata": metadata,
+                "signed_metadata": b64encode(signature_on_metadata).decode('utf-8')
+            })
+
+            response = receive_data_packet(connection.sock)
+            if response and response.get("status") == "OK":
+                self._store_session_ticket(connection, response)
+                message = f"Xác thực và trao đổi khóa phiên thành công! (bộ mã hóa: {connection.cipher_suite.name})"
+                self.activity_log.append(message)
+                return True, message
+            else:
+                message = f"Trao đổi khóa phiên thất bại: {response.get('message', 'Không rõ lỗi')}"
+                self.activity_log.append(message)
+                raise Exception(message)
+        except Exception as e:
+            connection.close()
+            message = f"Lỗi trong quá trình Handshake hoặc Trao đổi Khóa: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+
+    def _wrap_session_material(self, connection, key_exchange_mode):
+        # Tạo khóa phiên và IV cho kết nối, trả về các trường đã mã hóa RSA (Base64) của gói key_exchange
+        suite = connection.cipher_suite
+        if key_exchange_mode == KEY_EXCHANGE_SPLIT:
+            connection.session_key = get_random_bytes(suite.key_size)
+            connection.session_iv = get_random_bytes(suite.iv_size)
+            encrypted_session_key = rsa_encrypt(connection.session_key, self.receiver_public_key)
+            encrypted_session_iv = rsa_encrypt(connection.session_iv, self.receiver_public_key)
+            if encrypted_session_key is None or encrypted_session_iv is None:
+                message = "Không thể mã hóa khóa phiên hoặc IV bằng RSA."
+                self.activity_log.append(message)
+                raise ValueError(message)
+            return {
+                "encrypted_session_key": b64encode(encrypted_session_key).decode('utf-8'),
+                "encrypted_session_iv": b64encode(encrypted_session_iv).decode('utf-8')
+            }
+        if key_exchange_mode == KEY_EXCHANGE_OAEP_WRAP:
+            connection.session_key = get_random_bytes(suite.key_size)
+            connection.session_iv = get_random_bytes(suite.iv_size)
+            material = connection.session_key + connection.session_iv
+        else:
+            # Chỉ bí mật đi qua RSA; khóa và IV được dẫn xuất, gắn với bộ mã hóa đã chọn
+            material = get_random_bytes(SESSION_SECRET_SIZE)
+            connection.session_key, connection.session_iv = derive_session_material(
+                material, suite.key_size, suite.iv_size, suite.name.encode('utf-8'))
+        return {"encrypted_session_material": b64encode(rsa_oaep_encrypt(material, self.receiver_public_key)).decode('utf-8')}
+
+    def set_key_exchange_mode(self, key_exchange_mode):
+        if key_exchange_mode not in KEY_EXCHANGE_MODES:
+            message = f"Chế độ trao đổi khóa không hợp lệ: {key_exchange_mode}. Hỗ trợ: {', '.join(KEY_EXCHANGE_MODES)}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.key_exchange_mode = key_exchange_mode
+        message = f"Đã đặt chế độ trao đổi khóa: {key_exchange_mode} (áp dụng từ lần kết nối sau)"
+        self.activity_log.append(message)
+        return True, message
+
+    def _resume_session(self, connection):
+        # Thử nối lại phiên bằng một vé đã lưu; trả về False để chuyển sang trao đổi khóa đầy đủ
+        tickets = self.session_tickets.get(connection.address)
+        cached = None
+        while tickets:
+            candidate = tickets.popleft()
+            if candidate["expires_at"] > time.time() and candidate["cipher_suite"] in self.cipher_suites:
+                cached = candidate
+                break
+        if cached is None:
+            return False
+        client_nonce = get_random_bytes(16)
+        send_data_packet(connection.sock, {
+            "type": "session_resume",
+            "session_ticket": b64encode(cached["ticket"]).decode('utf-8'),
+            "nonce": b64encode(client_nonce).decode('utf-8'),
+            "proof": b64encode(session_proof(cached["session_key"], b"session-resume", cached["ticket"], client_nonce)).decode('utf-8')
+        })
+        response = receive_data_packet(connection.sock)
+        if not response or response.get("status") != "OK":
+            self.activity_log.append(f"Không nối lại được phiên ({(response or {}).get('message', 'Không rõ lỗi')}), trao đổi khóa đầy đủ.")
+            return False
+        # Người nhận cũng phải chứng minh giữ khóa phiên, tránh nối lại với một bên giả mạo
+        receiver_proof = b64decode(response.get("proof", ""))
+        if not verify_session_proof(cached["session_key"], receiver_proof, b"session-resumed", cached["ticket"], client_nonce):
+            self.activity_log.append("Bằng chứng nối lại phiên của Người nhận không hợp lệ, trao đổi khóa đầy đủ.")
+            return False
+        connection.session_key = cached["session_key"]
+        connection.session_iv = cached["session_iv"]
+        connection.cipher_suite = get_cipher_suite(cached["cipher_suite"])
+        self._store_session_ticket(connection, response)
+        self.activity_log.append(f"Nối lại phiên bằng vé, bỏ qua trao đổi khóa RSA (bộ mã hóa: {connection.cipher_suite.name})")
+        return True
+
+    def _store_session_ticket(self, connection, response):
+        ticket_b64 = response.get("session_ticket")
+        if not ticket_b64:
+            return # Người nhận cũ không cấp vé phiên
+        tickets = self.session_tickets.setdefault(connection.address, deque(maxlen=SESSION_TICKETS_PER_RECEIVER))
+        tickets.append({
+            "ticket": b64decode(ticket_b64),
+            "session_key": connection.session_key,
+            "session_iv": connection.session_iv,
+            "cipher_suite": connection.cipher_suite.name,
+            "expires_at": time.time() + response.get("ticket_lifetime", SESSION_TICKET_TTL)
+        })
+
+    def set_chunking_policy(self, mode, chunk_size=None, num_parts=None):
+        try:
+            plan_chunks(0, mode, chunk_size or self.chunk_size, num_parts or self.target_parts)
+        except (ValueError, TypeError) as e:
+            message = f"Chính sách chia phần không hợp lệ: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.chunk_mode = mode
+        if chunk_size:
+            self.chunk_size = chunk_size
+        if num_parts:
+            self.target_parts = num_parts
+        message = f"Đã đặt chính sách chia phần: {mode} (kích thước phần: {self.chunk_size}, số phần: {self.target_parts})"
+        self.activity_log.append(message)
+        return True, message
+
+    def _plan_chunks(self, file_size, chunk_size=None):
+        # Trả về (num_parts, chunk_size, mode); chunk_size truyền vào trực tiếp sẽ ghi đè chính sách hiện tại
+        mode = CHUNK_MODE_FIXED if chunk_size else self.chunk_mode
+        num_parts, chunk_size = plan_chunks(file_size, mode, chunk_size or self.chunk_size, self.target_parts, self.link_throughput)
+        return num_parts, chunk_size, mode
+
+    def send_contract_file(self, file_content, file_name, receiver=None):
+        file_size = len(file_content)
+        num_parts, effective_chunk_size, chunk_mode = self._plan_chunks(file_size)
+        # BytesIO dùng chung bộ đệm với file_content nên không tạo thêm bản sao
+        stream = io.BytesIO(file_content)
+        result = self._send_delta(stream, file_name, file_size, None, receiver)
+        if result is not None:
+            return result
+        success, message, _ = self._send_file_parts(stream, file_name, file_size, num_parts, effective_chunk_size, chunk_mode, receiver)
+        return success, message
+
+    def send_contract_stream(self, stream, file_name, file_size=None, chunk_size=None, receiver=None):
+        # Gửi file từ một luồng (stream) theo từng phần kích thước cố định,
+        # không bao giờ đọc toàn bộ file vào bộ nhớ.
+        try:
+            if file_size is None:
+                current_pos = stream.tell()
+                stream.seek(0, os.SEEK_END)
+                file_size = stream.tell() - current_pos
+                stream.seek(current_pos)
+            num_parts, chunk_size, chunk_mode = self._plan_chunks(file_size, chunk_size)
+        except (AttributeError, OSError) as e:
+            message = f"Không xác định được kích thước file từ luồng dữ liệu: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        except ValueError as e:
+            message = f"Không thể chia phần file: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        result = self._send_delta(stream, file_name, file_size, chunk_size, receiver)
+        if result is not None:
+            return result
+        success, message, _ = self._send_file_parts(stream, file_name, file_size, num_parts, chunk_size, chunk_mode, receiver)
+        return success, message
+
+    def send_contract_path(self, file_path, chunk_size=None, receiver=None):
+        try:
+            file_size = os.path.getsize(file_path)
+            with open(file_path, "rb") as f:
+                return self.send_contract_stream(f, os.path.basename(file_path), file_size, chunk_size, receiver)
+        except OSError as e:
+            message = f"Không thể đọc file '{file_path}': {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+
+    def send_contract_directory(self, dir_path, chunk_size=None, receiver=None):
+        # Gửi mọi file trong thư mục (kể cả thư mục con) thành một lô; Người nhận dựng lại cây thư mục
+        # bên dưới thư mục cùng tên. Trả về (success, message, báo cáo từng file).
+        if not os.path.isdir(dir_path):
+            message = f"Không tìm thấy thư mục: {dir_path}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, []
+        file_paths = []
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            file_paths.extend(os.path.join(root, name) for name in sorted(files))
+        batch_name = os.path.basename(os.path.normpath(os.path.abspath(dir_path)))
+        return self.send_contract_batch(file_paths, batch_name, dir_path, chunk_size, receiver)
+
+    def send_contract_batch(self, files, batch_name, base_dir=None, chunk_size=None, receiver=None):
+        # Gửi nhiều file trên một kết nối như một file duy nhất: các file được nối liền nên file nhỏ dùng
+        # chung phần, chỉ có một metadata đã ký (kèm danh sách file), một chữ ký gốc Merkle và một manifest.
+        # files là các đường dẫn, hoặc các cặp (tên trong lô, luồng đọc được) như file tải lên qua web;
+        # tên trong lô của đường dẫn là đường dẫn tương đối so với base_dir (mặc định là tên file).
+        # Trả về (success, message, báo cáo từng file của Người nhận: path, size, status, message).
+        pool = self.receiver_pools.get(receiver or self.default_receiver)
+        if pool is not None and pool.batch_version is None:
+            message = "Người nhận không hỗ trợ gửi theo lô."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, []
+        sources, entries, seen = [], [], set()
+        try:
+            if not files:
+                raise ValueError("Lô không có file nào.")
+            if len(files) > MAX_BATCH_FILES:
+                raise ValueError(f"Lô có {len(files)} file, tối đa {MAX_BATCH_FILES} file.")
+            for item in files:
+                if isinstance(item, tuple):
+                    name, source = item
+                    position = source.tell()
+                    size = source.seek(0, os.SEEK_END) - position
+                    source.seek(position)
+                else:
+                    source = item
+                    name = os.path.relpath(item, base_dir) if base_dir else os.path.basename(item)
+                    size = os.path.getsize(item)
+                name = batch_relative_path(name)
+                if name in seen:
+                    raise ValueError(f"File trùng tên trong lô: {name}")
+                seen.add(name)
+                sources.append(source)
+                entries.append({"path": name, "size": size})
+            total_size = sum(entry["size"] for entry in entries)
+            num_parts, chunk_size, chunk_mode = self._plan_chunks(total_size, chunk_size)
+        except (OSError, ValueError) as e:
+            message = f"Không thể chuẩn bị lô '{batch_name}': {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, []
+        self.activity_log.append(f"Gửi lô '{batch_name}': {len(entries)} file, {total_size} bytes, {num_parts} phần")
+        stream = BatchReader(sources, [entry["size"] for entry in entries])
+        try:
+            success, message, final_response = self._send_file_parts(
+                stream, batch_name, total_size, num_parts, chunk_size, chunk_mode, receiver,
+                extra_metadata={"batch": {"version": BATCH_VERSION, "files": entries}})
+        finally:
+            stream.close()
+        report = (final_response or {}).get("files") or []
+        if not success:
+            return False, message, report
+        failed = [entry for entry in report if entry.get("status") != "OK"]
+        for entry in failed:
+            self.activity_log.append(f"Người nhận không lưu được '{entry.get('path')}' trong lô '{batch_name}': {entry.get('message', '')}",
+                                     level=LOG_ERROR)
+        if failed or len(report) != len(entries):
+            message = f"Lô '{batch_name}': Người nhận lưu được {len(report) - len(failed)}/{len(entries)} file."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, report
+        message = f"Lô '{batch_name}' ({len(entries)} file) đã được gửi và xác minh thành công!"
+        self.activity_log.append(message)
+        return True, message, report
+
+    def _send_file_parts(self, stream, file_name, file_size, num_parts, chunk_size, chunk_mode, receiver=None, extra_metadata=None):
+        # receiver là địa chỉ (host, port) đã kết nối; mặc định là Người nhận kết nối gần nhất.
+        # extra_metadata được thêm vào metadata đã ký (ví dụ danh sách file của một lô).
+        # Trả về (success, message, trả lời cuối của Người nhận hoặc None).
+        pool = self.receiver_pools.get(receiver or self.default_receiver)
+        if not self.is_connected or pool is None:
+            message = "Chưa kết nối đến Người nhận."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, None
+        if not self.sender_private_key or not self.receiver_public_key:
+            message = "Thiếu khóa RSA hoặc khóa phiên."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, None
+        # Hậu tố ngẫu nhiên để các file cùng tên gửi đồng thời không trùng file_id
+        file_id = f"{file_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{get_random_bytes(4).hex()}"
+        try:
+            compression = self._choose_compression(pool, stream, file_name)
+            file_metadata = {
+                "file_id": file_id,
+                "filename": file_name,
+                "file_size": file_size,
+                "num_parts": num_parts,
+                "chunk_size": chunk_size,
+                "chunking": chunk_mode,
+                "auth_mode": self.auth_mode,
+                "timestamp": datetime.now().isoformat()
+            }
+            if compression != COMPRESSION_NONE:
+                file_metadata["compression"] = compression
+            if extra_metadata:
+                file_metadata.update(extra_metadata)
+            elif self.dedup and pool.dedup:
+                content_hash = self._content_hash(stream)
+                if content_hash:
+                    file_metadata[CONTENT_HASH_FIELD] = content_hash
+            file_metadata_json = json.dumps(file_metadata, sort_keys=True).encode('utf-8')
+            signature_on_file_metadata = sign_data(compute_sha512(file_metadata_json), self.sender_private_key)
+            init_packet = {
+                "type": "file_init",
+                "metadata": file_metadata,
+                "signed_metadata": b64encode(signature_on_file_metadata).decode('utf-8')
+            }
+            if self.send_window:
+                init_packet["window"] = self.send_window
+            # Khi kết nối lại, gửi lại đúng metadata đã ký này để Người nhận nhận ra lần gửi và báo phần còn thiếu.
+            # IV, hash, chữ ký của các phần đã gửi được giữ qua các lần thử để dựng cây Merkle và manifest trên toàn bộ file.
+            sent_parts = {}
+            base_position = self._stream_position(stream)
+            transfer_start = time.perf_counter()
+            attempt = 0
+            while True:
+                try:
+                    final_response, signed_manifest = self._transfer_file(pool, stream, base_position, init_packet, sent_parts)
+                    break
+                except TransferInterrupted as e:
+                    attempt += 1
+                    if base_position is None or attempt > self.resume_attempts:
+                        raise
+                    self.activity_log.append(f"{e} Kết nối lại để tiếp tục file '{file_name}' (lần {attempt}/{self.resume_attempts})...",
+                                             level=LOG_WARNING, file_id=file_id)
+                    time.sleep(RESUME_RETRY_DELAY * attempt)
+            content_hash = file_metadata.get(CONTENT_HASH_FIELD) or file_metadata.get("delta", {}).get("target_sha512")
+            if content_hash and final_response and final_response.get("status") == "OK":
+                self._remember_sent_version(pool, file_name, content_hash)
+            if final_response and final_response.get("deduplicated"):
+                FILES.inc(1, "sent", "dedup")
+                message = f"File hợp đồng '{file_name}' (ID: {file_id}) đã có sẵn trên Người nhận (cùng nội dung), không cần gửi lại."
+                self.activity_log.append(message)
+                return True, message, final_response
+            if final_response and final_response.get("status") == "OK":
+                elapsed = time.perf_counter() - transfer_start
+                self._update_link_throughput(file_size, elapsed)
+                FILES.inc(1, "sent", "ok")
+                FILE_BYTES.inc(file_size, "sent")
+                FILE_TRANSFER_SECONDS.observe(elapsed, "sent")
+                self._save_manifest(file_id, signed_manifest)
+                message = f"File hợp đồng '{file_name}' (ID: {file_id}) đã được gửi và xác minh thành công!"
+                self.activity_log.append(message)
+                return True, message, final_response
+            else:
+                FILES.inc(1, "sent", "error")
+                message = f"Người nhận báo lỗi khi hoàn tất file: {final_response.get('message', 'Không rõ lỗi')}"
+                self.activity_log.append(message, level=LOG_ERROR)
+                return False, message, final_response
+        except Exception as e:
+            FILES.inc(1, "sent", "error")
+            message = f"Lỗi trong quá trình gửi hợp đồng file: {e}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message, None
+
+    def _choose_compression(self, pool, stream, file_name):
+        # Codec ghi vào metadata đã ký của file. Chế độ auto lấy mẫu đầu file (nếu luồng seek được)
+        # và bỏ qua nén với dữ liệu đã nén sẵn như DOCX, PDF, ảnh.
+        if self.compression == COMPRESSION_NONE:
+            return COMPRESSION_NONE
+        if self.compression == COMPRESSION_AUTO:
+            compression = next((name for name in AUTO_COMPRESSION_CODECS
+                                if name in COMPRESSION_CODECS and name in pool.compression_codecs), None)
+        else:
+            compression = self.compression if self.compression in pool.compression_codecs else None
+        if compression is None:
+            self.activity_log.append(f"Người nhận không hỗ trợ nén {self.compression}, gửi file '{file_name}' không nén.")
+            return COMPRESSION_NONE
+        position = self._stream_position(stream)
+        if self.compression == COMPRESSION_AUTO and position is not None:
+            sample = stream.read(COMPRESSION_SAMPLE_SIZE)
+            stream.seek(position)
+            ratio = compression_ratio(get_compression_codec(compression), sample)
+            if ratio > COMPRESSION_MAX_RATIO:
+                self.activity_log.append(f"File '{file_name}' khó nén (mẫu còn {ratio:.0%}), gửi không nén.")
+                return COMPRESSION_NONE
+            self.activity_log.append(f"Nén file '{file_name}' bằng {compression} (mẫu còn {ratio:.0%}).")
+        return compression
+
+    def set_compression(self, compression):
+        if compression not in (COMPRESSION_NONE, COMPRESSION_AUTO) and compression not in COMPRESSION_CODECS:
+            supported = ', '.join((COMPRESSION_NONE, COMPRESSION_AUTO) + tuple(COMPRESSION_CODECS))
+            message = f"Codec nén không được hỗ trợ: {compression}. Hỗ trợ: {supported}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.compression = compression
+        message = f"Đã đặt chế độ nén: {compression}"
+        self.activity_log.append(message)
+        return True, message
+
+    def set_dedup(self, enabled):
+        self.dedup = bool(enabled)
+        message = f"Đã {'bật' if self.dedup else 'tắt'} bỏ qua file Người nhận đã có."
+        self.activity_log.append(message)
+        return True, message
+
+    def set_delta(self, enabled):
+        self.delta = bool(enabled)
+        message = f"Đã {'bật' if self.delta else 'tắt'} gửi phần khác biệt so với bản Người nhận đang có."
+        self.activity_log.append(message)
+        return True, message
+
+    def _remember_sent_version(self, pool, file_name, content_hash):
+        with self.content_hashes_lock:
+            self.sent_versions[(pool.address, file_name)] = content_hash
+            self.sent_versions.move_to_end((pool.address, file_name))
+            while len(self.sent_versions) > CONTENT_HASH_CACHE_SIZE:
+                self.sent_versions.popitem(last=False)
+
+    def _send_delta(self, stream, file_name, file_size, chunk_size, receiver):
+        # Gửi bản sửa đổi dưới dạng phần khác biệt so với bản cũ Người nhận đang giữ (cùng tên file, hoặc theo hash
+        # bản đã gửi gần nhất). Chỉ các đoạn mới được mã hóa, ký và gửi như một file bình thường; danh sách đoạn
+        # (chép từ bản cũ hoặc lấy từ dữ liệu mới) và SHA-512 của bản mới nằm trong metadata đã ký.
+        # Trả về (success, message), hoặc None khi cần gửi toàn bộ file như bình thường.
+        pool = self.receiver_pools.get(receiver or self.default_receiver)
+        if not self.delta or pool is None or not pool.delta_version or file_size > DELTA_MAX_FILE_SIZE:
+            return None
+        position = self._stream_position(stream)
+        if position is None:
+            return None
+        request_id = f"{file_name}_delta_{get_random_bytes(4).hex()}"
+        try:
+            content_hash = self._content_hash(stream)
+            base = self._request_delta_base(pool, request_id, file_name, file_size, content_hash)
+            if base is None:
+                return None
+            delta = compute_delta(stream, file_size, base["block_size"], base["weak"], b64decode(base["strong"]),
+                                  base["base_size"], int(file_size * DELTA_MAX_LITERAL_RATIO))
+            stream.seek(position)
+        except (TransferInterrupted, OSError, ValueError, KeyError) as e:
+            self.activity_log.append(f"Không lấy được chữ ký bản cũ của file '{file_name}', gửi toàn bộ file: {e}", level=LOG_WARNING)
+            stream.seek(position)
+            return None
+        if delta is None:
+            self.activity_log.append(f"File '{file_name}' khác nhiều so với bản cũ trên Người nhận, gửi toàn bộ file.")
+            return None
+        ops, literals = delta
+        literal_size = sum(length for _, length in literals)
+        reader = BatchReader([stream] * len(literals), [length for _, length in literals],
+                             [position + start for start, _ in literals])
+        try:
+            num_parts, chunk_size, chunk_mode = self._plan_chunks(literal_size, chunk_size)
+        except ValueError:
+            return None
+        self.activity_log.append(f"Gửi phần khác biệt của file '{file_name}': {literal_size}/{file_size} bytes mới, "
+                                 f"phần còn lại chép từ bản cũ trên Người nhận.")
+        success, message, _ = self._send_file_parts(
+            reader, file_name, literal_size, num_parts, chunk_size, chunk_mode, receiver,
+            extra_metadata={"delta": {"version": DELTA_VERSION, "base_sha512": base["base_sha512"], "base_size": base["base_size"],
+                                      "ops": ops, "target_size": file_size, "target_sha512": content_hash}})
+        if not success:
+            # Ví dụ bản cũ vừa bị xóa hoặc sửa trên Người nhận: gửi lại toàn bộ file
+            self.activity_log.append(f"Không gửi được file '{file_name}' bằng phần khác biệt, gửi toàn bộ file.",
+                                     level=LOG_WARNING)
+            stream.seek(position)
+            return None
+        return success, message
+
+    def _request_delta_base(self, pool, request_id, file_name, file_size, content_hash):
+        # Hỏi chữ ký từng khối của bản cũ; None nếu Người nhận không có bản cũ hoặc đã có đúng nội dung này
+        # (khi đó gửi bình thường để được khử trùng lặp ngay ở file_init).
+        packet = {"type": "delta_request", "file_id": request_id, "filename": file_name, "file_size": file_size}
+        if self.dedup and pool.dedup:
+            packet[CONTENT_HASH_FIELD] = content_hash
+        with self.content_hashes_lock:
+            base_hash = self.sent_versions.get((pool.address, file_name))
+        if base_hash:
+            packet["base_sha512"] = base_hash
+        connection = None
+        try:
+            connection, replies = self._acquire_connection(pool, request_id)
+            connection.send_packet(packet)
+            response = self._wait_reply(replies)
+        except OSError as e:
+            if connection is not None:
+                connection.close()
+            raise TransferInterrupted(f"Mất kết nối tới Người nhận: {e}.")
+        finally:
+            if connection is not None:
+                self._release_connection(pool, connection, request_id)
+        if response.get("status") != "OK":
+            raise ValueError(response.get("message", "Không rõ lỗi"))
+        if response.get("have_content") or not response.get("base"):
+            return None
+        # Chữ ký chứa hash từng khối bản rõ nên được mã hóa bằng khóa phiên như manifest
+        base_json = connection.cipher_suite.decrypt(b64decode(response["base"]), connection.session_key,
+                                                    b64decode(response["base_iv"]), chunk_aad(request_id, "delta_base"))
+        return json.loads(bytes(base_json))
+
+    def _content_hash(self, stream):
+        # SHA-512 toàn bộ nội dung còn lại của luồng (None nếu luồng không đọc lại được). Với file trên đĩa,
+        # kết quả được nhớ theo (thiết bị, inode, kích thước, thời điểm sửa) nên gửi lại cùng file không phải băm lại.
+        position = self._stream_position(stream)
+        if position is None:
+            return None
+        key = None
+        # Chỉ file thật trên đĩa; không gọi fileno() với luồng khác (SpooledTemporaryFile sẽ bị ghi ra đĩa)
+        if isinstance(getattr(stream, "raw", stream), io.FileIO):
+            stat = os.fstat(stream.fileno())
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, position)
+        if key is not None:
+            with self.content_hashes_lock:
+                if key in self.content_hashes:
+                    self.content_hashes.move_to_end(key)
+                    return self.content_hashes[key]
+        content_hash = stream_sha512(stream)
+        stream.seek(position)
+        if key is not None:
+            with self.content_hashes_lock:
+                self.content_hashes[key] = content_hash
+                while len(self.content_hashes) > CONTENT_HASH_CACHE_SIZE:
+                    self.content_hashes.popitem(last=False)
+        return content_hash
+
+    def _stream_position(self, stream):
+        # Vị trí bắt đầu của luồng nếu đọc lại được (seek), None nếu không thể tiếp tục khi bị ngắt
+        try:
+            return stream.tell() if stream.seekable() else None
+        except (AttributeError, OSError):
+            return None
+
+    def _transfer_file(self, pool, stream, base_position, init_packet, sent_parts):
+        # Một lần gửi file trên một kết nối của nhóm; báo TransferInterrupted nếu kết nối bị ngắt.
+        # Trả về (trả lời cuối của Người nhận, manifest đã ký hoặc None nếu chưa gửi tới file_end_signal).
+        file_metadata = init_packet["metadata"]
+        file_id = file_metadata["file_id"]
+        num_parts = file_metadata["num_parts"]
+        connection = None
+        try:
+            connection, replies = self._acquire_connection(pool, file_id)
+            connection.send_packet(init_packet)
+            response = self._wait_reply(replies)
+            if response.get("status") != "OK":
+                if response.get("retry"):
+                    raise TransferInterrupted(f"Người nhận bận: {response.get('message', 'Không rõ lỗi')}.")
+                message = f"Người nhận báo lỗi khi khởi tạo file: {response.get('message', 'Không rõ lỗi')}"
+                self.activity_log.append(message)
+                raise Exception(message)
+            if response.get("deduplicated"):
+                # Người nhận đã có nội dung này và đã lưu file: không gửi phần nào, không có manifest mới
+                return response, None
+            # Người nhận đã có một phần file từ lần gửi trước: chỉ gửi các phần còn thiếu
+            parts = response.get("missing_parts")
+            if parts is None:
+                parts = range(num_parts)
+            else:
+                self.activity_log.append(f"Người nhận đã có {num_parts - len(parts)}/{num_parts} phần, chỉ gửi {len(parts)} phần còn thiếu.")
+            if base_position is not None:
+                stream.seek(base_position)
+            # Người nhận cũ không trả về window: gửi liên tục, không có ACK
+            window = SendWindow(response.get("window"))
+            codec = get_compression_codec(file_metadata.get("compression"))
+            early_reply = self._run_send_pipeline(connection, replies, window, stream, file_id, file_metadata["file_size"],
+                                                  num_parts, file_metadata["chunk_size"], parts, sent_parts, codec)
+            if early_reply is not None:
+                # Người nhận báo lỗi (không phải ACK/NACK) trước file_end_signal: không gửi tiếp nữa
+                if early_reply.get("connection_lost"):
+                    raise TransferInterrupted(early_reply["message"])
+                return early_reply, None
+            end_packet = {"type": "file_end_signal", "file_id": file_id}
+            merkle_fields = {}
+            if file_metadata["auth_mode"] == AUTH_MODE_MERKLE:
+                merkle_fields = self._sign_merkle_root([sent_parts[i]["hash"] for i in range(num_parts)])
+                end_packet.update(merkle_fields)
+            signed_manifest = self._build_manifest(init_packet, connection.cipher_suite.name, sent_parts, merkle_fields)
+            end_packet.update(self._seal_manifest(connection, file_id, signed_manifest))
+            connection.send_packet(end_packet)
+            return self._wait_reply(replies), signed_manifest
+        except OSError as e:
+            # Lỗi kết nối hoặc ghi socket: bỏ kết nối này, lần thử sau dùng kết nối mới
+            if connection is not None:
+                connection.close()
+            raise TransferInterrupted(f"Mất kết nối tới Người nhận: {e}.")
+        finally:
+            if connection is not None:
+                self._release_connection(pool, connection, file_id)
+
+    def _build_manifest(self, init_packet, cipher_suite, sent_parts, merkle_fields):
+        # Bản ghi có chữ ký của lần gửi: thay cho việc chép hash/chữ ký từ nhật ký hoạt động.
+        # Phần gửi ở lần thử trước (kết nối khác) có thể dùng bộ mã hóa khác, khi đó ghi riêng cho phần đó.
+        file_metadata = init_packet["metadata"]
+        parts = []
+        for i in range(file_metadata["num_parts"]):
+            record = sent_parts[i]
+            entry = {"part": i}
+            for key in ("iv", "hash", "signature", "plaintext_hash"):
+                if record.get(key) is not None:
+                    entry[key] = b64encode(record[key]).decode('utf-8')
+            if record["cipher_suite"] != cipher_suite:
+                entry["cipher_suite"] = record["cipher_suite"]
+            parts.append(entry)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "file_id": file_metadata["file_id"],
+            "metadata": file_metadata,
+            "signed_metadata": init_packet["signed_metadata"],
+            "cipher_suite": cipher_suite,
+            "auth_mode": file_metadata["auth_mode"],
+            "parts": parts,
+            "created_at": datetime.now().isoformat()
+        }
+        manifest.update(merkle_fields)
+        return sign_transfer_manifest(manifest, self.sender_private_key)
+
+    def _seal_manifest(self, connection, file_id, signed_manifest):
+        # Manifest chứa tên file và hash bản rõ nên được mã hóa bằng khóa phiên như các phần file
+        suite = connection.cipher_suite
+        manifest_iv = get_random_bytes(suite.iv_size)
+        manifest_json = json.dumps(signed_manifest, sort_keys=True).encode('utf-8')
+        encrypted_manifest = suite.encrypt(manifest_json, connection.session_key, manifest_iv, chunk_aad(file_id, "manifest"))
+        return {
+            "manifest_iv": b64encode(manifest_iv).decode('utf-8'),
+            "manifest": b64encode(encrypted_manifest).decode('utf-8')
+        }
+
+    def _save_manifest(self, file_id, signed_manifest):
+        try:
+            os.makedirs(self.manifest_dir, exist_ok=True)
+            manifest_path = os.path.join(self.manifest_dir, os.path.basename(file_id) + MANIFEST_SUFFIX)
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(signed_manifest, f, ensure_ascii=False, indent=2)
+            self.activity_log.append(f"Đã lưu manifest đã ký của file '{file_id}' vào: {manifest_path}")
+        except OSError as e:
+            self.activity_log.append(f"Không thể lưu manifest của file '{file_id}': {e}")
+
+    def _wait_reply(self, replies):
+        response = replies.get()
+        if response.get("connection_lost"):
+            raise TransferInterrupted(response["message"])
+        return response
+
+    def set_cipher_suites(self, cipher_suites):
+        unknown = [name for name in cipher_suites if name not in CIPHER_SUITES]
+        if not cipher_suites or unknown:
+            message = f"Bộ mã hóa không hợp lệ: {', '.join(unknown) or '(trống)'}. Hỗ trợ: {', '.join(SUPPORTED_CIPHER_SUITES)}"
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        self.cipher_suites = list(cipher_suites)
+        message = f"Đã đặt thứ tự ưu tiên bộ mã hóa: {', '.join(self.cipher_suites)} (áp dụng từ lần kết nối sau)"
+        self.activity_log.append(message)
+        return True, message
+
+    def set_pipeline_settings(self, crypto_workers=None, pipeline_depth=None, send_window=None):
+        if (crypto_workers is not None and crypto_workers < 1) or (pipeline_depth is not None and pipeline_depth < 1):
+            message = "Số luồng mã hóa và độ sâu hàng đợi phải lớn hơn 0."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if send_window is not None and send_window < 0:
+            message = "Kích thước cửa sổ gửi không được âm."
+            self.activity_log.append(message, level=LOG_ERROR)
+            return False, message
+        if crypto_workers is not None:
+            self.crypto_workers = crypto_workers
+        if pipeline_depth is not None:
+            self.pipeline_depth = pipeline_depth
+        if send_window is not None:
+            self.send_window = send_window
+        message = f"Đã đặt pipeline gửi: {self.crypto_workers} luồng mã hóa, hàng đợi {self.pipeline_depth} phần, cửa sổ {self.send_window or 'không giới hạn'}"
+        self.activity_log.append(message)
+        return True, message
+
+    def _prepare_chunk(self, connection, file_id, part_number, num_parts, chunk, codec=None):
+        # Chạy trong luồng mã hóa: PyCryptodome (và zlib/lzma) nhả GIL trong phần mã C nên các phần được xử lý song song
+        suite = connection.cipher_suite
+        # Hash bản rõ (trước khi nén) đi vào manifest để xác minh lại file đã nhận mà không cần khóa phiên
+        plaintext_hash = compute_sha512(chunk)
+        if codec is not None:
+            chunk = compress_chunk(codec, chunk)
+        chunk_iv = get_random_bytes(suite.iv_size)
+        # Với AEAD, file_id và số thứ tự phần là dữ liệu liên kết: không thể tráo phần giữa các vị trí
+        encrypted_chunk = suite.encrypt(chunk, connection.session_key, chunk_iv, chunk_aad(file_id, part_number))
+        chunk_hash = chunk_digest(suite, chunk_iv, encrypted_chunk)
+        chunk_packet = {
+            "type": "file_chunk",
+            "file_id": file_id,
+            "part_number": part_number,
+            "total_parts": num_parts,
+            "iv": chunk_iv,
+            "cipher": encrypted_chunk,
+            "hash": chunk_hash,
+            "plaintext_hash": plaintext_hash
+        }
+        if self.auth_mode != AUTH_MODE_MERKLE:
+            chunk_packet["signature"] = sign_data(chunk_hash, self.sender_private_key)
+        return chunk_packet
+
+    def _write_chunk(self, connection, chunk_packet):
+        i = chunk_packet["part_number"]
+        # Mức DEBUG: manifest đã ký mới là bản ghi đầy đủ để xác minh, các dòng này chỉ để theo dõi
+        file_id = chunk_packet["file_id"]
+        self.activity_log.append(f"----- GỬI PHẦN FILE {i+1} -----", level=LOG_DEBUG, file_id=file_id)
+        self.activity_log.append(f"Hash (Base64) phần {i+1}: {b64encode(chunk_packet['hash']).decode('utf-8')}", level=LOG_DEBUG, file_id=file_id)
+        if "signature" in chunk_packet:
+            self.activity_log.append(f"Chữ ký (Base64) phần {i+1}: {b64encode(chunk_packet['signature']).decode('utf-8')}", level=LOG_DEBUG, file_id=file_id)
+        self.activity_log.append(f"---------------------------------", level=LOG_DEBUG, file_id=file_id)
+
+        CHUNKS.inc(1, "sent", "ok")
+        if connection.wire_format == WIRE_FORMAT_BINARY:
+            connection.send_binary_packet(chunk_packet, payload_key="cipher")
+        else:
+            for key in ("iv", "cipher", "hash", "signature"):
+                if key in chunk_packet:
+                    chunk_packet[key] = b64encode(chunk_packet[key]).decode('utf-8')
+            connection.send_packet(chunk_packet)
+
+    def _run_send_pipeline(self, connection, replies, window, stream, file_id, file_size, num_parts, chunk_size, parts, sent_parts, codec=None):
+        # Luồng hiện tại đọc file và giao từng phần cho các luồng mã hóa; các future được đưa vào
+        # hàng đợi có giới hạn theo đúng thứ tự phần, luồng ghi lấy ra và gửi lần lượt.
+        # Hàng đợi đầy thì việc đọc file bị chặn lại, nên bộ nhớ chỉ phụ thuộc pipeline_depth và cửa sổ.
+        # Luồng ghi chỉ gửi phần mới khi cửa sổ còn chỗ, và gửi lại các phần bị NACK; luồng ACK nhận các
+        # trả lời của file này. IV, hash, chữ ký của mỗi phần đã gửi được ghi vào sent_parts (theo số thứ tự phần).
+        # Trả về trả lời lỗi nếu Người nhận báo lỗi trước khi gửi xong, ngược lại None.
+        pending = queue.Queue(maxsize=self.pipeline_depth)
+        errors = []
+        early_replies = []
+
+        def send_packet(chunk_packet):
+            # plaintext_hash chỉ dùng cho manifest, không gửi kèm phần file
+            sent_parts[chunk_packet["part_number"]] = {
+                "iv": chunk_packet["iv"],
+                "hash": chunk_packet["hash"],
+                "signature": chunk_packet.get("signature"),
+                "plaintext_hash": chunk_packet.pop("plaintext_hash"),
+                "cipher_suite": connection.cipher_suite.name
+            }
+            self._write_chunk(connection, chunk_packet)
+
+        def wait_window(need_slot):
+            # Gửi lại các phần bị NACK trong lúc chờ cửa sổ có chỗ (hoặc chờ mọi phần được ACK)
+            while True:
+                action, item = window.next_action(need_slot)
+                if action != "resend":
+                    return action
+                part_number, chunk = item
+                send_packet(self._prepare_chunk(connection, file_id, part_number, num_parts, chunk, codec))
+
+        def ack_reader():
+            while True:
+                response = replies.get()
+                reply_type = response.get("type")
+                if reply_type == "_stop":
+                    return
+                if reply_type == "ack":
+                    window.ack(response.get("part"), response.get("cumulative", 0))
+                elif reply_type == "nack":
+                    CHUNKS.inc(1, "sent", "nack")
+                    self.activity_log.append(f"Người nhận yêu cầu gửi lại phần {response.get('part')}: {response.get('message', '')}",
+                                             level=LOG_WARNING, file_id=file_id)
+                    window.nack(response.get("part"))
+                else:
+                    early_replies.append(response)
+                    window.stop()
+                    return
+
+        def writer():
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                if errors or window.stopped:
+                    continue # Đã lỗi hoặc Người nhận đã báo lỗi: chỉ lấy ra để luồng đọc không bị chặn
+                try:
+                    part_number, chunk, future = item
+                    chunk_packet = future.result()
+                    if wait_window(need_slot=True) == "stop":
+                        continue
+                    window.sent(part_number, chunk)
+                    send_packet(chunk_packet)
+                except Exception as e:
+                    errors.append(e)
+                    window.stop()
+            if not errors and not window.stopped:
+                try:
+                    wait_window(need_slot=False)
+                except Exception as e:
+                    errors.append(e)
+                    window.stop()
+
+        ack_thread = threading.Thread(target=ack_reader, daemon=True)
+        ack_thread.start()
+        writer_thread = threading.Thread(target=writer, daemon=True)
+        writer_thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.crypto_workers) as executor:
+                base_position = None
+                next_part = 0
+                for i in parts:
+                    if errors or window.stopped:
+                        break
+                    # Chỉ seek khi bỏ qua phần đã có ở Người nhận; gửi tuần tự thì luồng không cần seek được
+                    if i != next_part:
+                        if base_position is None:
+                            base_position = stream.tell() - next_part * chunk_size
+                        stream.seek(base_position + i * chunk_size)
+                    # Chỉ đọc đúng một phần file tại mỗi vòng lặp để bộ nhớ không phụ thuộc kích thước file
+                    expected_length = part_length(file_size, chunk_size, i)
+                    chunk = stream.read(expected_length)
+                    if len(chunk) != expected_length:
+                        raise EOFError(f"Luồng dữ liệu kết thúc sớm ở phần {i+1}/{num_parts}.")
+                    next_part = i + 1
+                    pending.put((i, chunk, executor.submit(self._prepare_chunk, connection, file_id, i, num_parts, chunk, codec)))
+        finally:
+            pending.put(None)
+            writer_thread.join()
+            if not early_replies:
+                replies.put({"type": "_stop"})
+            ack_thread.join()
+        if early_replies:
+            return early_replies[0]
+        if errors:
+            raise errors[0]
+        return None
+
+    def _sign_merkle_root(self, leaf_hashes):
+        tree = build_merkle_tree(leaf_hashes)
+        root = merkle_root(tree)
+        root_signature = sign_data(root, self.sender_private_key)
+        root_b64 = b64encode(root).decode('utf-8')
+        root_signature_b64 = b64encode(root_signature).decode('utf-8')
+        # Chữ ký và bằng chứng từng phần (cho verify_tool.py) chỉ ở mức DEBUG như hash/chữ ký từng phần;
+        # manifest đã ký của file cũng chứa đủ các dữ liệu này
+        self.activity_log.append(f"Gốc Merkle (Base64): {root_b64}")
+        self.activity_log.append(f"Chữ ký gốc Merkle (Base64): {root_signature_b64}", level=LOG_DEBUG)
+        for i in range(len(leaf_hashes)):
+            proof_json = json.dumps(encode_merkle_proof(merkle_proof(tree, i)))
+            self.activity_log.append(f"Bằng chứng Merkle (JSON) phần {i+1}: {proof_json}", level=LOG_DEBUG)
+        return {"merkle_root": root_b64, "root_signature": root_signature_b64}
+
+    def _update_link_throughput(self, num_bytes, elapsed):
+        # Bỏ qua các file quá nhỏ vì thời gian đo chủ yếu là độ trễ, không phản ánh thông lượng
+        if num_bytes < MIN_CHUNK_SIZE or elapsed <= 0:
+            return
+        measured = num_bytes / elapsed
+        if self.link_throughput is None:
+            self.link_throughput = measured
+        else:
+            self.link_throughput = 0.7 * self.link_throughput + 0.3 * measured
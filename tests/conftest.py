@@ -0,0 +1,61 @@
+"""
+Fixture dùng chung cho các bài kiểm tra: cặp khóa RSA của Người gửi/Người nhận và một cặp
+ReceiverEngine/SenderEngine nối với nhau qua localhost.
+"""
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import generate_rsa_keys
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+@pytest.fixture(scope="session")
+def key_dir(tmp_path_factory):
+    # Sinh khóa RSA chậm: một lần cho cả phiên kiểm tra
+    directory = tmp_path_factory.mktemp("keys")
+    for role in ("sender", "receiver"):
+        generate_rsa_keys(str(directory / f"{role}_private_key.pem"), str(directory / f"{role}_public_key.pem"))
+    return directory
+
+
+def make_receiver(key_dir, save_dir):
+    from receiver_engine import ReceiverEngine
+    receiver = ReceiverEngine(save_dir=str(save_dir))
+    receiver.load_receiver_private_key(str(key_dir / "receiver_private_key.pem"))
+    receiver.load_sender_public_key(str(key_dir / "sender_public_key.pem"))
+    return receiver
+
+
+def make_sender(key_dir, manifest_dir):
+    from sender_engine import SenderEngine
+    sender = SenderEngine(manifest_dir=str(manifest_dir))
+    sender.load_sender_private_key(str(key_dir / "sender_private_key.pem"))
+    sender.load_receiver_public_key(str(key_dir / "receiver_public_key.pem"))
+    return sender
+
+
+@pytest.fixture
+def loopback(key_dir, tmp_path):
+    """(sender, receiver, port): Người nhận chế độ luồng đã chạy và Người gửi đã kết nối tới nó."""
+    receiver = make_receiver(key_dir, tmp_path / "received")
+    port = free_port()
+    success, message = receiver.start_server(port, "thread")
+    assert success, message
+    sender = make_sender(key_dir, tmp_path / "sent")
+    success, message = sender.connect_to_receiver('127.0.0.1', port)
+    assert success, message
+    yield sender, receiver, port
+    sender.disconnect()
+    receiver.stop_server()
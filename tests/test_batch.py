@@ -0,0 +1,77 @@
+"""
+Kiểm tra gửi theo lô: đường dẫn trong lô không thể thoát khỏi thư mục lô (Người gửi và Người nhận
+đều từ chối "..", đường dẫn tuyệt đối, ổ đĩa), và một lô hợp lệ được dựng lại đúng cây thư mục.
+
+Chạy: python -m pytest tests
+"""
+import io
+import os
+
+import pytest
+
+from receiver_engine import ReceiverEngine
+from utils import BATCH_VERSION, MANIFEST_SUFFIX, batch_relative_path, load_rsa_public_key
+from verify_tool import verify_received_file
+
+BAD_PATHS = ["../evil.txt", "a/../../evil.txt", "a/./b.txt", "/etc/passwd", "..\\evil.txt", "C:/evil.txt", "a//b.txt", ""]
+
+
+def test_batch_relative_path_normalizes_separators():
+    assert batch_relative_path("hop_dong\\2024\\a.pdf") == "hop_dong/2024/a.pdf"
+    assert batch_relative_path("a.pdf") == "a.pdf"
+
+
+@pytest.mark.parametrize("path", BAD_PATHS)
+def test_batch_relative_path_rejects_escapes(path):
+    with pytest.raises(ValueError, match="không hợp lệ"):
+        batch_relative_path(path)
+
+
+@pytest.mark.parametrize("path", BAD_PATHS)
+def test_receiver_rejects_escaping_batch_entries(path):
+    batch = {"version": BATCH_VERSION, "files": [{"path": "ok.txt", "size": 2}, {"path": path, "size": 3}]}
+    with pytest.raises(ValueError):
+        ReceiverEngine()._check_batch(batch, 5)
+
+
+def test_receiver_rejects_duplicate_or_mismatched_entries():
+    receiver = ReceiverEngine()
+    with pytest.raises(ValueError, match="trùng tên"):
+        receiver._check_batch({"version": BATCH_VERSION, "files": [{"path": "a", "size": 1}, {"path": "a", "size": 1}]}, 2)
+    with pytest.raises(ValueError, match="không khớp"):
+        receiver._check_batch({"version": BATCH_VERSION, "files": [{"path": "a", "size": 1}]}, 2)
+    assert receiver._check_batch({"version": BATCH_VERSION, "files": [{"path": "d\\a", "size": 2}]}, 2) == [("d/a", 2)]
+
+
+def test_sender_rejects_escaping_batch_before_sending(loopback, tmp_path):
+    sender, _, _ = loopback
+    files = [("ok.txt", io.BytesIO(b"ok")), ("../evil.txt", io.BytesIO(b"evil"))]
+
+    success, message, report = sender.send_contract_batch(files, "lo")
+
+    assert not success and report == []
+    assert "không hợp lệ" in message
+    assert not os.path.exists(tmp_path / "evil.txt")
+    assert not os.path.exists(tmp_path / "received" / "lo")
+
+
+def test_batch_round_trip(loopback, key_dir, tmp_path):
+    sender, _, _ = loopback
+    source = tmp_path / "lo"
+    contents = {"a.txt": b"hop dong a", "sub/b.bin": os.urandom(100 * 1024), "sub/deep/c.txt": b""}
+    for name, data in contents.items():
+        path = source.joinpath(*name.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    success, message, report = sender.send_contract_directory(str(source))
+
+    assert success, message
+    assert sorted(entry["path"] for entry in report) == sorted(contents)
+    batch_dir = tmp_path / "received" / "lo"
+    for name, data in contents.items():
+        assert batch_dir.joinpath(*name.split("/")).read_bytes() == data
+    public_key = load_rsa_public_key(str(key_dir / "sender_public_key.pem"))
+    valid, reason, details = verify_received_file(str(batch_dir) + MANIFEST_SUFFIX, public_key)
+    assert valid, reason
+    assert details["files"] == len(contents)
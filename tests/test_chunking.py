@@ -0,0 +1,43 @@
+"""
+Kiểm tra chính sách chia phần plan_chunks: mọi chế độ giữ kích thước phần trong giới hạn MAX_CHUNK_SIZE.
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (
+    plan_chunks, part_length, CHUNK_MODE_AUTO, CHUNK_MODE_FIXED, CHUNK_MODE_PARTS, MAX_CHUNK_SIZE, MAX_FRAME_SIZE
+)
+
+MIB = 1024 * 1024
+
+
+@pytest.mark.parametrize("mode, options", [
+    (CHUNK_MODE_AUTO, {"throughput": 10 ** 12}),
+    (CHUNK_MODE_PARTS, {"num_parts": 3}),
+    (CHUNK_MODE_FIXED, {"chunk_size": MAX_CHUNK_SIZE}),
+])
+def test_chunk_size_is_bounded(mode, options):
+    file_size = 200 * MIB
+    num_parts, chunk_size = plan_chunks(file_size, mode, **options)
+    assert chunk_size <= MAX_CHUNK_SIZE < MAX_FRAME_SIZE
+    assert sum(part_length(file_size, chunk_size, i) for i in range(num_parts)) == file_size
+
+
+def test_parts_mode_adds_parts_for_large_files():
+    assert plan_chunks(200 * MIB, CHUNK_MODE_PARTS, num_parts=3) == (13, MAX_CHUNK_SIZE)
+    assert plan_chunks(30 * MIB, CHUNK_MODE_PARTS, num_parts=3) == (3, 10 * MIB)
+
+
+def test_oversized_fixed_chunk_is_rejected():
+    with pytest.raises(ValueError):
+        plan_chunks(10, CHUNK_MODE_FIXED, chunk_size=MAX_CHUNK_SIZE + 1)
+
+
+def test_empty_file_has_one_part():
+    assert plan_chunks(0, CHUNK_MODE_PARTS, num_parts=4) == (1, 1)
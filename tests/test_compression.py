@@ -0,0 +1,71 @@
+"""
+Kiểm tra nén từng phần file: byte cờ cho biết phần được nén hay giữ nguyên, và dữ liệu giải nén
+ra nhiều hơn độ dài phần dự kiến (bom giải nén) bị từ chối thay vì được cấp phát toàn bộ.
+
+Chạy: python -m pytest tests
+"""
+import os
+
+import pytest
+
+from utils import COMPRESSION_CODECS, COMPRESSION_NONE, compress_chunk, decompress_chunk, get_compression_codec
+
+CODECS = sorted(COMPRESSION_CODECS)
+PART_LENGTH = 64 * 1024
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_compressible_part_round_trip(name):
+    codec = get_compression_codec(name)
+    data = b"hop dong mua ban " * (PART_LENGTH // 17) + b"x" * (PART_LENGTH % 17)
+    packed = compress_chunk(codec, data)
+    assert packed[0] == 1 and len(packed) < len(data)
+    assert decompress_chunk(codec, packed, len(data)) == data
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_incompressible_part_is_stored(name):
+    codec = get_compression_codec(name)
+    data = os.urandom(PART_LENGTH)
+    packed = compress_chunk(codec, data)
+    assert packed[0] == 0 and packed[1:] == data
+    assert decompress_chunk(codec, packed, len(data)) == data
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_decompression_bomb_is_rejected(name):
+    codec = get_compression_codec(name)
+    bomb = compress_chunk(codec, bytes(16 * PART_LENGTH))
+    assert bomb[0] == 1
+    with pytest.raises(ValueError):
+        decompress_chunk(codec, bomb, PART_LENGTH)
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_short_output_is_rejected(name):
+    codec = get_compression_codec(name)
+    packed = compress_chunk(codec, bytes(PART_LENGTH))
+    with pytest.raises(ValueError, match="dự kiến"):
+        decompress_chunk(codec, packed, PART_LENGTH + 1)
+
+
+def test_stored_part_with_wrong_length_is_rejected():
+    codec = get_compression_codec(CODECS[0])
+    packed = compress_chunk(codec, os.urandom(PART_LENGTH))
+    with pytest.raises(ValueError, match="dự kiến"):
+        decompress_chunk(codec, packed, PART_LENGTH - 1)
+
+
+def test_invalid_flag_or_empty_part_is_rejected():
+    codec = get_compression_codec(CODECS[0])
+    with pytest.raises(ValueError, match="Cờ nén"):
+        decompress_chunk(codec, b"\x02data", 4)
+    with pytest.raises(ValueError, match="rỗng"):
+        decompress_chunk(codec, b"", 0)
+
+
+def test_codec_lookup():
+    assert get_compression_codec(COMPRESSION_NONE) is None
+    assert get_compression_codec(None) is None
+    with pytest.raises(ValueError, match="không được hỗ trợ"):
+        get_compression_codec("brotli")
@@ -0,0 +1,72 @@
+"""
+Kiểm tra kho nội dung của Người nhận: file cùng nội dung được liên kết từ kho mà không gửi phần nào,
+còn nội dung trong kho đã bị sửa tại chỗ (cùng kích thước) bị loại khỏi kho và file được truyền đầy đủ.
+
+Chạy: python -m pytest tests
+"""
+import hashlib
+import os
+import threading
+
+from receiver_engine import CONTENT_STORE_DIR
+
+CHUNK_SIZE = 64 * 1024
+NUM_PARTS = 3
+
+
+def _count_parts(sender):
+    written = []
+    lock = threading.Lock()
+    write_chunk = sender._write_chunk
+
+    def counting_write(connection, chunk_packet):
+        with lock:
+            written.append(chunk_packet["part_number"])
+        write_chunk(connection, chunk_packet)
+
+    sender._write_chunk = counting_write
+    return written
+
+
+def test_same_content_is_linked_from_store(loopback, tmp_path):
+    sender, _, _ = loopback
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * NUM_PARTS)
+    written = _count_parts(sender)
+    assert sender.send_contract_file(data, "a.bin")[0]
+    assert len(written) == NUM_PARTS
+
+    success, message = sender.send_contract_file(data, "b.bin")
+
+    assert success, message
+    assert "đã có sẵn" in message
+    assert len(written) == NUM_PARTS
+    assert (tmp_path / "received" / "b.bin").read_bytes() == data
+
+
+def test_blob_edited_in_place_forces_full_transfer(loopback, tmp_path):
+    sender, receiver, _ = loopback
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * NUM_PARTS)
+    content_hash = hashlib.sha512(data).hexdigest()
+    assert sender.send_contract_file(data, "a.bin")[0]
+    blob = tmp_path / "received" / CONTENT_STORE_DIR / content_hash[:2] / content_hash
+    assert blob.read_bytes() == data
+
+    # Sửa tại chỗ qua file đã nhận (liên kết cứng tới kho): kích thước không đổi nên chỉ băm lại mới phát hiện
+    with open(tmp_path / "received" / "a.bin", "r+b") as f:
+        f.seek(CHUNK_SIZE + 5)
+        f.write(b"\x00\x01\x02")
+    assert blob.read_bytes() != data
+    written = _count_parts(sender)
+
+    success, message = sender.send_contract_file(data, "b.bin")
+
+    assert success, message
+    assert "đã có sẵn" not in message
+    assert sorted(written) == list(range(NUM_PARTS))
+    assert (tmp_path / "received" / "b.bin").read_bytes() == data
+    entries, _ = receiver.activity_log.since(0)
+    assert any("trong kho đã bị sửa" in entry["message"] for entry in entries)
+    # Bản nhận đầy đủ thay chỗ nội dung hỏng trong kho
+    assert blob.read_bytes() == data
@@ -0,0 +1,117 @@
+"""
+Kiểm tra gửi phần khác biệt: chữ ký khối của bản cũ, so khớp compute_delta và dựng lại bản mới
+bằng ReceiverEngine._apply_delta như khi Người nhận hoàn tất một file.
+
+Chạy: python -m pytest tests
+"""
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from utils import compute_delta, delta_block_size, delta_signatures
+from receiver_engine import ReceiverEngine
+
+
+def _delta(base, new, block_size=None, max_literal=None):
+    block_size = block_size or delta_block_size(len(base))
+    weak, strong, _ = delta_signatures(io.BytesIO(base), block_size)
+    max_literal = len(new) if max_literal is None else max_literal
+    return compute_delta(io.BytesIO(new), len(new), block_size, weak, strong, len(base), max_literal)
+
+
+def _rebuild(tmp_path, base, new, delta):
+    # Ghi các đoạn mới ra file như Người nhận nhận được, rồi dựng lại bản mới từ bản cũ
+    ops, literals = delta
+    base_path, literal_path, target_path = (str(tmp_path / name) for name in ("base", "literal", "target"))
+    with open(base_path, "wb") as f:
+        f.write(base)
+    with open(literal_path, "wb") as f:
+        for start, length in literals:
+            f.write(new[start:start + length])
+    with open(base_path, "rb") as base_file:
+        ReceiverEngine(save_dir=str(tmp_path))._apply_delta(base_file, literal_path, target_path, ops)
+    with open(target_path, "rb") as f:
+        return f.read()
+
+
+def _edit(rng, data, edits):
+    data = bytearray(data)
+    for _ in range(edits):
+        position = rng.randint(0, len(data))
+        kind = rng.choice(("insert", "delete", "replace"))
+        if kind == "insert":
+            data[position:position] = rng.randbytes(rng.randint(1, 300))
+        elif kind == "delete":
+            del data[position:position + rng.randint(1, 300)]
+        else:
+            data[position:position + 64] = rng.randbytes(64)
+    return bytes(data)
+
+
+@pytest.mark.parametrize("read_size", [7, 1000, 1024 * 1024])
+def test_random_edits_round_trip(tmp_path, monkeypatch, read_size):
+    # Cửa sổ đọc nhỏ buộc so khớp phải đọc lại luồng giữa chừng một khối
+    monkeypatch.setattr(utils, "DELTA_READ_SIZE", read_size)
+    rng = random.Random(read_size)
+    for trial in range(30):
+        base = rng.randbytes(rng.choice((1, 1500, 5000, 40000)))
+        new = _edit(rng, base, rng.randint(0, 4))
+        delta = _delta(base, new)
+        assert delta is not None
+        assert _rebuild(tmp_path, base, new, delta) == new, f"lần thử {trial}"
+
+
+def test_unchanged_file_has_no_literals():
+    base = random.Random(1).randbytes(10000)
+    ops, literals = _delta(base, base)
+    assert literals == []
+    assert ops == [[0, len(base)]]
+
+
+def test_short_last_block_matches_at_end(tmp_path):
+    block_size = 1024
+    base = random.Random(2).randbytes(block_size * 3 + 500)
+    new = b"X" * 10 + base
+    ops, literals = _delta(base, new, block_size)
+    assert literals == [(0, 10)]
+    # Ba khối đủ và khối cuối 500 bytes được gộp thành một đoạn chép
+    assert ops == [[None, 10], [0, len(base)]]
+    assert _rebuild(tmp_path, base, new, (ops, literals)) == new
+
+
+def test_short_last_block_not_matched_in_middle(tmp_path):
+    block_size = 1024
+    base = random.Random(3).randbytes(block_size + 500)
+    tail = base[block_size:]
+    new = tail + random.Random(4).randbytes(2000)
+    ops, literals = _delta(base, new, block_size)
+    assert all(offset is None for offset, _ in ops)
+    assert _rebuild(tmp_path, base, new, (ops, literals)) == new
+
+
+def test_empty_base(tmp_path):
+    new = random.Random(5).randbytes(3000)
+    ops, literals = _delta(b"", new, 1024)
+    assert ops == [[None, len(new)]]
+    assert literals == [(0, len(new))]
+    assert _rebuild(tmp_path, b"", new, (ops, literals)) == new
+    assert _delta(b"", new, 1024, max_literal=len(new) - 1) is None
+
+
+def test_too_many_literals_gives_up():
+    rng = random.Random(6)
+    base = rng.randbytes(20000)
+    assert _delta(base, rng.randbytes(20000), max_literal=10000) is None
+
+
+def test_short_stream_is_rejected():
+    base = random.Random(7).randbytes(4096)
+    weak, strong, _ = delta_signatures(io.BytesIO(base), 1024)
+    with pytest.raises(ValueError):
+        compute_delta(io.BytesIO(base[:3000]), len(base), 1024, weak, strong, len(base), len(base))
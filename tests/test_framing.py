@@ -0,0 +1,147 @@
+"""
+Kiểm tra khung nhị phân của gói file_chunk: mã hóa/giải mã giữ nguyên mọi kiểu trường, payload
+được trả về dạng memoryview không sao chép, và khung bị cắt cụt hoặc sai magic bị từ chối. Phía nhận:
+recv_exact_into ghép đủ dữ liệu đến từng mảnh, báo lỗi khi kết nối đóng giữa chừng, và gói vượt
+max_frame_size bị từ chối trước khi cấp phát bộ đệm.
+
+Chạy: python -m pytest tests
+"""
+import asyncio
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+from utils import (
+    BINARY_FRAME_MAGIC, async_receive_data_packet, decode_binary_frame, decode_packet, encode_binary_frame,
+    receive_data_packet, recv_exact_into, send_binary_packet
+)
+
+
+def _chunk_packet():
+    return {
+        "type": "file_chunk",
+        "file_id": "f-1",
+        "part_number": 7,
+        "offset": -1,
+        "iv": os.urandom(12),
+        "hash": {"sha512": "abc"},
+        "cipher": os.urandom(100 * 1024)
+    }
+
+
+def test_binary_frame_round_trip():
+    packet = _chunk_packet()
+    header, payload = encode_binary_frame(packet, "cipher")
+    assert header[0] == BINARY_FRAME_MAGIC
+    assert payload is packet["cipher"]
+
+    decoded = decode_binary_frame(header + payload)
+
+    assert isinstance(decoded["cipher"], memoryview)
+    assert bytes(decoded.pop("cipher")) == packet.pop("cipher")
+    assert decoded == packet
+
+
+def test_binary_frame_without_payload():
+    packet = {"type": "ack", "part": 3, "flags": [1, 2], "iv": b""}
+    header, payload = encode_binary_frame(packet)
+    assert payload == b""
+    assert decode_binary_frame(header) == packet
+    # decode_packet nhận ra khung nhị phân nhờ byte MAGIC khác '{'
+    assert decode_packet(header) == packet
+
+
+def test_truncated_header_is_rejected():
+    header, payload = encode_binary_frame(_chunk_packet(), "cipher")
+    with pytest.raises(ValueError, match="cắt cụt"):
+        decode_binary_frame(header[:-3])
+    with pytest.raises(struct.error):
+        decode_binary_frame(header[:4])
+
+
+def test_unknown_magic_or_version_is_rejected():
+    header, _ = encode_binary_frame({"type": "ack"})
+    with pytest.raises(ValueError, match="không được hỗ trợ"):
+        decode_binary_frame(b"\x00" + header[1:])
+    with pytest.raises(ValueError, match="không được hỗ trợ"):
+        decode_binary_frame(header[:1] + b"\x09" + header[2:])
+
+
+def test_recv_exact_into_joins_pieces():
+    data = os.urandom(10000)
+    left, right = socket.socketpair()
+    try:
+        def send_in_pieces():
+            for start in range(0, len(data), 777):
+                left.sendall(data[start:start + 777])
+
+        sender = threading.Thread(target=send_in_pieces)
+        sender.start()
+        buffer = bytearray(len(data))
+        assert recv_exact_into(right, memoryview(buffer), buffer_size=512)
+        sender.join()
+    finally:
+        left.close()
+        right.close()
+    assert buffer == data
+
+
+def test_recv_exact_into_reports_short_read():
+    left, right = socket.socketpair()
+    try:
+        left.sendall(b"x" * 100)
+        left.close()
+        buffer = bytearray(200)
+        assert not recv_exact_into(right, memoryview(buffer))
+        assert buffer[:100] == b"x" * 100
+    finally:
+        right.close()
+
+
+def test_receive_binary_packet_over_socketpair():
+    packet = _chunk_packet()
+    left, right = socket.socketpair()
+    try:
+        sender = threading.Thread(target=send_binary_packet, args=(left, dict(packet), "cipher"))
+        sender.start()
+        received = receive_data_packet(right, buffer_size=4096)
+        sender.join()
+    finally:
+        left.close()
+        right.close()
+    assert bytes(received.pop("cipher")) == packet.pop("cipher")
+    assert received == packet
+
+
+def test_truncated_packet_is_dropped():
+    header, payload = encode_binary_frame(_chunk_packet(), "cipher")
+    left, right = socket.socketpair()
+    try:
+        left.sendall((len(header) + len(payload)).to_bytes(4, 'big') + header + payload[:1000])
+        left.close()
+        assert receive_data_packet(right) is None
+    finally:
+        right.close()
+
+
+def test_oversized_frame_is_rejected():
+    left, right = socket.socketpair()
+    try:
+        # Chỉ gửi tiền tố độ dài: bên nhận phải từ chối ngay mà không chờ (hay cấp phát) phần thân
+        left.sendall((1024 + 1).to_bytes(4, 'big'))
+        assert receive_data_packet(right, max_frame_size=1024) is None
+    finally:
+        left.close()
+        right.close()
+
+
+def test_async_oversized_frame_is_rejected():
+    async def receive():
+        reader = asyncio.StreamReader()
+        reader.feed_data((1024 + 1).to_bytes(4, 'big'))
+        return await async_receive_data_packet(reader, max_frame_size=1024)
+
+    assert asyncio.run(receive()) is None
@@ -0,0 +1,112 @@
+"""
+Kiểm tra trao đổi khóa phiên: mỗi chế độ (oaep-hkdf, oaep-wrap, split) cho Người nhận đúng khóa/IV
+Người gửi đã tạo, và key_material_digest trong metadata đã ký khiến các trường RSA bị tráo hoặc thay
+trên đường truyền bị từ chối.
+
+Chạy: python -m pytest tests
+"""
+import time
+
+import pytest
+
+import sender_engine
+from conftest import make_receiver, make_sender
+from sender_engine import ReceiverConnection
+from utils import (
+    KEY_EXCHANGE_MODES, KEY_EXCHANGE_SPLIT, KEY_EXCHANGE_OAEP_WRAP, SUPPORTED_CIPHER_SUITES,
+    get_cipher_suite, key_material_digest
+)
+
+
+def _connection(suite_name):
+    connection = ReceiverConnection(('127.0.0.1', 0), None)
+    connection.cipher_suite = get_cipher_suite(suite_name)
+    return connection
+
+
+@pytest.mark.parametrize("suite_name", SUPPORTED_CIPHER_SUITES)
+@pytest.mark.parametrize("mode", KEY_EXCHANGE_MODES)
+def test_session_material_round_trip(key_dir, tmp_path, mode, suite_name):
+    sender = make_sender(key_dir, tmp_path / "sent")
+    receiver = make_receiver(key_dir, tmp_path / "received")
+    connection = _connection(suite_name)
+
+    packet = sender._wrap_session_material(connection, mode)
+
+    if mode == KEY_EXCHANGE_SPLIT:
+        assert set(packet) == {"encrypted_session_key", "encrypted_session_iv"}
+    else:
+        assert set(packet) == {"encrypted_session_material"}
+    suite = connection.cipher_suite
+    assert len(connection.session_key) == suite.key_size and len(connection.session_iv) == suite.iv_size
+    assert receiver._unwrap_session_material(packet, mode, suite) == (connection.session_key, connection.session_iv)
+
+
+@pytest.mark.parametrize("mode", KEY_EXCHANGE_MODES)
+def test_key_exchange_over_loopback(loopback, tmp_path, mode):
+    sender, receiver, port = loopback
+    sender.session_resumption = False
+    assert sender.set_key_exchange_mode(mode)[0]
+    sender.disconnect()
+    success, message = sender.connect_to_receiver('127.0.0.1', port)
+    assert success, message
+
+    connection = sender.receiver_pools[('127.0.0.1', port)].connections[0]
+    assert connection.session_key in {session["session_key"] for session in receiver.client_sessions.values()}
+    assert sender.send_contract_file(b"key exchange " + mode.encode('utf-8'), "kx.txt")[0]
+    with open(tmp_path / "received" / "kx.txt", "rb") as f:
+        assert f.read() == b"key exchange " + mode.encode('utf-8')
+
+
+def test_key_material_digest_binds_fields():
+    packet = {"encrypted_session_key": "AAEC", "encrypted_session_iv": "AwQF"}
+    reordered = {"encrypted_session_iv": "AwQF", "encrypted_session_key": "AAEC", "type": "key_exchange"}
+    swapped = {"encrypted_session_key": "AwQF", "encrypted_session_iv": "AAEC"}
+    assert key_material_digest(packet) == key_material_digest(reordered)
+    assert key_material_digest(packet) != key_material_digest(swapped)
+    assert key_material_digest({"encrypted_session_material": "AAEC"}) != key_material_digest({"encrypted_session_material": "AAED"})
+
+
+def _tamper_key_exchange(monkeypatch, tamper):
+    # Sửa gói key_exchange ngay trước khi ghi ra socket, sau khi metadata đã được ký
+    send_data_packet = sender_engine.send_data_packet
+
+    def tampering_send(sock, data_dict):
+        if data_dict.get("type") == "key_exchange":
+            data_dict = tamper(dict(data_dict))
+        return send_data_packet(sock, data_dict)
+
+    monkeypatch.setattr(sender_engine, "send_data_packet", tampering_send)
+
+
+def _swap_split_fields(packet):
+    packet["encrypted_session_key"], packet["encrypted_session_iv"] = packet["encrypted_session_iv"], packet["encrypted_session_key"]
+    return packet
+
+
+@pytest.mark.parametrize("mode", [KEY_EXCHANGE_SPLIT, KEY_EXCHANGE_OAEP_WRAP])
+def test_tampered_key_fields_are_rejected(loopback, monkeypatch, mode):
+    sender, receiver, port = loopback
+    sender.session_resumption = False
+    assert sender.set_key_exchange_mode(mode)[0]
+    if mode == KEY_EXCHANGE_SPLIT:
+        tamper = _swap_split_fields
+    else:
+        # Thay dữ liệu khóa bằng bản bọc hợp lệ của một khóa phiên khác
+        other = sender._wrap_session_material(_connection(SUPPORTED_CIPHER_SUITES[0]), mode)
+        tamper = lambda packet: {**packet, **other}
+    _tamper_key_exchange(monkeypatch, tamper)
+    sender.disconnect()
+
+    success, message = sender.connect_to_receiver('127.0.0.1', port)
+
+    assert not success
+    assert "không khớp với metadata đã ký" in message
+    deadline = time.monotonic() + 2
+    entries = []
+    while time.monotonic() < deadline:
+        entries = [entry["message"] for entry in receiver.activity_log.since(0)[0]]
+        if any("không khớp với metadata đã ký" in entry for entry in entries):
+            break
+        time.sleep(0.01)
+    assert any(entry.startswith("Lỗi trao đổi khóa") and "không khớp với metadata đã ký" in entry for entry in entries)
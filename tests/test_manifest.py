@@ -0,0 +1,95 @@
+"""
+Kiểm tra manifest đã ký lưu cùng file nhận được: verify_received_file chấp nhận file nguyên vẹn
+và báo không hợp lệ khi một phần của file, một mục trong manifest, hoặc khóa người gửi không khớp.
+
+Chạy: python -m pytest tests
+"""
+import base64
+import json
+import os
+
+import pytest
+
+from utils import AUTH_MODES, MANIFEST_SUFFIX, generate_rsa_keys, load_rsa_public_key
+from verify_tool import verify_received_file
+
+CHUNK_SIZE = 64 * 1024
+NUM_PARTS = 4
+
+
+@pytest.fixture(params=AUTH_MODES)
+def received(request, loopback, key_dir, tmp_path):
+    """(đường dẫn file đã nhận, đường dẫn manifest, khóa công khai người gửi, dữ liệu gốc)."""
+    sender, _, _ = loopback
+    sender.auth_mode = request.param
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * (NUM_PARTS - 1) + 321)
+    success, message = sender.send_contract_file(data, "contract.bin")
+    assert success, message
+    saved = str(tmp_path / "received" / "contract.bin")
+    public_key = load_rsa_public_key(str(key_dir / "sender_public_key.pem"))
+    return saved, saved + MANIFEST_SUFFIX, public_key, data
+
+
+def test_intact_file_is_valid(received):
+    saved, manifest_path, public_key, data = received
+    valid, reason, details = verify_received_file(manifest_path, public_key)
+    assert valid, reason
+    assert details["parts"] == NUM_PARTS and details["bytes"] == len(data)
+
+
+def test_tampered_part_is_reported(received):
+    saved, manifest_path, public_key, _ = received
+    # Liên kết cứng tới kho nội dung: ghi file mới thay vì sửa tại chỗ
+    with open(saved, "rb") as f:
+        content = bytearray(f.read())
+    content[2 * CHUNK_SIZE + 10] ^= 0xFF
+    os.remove(saved)
+    with open(saved, "wb") as f:
+        f.write(content)
+
+    valid, reason, _ = verify_received_file(manifest_path, public_key)
+
+    assert not valid
+    assert "phần 2" in reason
+
+
+def test_tampered_manifest_entry_is_reported(received):
+    saved, manifest_path, public_key, _ = received
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        signed_manifest = json.load(f)
+    entry = signed_manifest["manifest"]["parts"][1]
+    entry["plaintext_hash"] = base64.b64encode(bytes(64)).decode('utf-8')
+    tampered_path = saved + ".tampered" + MANIFEST_SUFFIX
+    with open(tampered_path, "w", encoding="utf-8") as f:
+        json.dump(signed_manifest, f)
+
+    valid, reason, _ = verify_received_file(tampered_path, public_key, file_path=saved)
+
+    assert not valid
+    assert reason == "Chữ ký manifest không hợp lệ."
+
+
+def test_other_sender_key_is_rejected(received, tmp_path):
+    _, manifest_path, _, _ = received
+    other_private, other_public = str(tmp_path / "other_private.pem"), str(tmp_path / "other_public.pem")
+    generate_rsa_keys(other_private, other_public)
+
+    valid, reason, _ = verify_received_file(manifest_path, load_rsa_public_key(other_public))
+
+    assert not valid
+    assert reason == "Chữ ký manifest không hợp lệ."
+
+
+def test_appended_bytes_are_reported(received):
+    saved, manifest_path, public_key, data = received
+    with open(saved, "rb") as f:
+        content = f.read()
+    os.remove(saved)
+    with open(saved, "wb") as f:
+        f.write(content + b"x")
+
+    valid, reason, _ = verify_received_file(manifest_path, public_key)
+
+    assert not valid
+    assert "Kích thước file" in reason
@@ -0,0 +1,83 @@
+"""
+Kiểm tra chế độ xác thực Merkle: cây, bằng chứng từng phần, chuyển đổi JSON của bằng chứng
+và verify_tool.verify_merkle_part (bằng chứng kèm chữ ký RSA trên gốc cây).
+
+Chạy: python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (
+    build_merkle_tree, merkle_root, merkle_proof, verify_merkle_proof, encode_merkle_proof, decode_merkle_proof,
+    compute_sha512, generate_rsa_keys, load_rsa_private_key, load_rsa_public_key, sign_data
+)
+from verify_tool import verify_merkle_part
+
+
+@pytest.fixture(scope="module")
+def keys(tmp_path_factory):
+    key_dir = tmp_path_factory.mktemp("keys")
+    private_path, public_path = str(key_dir / "private_key.pem"), str(key_dir / "public_key.pem")
+    generate_rsa_keys(private_path, public_path)
+    return load_rsa_private_key(private_path), load_rsa_public_key(public_path)
+
+
+def _leaves(count):
+    return [compute_sha512(f"phần {i}".encode("utf-8")) for i in range(count)]
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 13])
+def test_every_proof_leads_to_root(count):
+    # Số lá lẻ kiểm tra nút được đưa thẳng lên tầng trên
+    leaves = _leaves(count)
+    tree = build_merkle_tree(leaves)
+    root = merkle_root(tree)
+    for index, leaf in enumerate(leaves):
+        proof = decode_merkle_proof(encode_merkle_proof(merkle_proof(tree, index)))
+        assert verify_merkle_proof(leaf, proof, root)
+
+
+def test_tampered_leaf_fails():
+    leaves = _leaves(6)
+    tree = build_merkle_tree(leaves)
+    root = merkle_root(tree)
+    tampered = bytearray(leaves[3])
+    tampered[0] ^= 1
+    assert not verify_merkle_proof(bytes(tampered), merkle_proof(tree, 3), root)
+    # Bằng chứng của phần khác không xác minh được phần này
+    assert not verify_merkle_proof(leaves[3], merkle_proof(tree, 2), root)
+
+
+def test_inner_node_is_not_a_leaf():
+    # Tiền tố lá/nút trong: nút trong không thể được trình ra như một lá với bằng chứng ngắn hơn
+    tree = build_merkle_tree(_leaves(4))
+    assert not verify_merkle_proof(tree[1][0], [("R", tree[1][1])], merkle_root(tree))
+
+
+def test_empty_tree_is_rejected():
+    with pytest.raises(ValueError):
+        build_merkle_tree([])
+
+
+def test_verify_merkle_part(keys):
+    private_key, public_key = keys
+    leaves = _leaves(5)
+    tree = build_merkle_tree(leaves)
+    root = merkle_root(tree)
+    root_signature = sign_data(root, private_key)
+
+    valid, _ = verify_merkle_part(leaves[4], merkle_proof(tree, 4), root, root_signature, public_key)
+    assert valid
+
+    tampered = bytearray(leaves[4])
+    tampered[-1] ^= 0x80
+    valid, _ = verify_merkle_part(bytes(tampered), merkle_proof(tree, 4), root, root_signature, public_key)
+    assert not valid
+
+    other_root = merkle_root(build_merkle_tree(_leaves(6)))
+    valid, _ = verify_merkle_part(leaves[0], merkle_proof(tree, 0), root, sign_data(other_root, private_key), public_key)
+    assert not valid
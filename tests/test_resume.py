@@ -0,0 +1,72 @@
+"""
+Kiểm tra tiếp tục file bị gián đoạn: ngắt kết nối giữa chừng, Người gửi kết nối lại và chỉ gửi
+các phần Người nhận còn thiếu (theo nhật ký tiến độ), gốc Merkle vẫn bao trùm mọi phần của file.
+
+Chạy: python -m pytest tests
+"""
+import os
+import socket
+import threading
+import time
+
+import sender_engine
+from utils import AUTH_MODE_MERKLE, MANIFEST_SUFFIX, load_rsa_public_key
+from verify_tool import verify_received_file
+
+CHUNK_SIZE = 64 * 1024
+NUM_PARTS = 40
+DROP_AFTER = 20
+
+
+def test_dropped_connection_resends_only_missing_parts(loopback, key_dir, tmp_path, monkeypatch):
+    sender, receiver, _ = loopback
+    monkeypatch.setattr(sender_engine, "RESUME_RETRY_DELAY", 0)
+    assert sender.auth_mode == AUTH_MODE_MERKLE
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * (NUM_PARTS - 1) + 123)
+    source = tmp_path / "resume.bin"
+    source.write_bytes(data)
+
+    attempts = []  # Các phần được giao cho pipeline ở mỗi lần thử
+    written = []   # (lần thử, part_number) theo thứ tự ghi ra socket
+    lock = threading.Lock()
+    run_send_pipeline = sender._run_send_pipeline
+    write_chunk = sender._write_chunk
+
+    def recording_pipeline(connection, replies, window, stream, file_id, file_size, num_parts, chunk_size, parts, *args):
+        attempts.append(list(parts))
+        return run_send_pipeline(connection, replies, window, stream, file_id, file_size, num_parts, chunk_size, parts, *args)
+
+    def dropping_write(connection, chunk_packet):
+        with lock:
+            written.append((len(attempts), chunk_packet["part_number"]))
+            drop = len(attempts) == 1 and len(written) == DROP_AFTER
+        if drop:
+            # Chờ Người nhận ghi các phần trước đó vào nhật ký rồi mới ngắt kết nối
+            time.sleep(0.2)
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        write_chunk(connection, chunk_packet)
+
+    sender._run_send_pipeline = recording_pipeline
+    sender._write_chunk = dropping_write
+
+    success, message = sender.send_contract_path(str(source))
+
+    assert success, message
+    assert len(attempts) == 2
+    first, resumed = attempts
+    assert first == list(range(NUM_PARTS))
+    # Lần thử sau chỉ gồm các phần còn thiếu, và chỉ đúng các phần đó được gửi lại
+    assert 0 < len(resumed) < NUM_PARTS
+    assert sorted(part for attempt, part in written if attempt == 2) == sorted(resumed)
+    received_first = {part for attempt, part in written if attempt == 1} - set(resumed)
+    assert received_first | set(resumed) == set(range(NUM_PARTS))
+
+    saved = tmp_path / "received" / "resume.bin"
+    assert saved.read_bytes() == data
+    # Manifest lưu cùng file: gốc Merkle đã ký được dựng từ hash của cả NUM_PARTS phần
+    manifest_path = str(saved) + MANIFEST_SUFFIX
+    public_key = load_rsa_public_key(str(key_dir / "sender_public_key.pem"))
+    valid, reason, details = verify_received_file(manifest_path, public_key)
+    assert valid, reason
+    assert details["parts"] == NUM_PARTS
@@ -0,0 +1,107 @@
+"""
+Kiểm tra cửa sổ trượt và gửi lại chọn lọc: phần bị NACK được mã hóa lại với IV mới, ACK tích lũy
+giải phóng cửa sổ, và file bị hủy khi một phần vẫn lỗi sau MAX_PART_RETRANSMITS lần gửi lại.
+
+Chạy: python -m pytest tests
+"""
+import os
+import socket
+import threading
+import time
+
+from utils import MAX_PART_RETRANSMITS, receive_data_packet
+from sender_engine import SendWindow
+from receiver_engine import ReceiverEngine
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _corrupt_parts(sender, bad_parts):
+    # Làm hỏng ciphertext của các phần trong bad_parts trên đường truyền; bad_parts[i] là số lần
+    # còn làm hỏng phần i (None: luôn làm hỏng). Trả về danh sách (part_number, iv) đã ghi ra socket.
+    written = []
+    lock = threading.Lock()
+    write_chunk = sender._write_chunk
+
+    def corrupting_write(connection, chunk_packet):
+        part_number = chunk_packet["part_number"]
+        with lock:
+            written.append((part_number, bytes(chunk_packet["iv"])))
+            remaining = bad_parts.get(part_number, 0)
+            if remaining is None or remaining > 0:
+                if remaining:
+                    bad_parts[part_number] = remaining - 1
+                cipher = bytearray(chunk_packet["cipher"])
+                cipher[0] ^= 0xFF
+                chunk_packet["cipher"] = bytes(cipher)
+        write_chunk(connection, chunk_packet)
+
+    sender._write_chunk = corrupting_write
+    return written
+
+
+def test_nacked_part_is_resent_with_fresh_iv(loopback, tmp_path):
+    sender, receiver, _ = loopback
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * 5 + 123)
+    written = _corrupt_parts(sender, {2: 1})
+
+    success, message = sender.send_contract_file(data, "nack.bin")
+
+    assert success, message
+    with open(tmp_path / "received" / "nack.bin", "rb") as f:
+        assert f.read() == data
+    ivs = [iv for part_number, iv in written if part_number == 2]
+    assert len(ivs) == 2 and ivs[0] != ivs[1]
+    # Chỉ phần bị từ chối được gửi lại
+    assert sorted(part_number for part_number, _ in written) == [0, 1, 2, 2, 3, 4, 5]
+
+
+def test_file_is_abandoned_after_max_retransmits(loopback, tmp_path):
+    sender, receiver, _ = loopback
+    assert sender.set_chunking_policy("fixed", CHUNK_SIZE)[0]
+    data = os.urandom(CHUNK_SIZE * 3)
+    written = _corrupt_parts(sender, {1: None})
+
+    success, message = sender.send_contract_file(data, "abandoned.bin")
+
+    assert not success
+    assert sum(1 for part_number, _ in written if part_number == 1) == MAX_PART_RETRANSMITS + 1
+    assert not os.path.exists(tmp_path / "received" / "abandoned.bin")
+    # Người nhận hủy file ngay sau khi gửi lỗi: chờ một chút cho luồng kết nối giải phóng file tạm
+    deadline = time.monotonic() + 2
+    while receiver.active_transfers and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert receiver.active_transfers == set()
+
+
+def test_cumulative_ack_advances_window():
+    window = SendWindow(3)
+    for part_number in range(3):
+        assert window.next_action(need_slot=True) == ("send", None)
+        window.sent(part_number, bytes([part_number]) * 16)
+    # Cửa sổ đầy: phải chờ ACK mới gửi tiếp
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(window.next_action(need_slot=True)))
+    waiter.start()
+    waiter.join(timeout=0.2)
+    assert waiter.is_alive()
+
+    # Người nhận có phần 0, 1 (và 3 từ trước): ACK chọn lọc phần 1 kèm ACK tích lũy
+    left, right = socket.socketpair()
+    try:
+        file_info = {"received": {0, 1, 3}, "next_expected": 0}
+        ReceiverEngine()._send_ack(left, "f", file_info, 1)
+        ack = receive_data_packet(right)
+    finally:
+        left.close()
+        right.close()
+    assert ack["type"] == "ack" and ack["part"] == 1 and ack["cumulative"] == 2
+
+    window.ack(ack["part"], ack["cumulative"])
+    waiter.join(timeout=2)
+    assert results == [("send", None)]
+    assert list(window.in_flight) == [2]
+
+    window.ack(2, 2)
+    assert window.next_action(need_slot=False) == ("done", None)
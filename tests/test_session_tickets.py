@@ -0,0 +1,133 @@
+"""
+Kiểm tra nối lại phiên bằng vé: vé chỉ dùng được một lần, hết hạn theo TTL, bị từ chối khi Người nhận
+đổi khóa công khai người gửi, và bằng chứng sai làm Người gửi quay về trao đổi khóa đầy đủ.
+
+Chạy: python -m pytest tests
+"""
+import time
+
+import receiver_engine
+from receiver_engine import SessionTicketCache
+from utils import generate_rsa_keys
+
+
+def _messages(engine):
+    entries, _ = engine.activity_log.since(0)
+    return [entry["message"] for entry in entries]
+
+
+def _reconnect(sender, port):
+    sender.disconnect()
+    return sender.connect_to_receiver('127.0.0.1', port)
+
+
+def _eventually(predicate, timeout=2):
+    # Người nhận ghi nhật ký sau khi đã trả lời: chờ một chút cho luồng kết nối ghi xong
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def _resumed(receiver, count=1):
+    resumed = lambda: sum(1 for message in _messages(receiver) if message.startswith("Nối lại phiên với"))
+    _eventually(lambda: resumed() >= count)
+    return resumed()
+
+
+def _rejected(receiver, reason):
+    return _eventually(lambda: any(message.startswith("Không thể nối lại phiên") and reason in message
+                                   for message in _messages(receiver)))
+
+
+def _saved_ticket(sender, port):
+    tickets = sender.session_tickets[('127.0.0.1', port)]
+    return dict(tickets[-1])
+
+
+def test_cache_pops_each_ticket_once():
+    cache = SessionTicketCache(ttl=60)
+    cache.put("a", {"session_key": b"k"})
+    assert cache.get("a") == {"session_key": b"k"}
+    assert cache.pop("a") == {"session_key": b"k"}
+    assert cache.pop("a") is None
+    assert cache.get("a") is None
+
+
+def test_cache_expires_and_evicts():
+    cache = SessionTicketCache(ttl=0.05, max_entries=2)
+    cache.put("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a") is None and cache.pop("a") is None
+    cache.ttl = 60
+    for ticket_id in ("b", "c", "d"):
+        cache.put(ticket_id, ticket_id)
+    assert cache.get("b") is None
+    assert cache.get("c") == "c" and cache.get("d") == "d"
+
+
+def test_ticket_resumes_session_only_once(loopback):
+    sender, receiver, port = loopback
+    used = _saved_ticket(sender, port)
+    assert _reconnect(sender, port)[0]
+    assert _resumed(receiver) == 1
+
+    # Dùng lại vé đã dùng: Người nhận từ chối, Người gửi trao đổi khóa đầy đủ và vẫn kết nối được
+    sender.session_tickets[('127.0.0.1', port)].clear()
+    sender.session_tickets[('127.0.0.1', port)].append(used)
+    success, message = _reconnect(sender, port)
+    assert success, message
+    assert _rejected(receiver, "đã hết hạn hoặc đã được sử dụng")
+    assert _resumed(receiver) == 1
+    assert sender.send_contract_file(b"replayed ticket", "replay.txt")[0]
+
+
+def test_expired_ticket_falls_back_to_key_exchange(loopback):
+    sender, receiver, port = loopback
+    receiver.session_cache.ttl = 0.05
+    assert _reconnect(sender, port)[0]  # Vé mới được cấp với TTL ngắn
+    assert _resumed(receiver) == 1
+    time.sleep(0.1)
+    # Bỏ qua kiểm tra hạn phía Người gửi để vé hết hạn thực sự tới Người nhận
+    for ticket in sender.session_tickets[('127.0.0.1', port)]:
+        ticket["expires_at"] = time.time() + 60
+    success, message = _reconnect(sender, port)
+    assert success, message
+    assert _rejected(receiver, "đã hết hạn hoặc đã được sử dụng")
+    assert _resumed(receiver) == 1
+
+
+def test_ticket_rejected_after_sender_key_change(loopback, tmp_path):
+    sender, receiver, port = loopback
+    other_private, other_public = str(tmp_path / "other_private.pem"), str(tmp_path / "other_public.pem")
+    generate_rsa_keys(other_private, other_public)
+    assert receiver.load_sender_public_key(other_public)[0]
+    # Vé được cấp cho khóa cũ; trao đổi khóa đầy đủ cũng thất bại vì chữ ký không còn khớp
+    success, _ = _reconnect(sender, port)
+    assert not success
+    assert _rejected(receiver, "không thuộc khóa công khai người gửi hiện tại")
+    assert _resumed(receiver, count=0) == 0
+
+
+def test_bad_sender_proof_falls_back_and_keeps_ticket(loopback):
+    sender, receiver, port = loopback
+    tickets = sender.session_tickets[('127.0.0.1', port)]
+    genuine = dict(tickets[-1])
+    tickets[-1]["session_key"] = bytes(len(genuine["session_key"]))
+    success, message = _reconnect(sender, port)
+    assert success, message
+    assert _rejected(receiver, "Bằng chứng khóa phiên KHÔNG hợp lệ")
+    # Bằng chứng sai không đốt vé: chủ vé thật vẫn nối lại được
+    tickets.clear()
+    tickets.append(genuine)
+    assert _reconnect(sender, port)[0]
+    assert _resumed(receiver) == 1
+
+
+def test_bad_receiver_proof_falls_back(loopback, monkeypatch):
+    sender, receiver, port = loopback
+    monkeypatch.setattr(receiver_engine, "session_proof", lambda *args: bytes(64))
+    success, message = _reconnect(sender, port)
+    assert success, message
+    assert any("Bằng chứng nối lại phiên của Người nhận không hợp lệ" in message for message in _messages(sender))
+    assert sender.send_contract_file(b"after key exchange", "fallback.txt")[0]
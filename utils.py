@@ -1,24 +1,217 @@
 import json
 import socket
+import struct
 from base64 import b64encode, b64decode
 from Crypto import Random
-from Crypto.Cipher import DES3, PKCS1_v1_5 # Thêm PKCS1_v1_5
+from Crypto.Cipher import DES3, AES, ChaCha20_Poly1305, PKCS1_v1_5, PKCS1_OAEP # Thêm PKCS1_v1_5
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA512
+from Crypto.Hash import SHA512, HMAC
 from Crypto.Util.Padding import pad, unpad # Import cho padding Triple DES
+from Crypto.Protocol.KDF import HKDF
 import os
+import hashlib
+import threading
+import itertools
+import math
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+import zlib
+import lzma
+import time
+from metrics import timed, CRYPTO_SECONDS, PACKET_SECONDS, PACKETS, PACKET_BYTES
+try:
+    import zstandard # Tùy chọn: codec zstd chỉ có khi đã cài gói zstandard
+except ImportError:
+    zstandard = None
 
-# Kích thước bộ đệm cho socket khi nhận/gửi dữ liệu
-BUFFER_SIZE = 4096 # 4KB
+# Bộ mã hóa đối xứng cho nội dung file, được chọn trong metadata đã ký của gói key_exchange
+CIPHER_SUITE_3DES_CBC = "3des-cbc"
+CIPHER_SUITE_AES_256_GCM = "aes-256-gcm"
+CIPHER_SUITE_CHACHA20_POLY1305 = "chacha20-poly1305"
+
+# Nén từng phần trước khi mã hóa; codec được khai báo trong metadata đã ký của file_init
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_LZMA = "lzma"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_AUTO = "auto" # Chỉ ở phía gửi: lấy mẫu đầu file, bỏ qua nén nếu dữ liệu không nén được
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MAX_RATIO = 0.9 # Mẫu phải nhỏ đi ít nhất 10% thì chế độ auto mới bật nén
+
+# Manifest truyền file: bản ghi có chữ ký của metadata và IV, hash, chữ ký, hash bản rõ của từng phần.
+# Người nhận lưu cạnh file đã nhận với hậu tố này để xác minh lại offline.
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+# Gửi theo lô: nhiều file được nối liền thành một luồng và gửi như một file duy nhất (một metadata đã ký,
+# một gốc Merkle, một manifest), nên file nhỏ dùng chung phần. Danh sách file nằm trong metadata đã ký.
+BATCH_VERSION = 1
+MAX_BATCH_FILES = 100000
+
+# Khử trùng lặp theo nội dung: Người gửi khai báo SHA-512 của toàn bộ file trong metadata đã ký; nếu Người nhận
+# đã có nội dung đó trong kho (đánh địa chỉ theo hash) thì liên kết file ngay, không truyền phần nào.
+CONTENT_HASH_FIELD = "content_sha512"
+CONTENT_HASH_BLOCK_SIZE = 1024 * 1024 # Kích thước mỗi lần đọc khi băm toàn bộ file
+
+# Gửi phần khác biệt (kiểu rsync): Người nhận gửi chữ ký từng khối (checksum cuộn Adler-32 và hash mạnh) của bản cũ,
+# Người gửi chỉ gửi các đoạn mới; các đoạn trùng được chép từ bản cũ trên máy Người nhận.
+DELTA_VERSION = 1
+DELTA_MIN_BLOCK_SIZE = 1024
+DELTA_MAX_BLOCKS = 65536 # Giới hạn số khối (kích thước gói chữ ký); file lớn dùng khối lớn hơn
+DELTA_STRONG_HASH_SIZE = 16 # Bytes của hash mạnh (BLAKE2b) mỗi khối; bản dựng lại vẫn được kiểm tra bằng SHA-512
+DELTA_MAX_FILE_SIZE = 256 * 1024 * 1024 # File lớn hơn được gửi toàn bộ (giới hạn kích thước gói chữ ký và thời gian so khớp)
+DELTA_READ_SIZE = 1024 * 1024 # Mỗi lần đọc bản mới khi so khớp; bộ nhớ dùng cỡ một lần đọc cộng đoạn chưa khớp
+DELTA_MAX_LITERAL_RATIO = 0.5 # Dữ liệu mới vượt tỉ lệ này của file thì gửi toàn bộ sẽ rẻ hơn
+# Đoạn liên tiếp không khớp khối nào dài hơn mức này thì dừng so khớp (cuộn từng byte chạy bằng Python, khoảng 1 MB/s):
+# một lần sửa hợp đồng hiếm khi dài vậy, còn file nén (DOCX, PDF nén) đổi toàn bộ và không bao giờ khớp lại
+DELTA_MAX_UNMATCHED_RUN = 256 * 1024
+_ADLER_MOD = 65521
+
+# Nhật ký hoạt động: vòng đệm giữ các mục gần nhất, mỗi mục có số thứ tự để giao diện lấy phần mới
+ACTIVITY_LOG_CAPACITY = 5000
+GET_LOGS_LIMIT = 1000 # Số mục tối đa trả về cho mỗi lần gọi /get_logs
+LOG_DEBUG = "DEBUG"
+LOG_INFO = "INFO"
+LOG_WARNING = "WARNING"
+LOG_ERROR = "ERROR"
+SSE_KEEPALIVE_SECONDS = 15 # Gửi dòng chú thích định kỳ để phát hiện trình duyệt đã đóng luồng sự kiện
+
+# Điều khiển luồng theo cửa sổ trượt: số phần đã gửi nhưng chưa được ACK tối đa,
+# và số lần một phần bị NACK được gửi lại trước khi hủy cả file
+DEFAULT_SEND_WINDOW = 32
+MAX_SEND_WINDOW = 256
+MAX_PART_RETRANSMITS = 3
+
+# Cách bọc khóa phiên trong gói key_exchange, được chọn trong metadata đã ký
+KEY_EXCHANGE_SPLIT = "split"          # Hai lần RSA PKCS#1 v1.5: khóa phiên và IV riêng (tương thích ngược)
+KEY_EXCHANGE_OAEP_WRAP = "oaep-wrap"  # Một lần RSA-OAEP bọc (khóa phiên || IV)
+KEY_EXCHANGE_OAEP_HKDF = "oaep-hkdf"  # Một lần RSA-OAEP bọc bí mật 32 bytes, khóa phiên và IV dẫn xuất bằng HKDF
+KEY_EXCHANGE_MODES = (KEY_EXCHANGE_OAEP_HKDF, KEY_EXCHANGE_OAEP_WRAP, KEY_EXCHANGE_SPLIT)
+DEFAULT_KEY_EXCHANGE_MODE = KEY_EXCHANGE_OAEP_HKDF
+SESSION_SECRET_SIZE = 32
+
+# Vé phiên (session ticket): cho phép kết nối lại mà không cần trao đổi khóa RSA
+SESSION_TICKET_TTL = 3600 # giây
+SESSION_TICKET_CACHE_SIZE = 1024 # Số phiên tối đa Người nhận lưu để nối lại
+_SESSION_TICKET_AAD = b"session-ticket-v1"
+
+# Chế độ xác thực các phần file
+AUTH_MODE_PER_CHUNK = "per_chunk" # Mỗi phần có một chữ ký RSA riêng
+AUTH_MODE_MERKLE = "merkle"       # Mỗi phần chỉ mang SHA-512, một chữ ký RSA duy nhất trên gốc cây Merkle
+AUTH_MODES = (AUTH_MODE_PER_CHUNK, AUTH_MODE_MERKLE)
+DEFAULT_AUTH_MODE = AUTH_MODE_MERKLE
+
+# Pipeline gửi: số luồng mã hóa/băm/ký và số phần đã chuẩn bị tối đa chờ ghi ra socket
+DEFAULT_CRYPTO_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+DEFAULT_PIPELINE_DEPTH = 8
+
+# Số byte tối đa đọc trong mỗi lần gọi recv_into khi nhận dữ liệu (có thể truyền tham số khác)
+BUFFER_SIZE = 256 * 1024 # 256KB
+
+# Kích thước tối đa của một gói dữ liệu; gói lớn hơn bị coi là lỗi giao thức
+MAX_FRAME_SIZE = 64 * 1024 * 1024 # 64MB
+
+# Định dạng khung dữ liệu trên đường truyền, được thương lượng trong gói handshake.
+# Gói điều khiển luôn là JSON; gói dữ liệu (file_chunk) dùng khung nhị phân nếu hai bên hỗ trợ.
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary-v1"
+SUPPORTED_WIRE_FORMATS = (WIRE_FORMAT_BINARY, WIRE_FORMAT_JSON)
+
+# Khung nhị phân: MAGIC(1) | VERSION(1) | HEADER_LEN(4) | HEADER | PAYLOAD
+# HEADER gồm các trường: NAME_LEN(1) | NAME | TYPE(1) | VALUE_LEN(4) | VALUE
+# Byte MAGIC khác '{' nên bên nhận phân biệt được với gói JSON.
+BINARY_FRAME_MAGIC = 0xB1
+BINARY_FRAME_VERSION = 1
+_FRAME_PREFIX = struct.Struct("!BBI")
+_FIELD_PREFIX = struct.Struct("!BI")
+_FIELD_BYTES = 1
+_FIELD_STR = 2
+_FIELD_INT = 3
+_FIELD_JSON = 4
+_FIELD_PAYLOAD = 5 # Đánh dấu tên trường chứa phần dữ liệu thô nằm sau HEADER
+# Payload nhỏ hơn ngưỡng này được ghép với HEADER để gửi trong một lần sendall
+_SMALL_PAYLOAD_SIZE = 64 * 1024
 
 # Kích thước khóa RSA mặc định (bits)
 RSA_KEY_SIZE = 2048 
 
+# Kích thước mỗi phần file khi gửi ở chế độ streaming (đọc, mã hóa, ký và gửi từng phần)
+STREAM_CHUNK_SIZE = 1024 * 1024 # 1MB
+
+# Các chính sách chia phần file
+CHUNK_MODE_FIXED = "fixed"  # Kích thước phần cố định
+CHUNK_MODE_PARTS = "parts"  # Số phần mục tiêu cố định
+CHUNK_MODE_AUTO = "auto"    # Tự điều chỉnh theo kích thước file và thông lượng đường truyền
+CHUNK_MODES = (CHUNK_MODE_FIXED, CHUNK_MODE_PARTS, CHUNK_MODE_AUTO)
+
+# Giới hạn kích thước phần file cho chế độ auto
+MIN_CHUNK_SIZE = 64 * 1024 # 64KB
+MAX_CHUNK_SIZE = 16 * 1024 * 1024 # 16MB
+# Chế độ auto chọn kích thước sao cho mỗi phần mất khoảng thời gian này để truyền
+AUTO_CHUNK_TARGET_SECONDS = 0.25
+# Thông lượng giả định (bytes/giây) khi chưa đo được thông lượng thực tế
+DEFAULT_LINK_THROUGHPUT = 10 * 1024 * 1024 # 10MB/s
+
 def get_random_bytes(num_bytes):
     """Tạo số byte ngẫu nhiên an toàn bằng mật mã."""
     return Random.get_random_bytes(num_bytes)
 
+def plan_chunks(file_size, mode=CHUNK_MODE_AUTO, chunk_size=None, num_parts=None, throughput=None):
+    """
+    Tính số phần và kích thước mỗi phần khi chia file theo chính sách đã chọn.
+
+    Args:
+        file_size (int): Kích thước file (bytes).
+        mode (str): Một trong CHUNK_MODES.
+        chunk_size (int): Kích thước phần cho chế độ "fixed". Mặc định STREAM_CHUNK_SIZE.
+        num_parts (int): Số phần mục tiêu cho chế độ "parts".
+        throughput (float): Thông lượng đo được (bytes/giây) cho chế độ "auto".
+
+    Returns:
+        tuple: (num_parts, chunk_size). Phần cuối có thể nhỏ hơn chunk_size;
+        file rỗng luôn có đúng 1 phần rỗng. Ở mọi chế độ chunk_size không vượt MAX_CHUNK_SIZE,
+        giới hạn Người nhận kiểm tra ở file_init (gói của một phần luôn nằm trong MAX_FRAME_SIZE).
+
+    Raises:
+        ValueError: Chế độ không hợp lệ, hoặc kích thước phần "fixed" ngoài khoảng 1..MAX_CHUNK_SIZE.
+    """
+    if mode == CHUNK_MODE_FIXED:
+        chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        if chunk_size > MAX_CHUNK_SIZE:
+            raise ValueError(f"Kích thước phần file {chunk_size} vượt quá giới hạn {MAX_CHUNK_SIZE} bytes")
+    elif mode == CHUNK_MODE_PARTS:
+        if not num_parts or num_parts < 1:
+            raise ValueError(f"Số phần mục tiêu không hợp lệ: {num_parts}")
+        # File lớn được chia thành nhiều phần hơn số mục tiêu thay vì tạo phần quá lớn
+        chunk_size = min(MAX_CHUNK_SIZE, max(1, -(-file_size // num_parts)))
+    elif mode == CHUNK_MODE_AUTO:
+        throughput = throughput or DEFAULT_LINK_THROUGHPUT
+        chunk_size = int(throughput * AUTO_CHUNK_TARGET_SECONDS)
+        chunk_size = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, chunk_size))
+        # File nhỏ chỉ cần một phần (một chữ ký RSA)
+        chunk_size = min(chunk_size, max(1, file_size))
+    else:
+        raise ValueError(f"Chính sách chia phần không hợp lệ: {mode}")
+    if chunk_size <= 0:
+        raise ValueError(f"Kích thước phần file không hợp lệ: {chunk_size}")
+    return max(1, -(-file_size // chunk_size)), chunk_size
+
+def part_length(file_size, chunk_size, part_number):
+    """
+    Tính kích thước dữ liệu gốc (chưa mã hóa) của một phần file.
+
+    Args:
+        file_size (int): Kích thước file (bytes).
+        chunk_size (int): Kích thước mỗi phần.
+        part_number (int): Số thứ tự phần (bắt đầu từ 0).
+
+    Returns:
+        int: Số byte của phần đó.
+    """
+    return max(0, min(chunk_size, file_size - part_number * chunk_size))
+
 def generate_rsa_keys(private_key_path, public_key_path, key_size=RSA_KEY_SIZE):
     """
     Tạo cặp khóa RSA (khóa riêng tư và khóa công khai) và lưu vào file PEM.
@@ -68,6 +261,7 @@ def load_rsa_public_key(file_path):
         public_key = RSA.import_key(f.read())
     return public_key
 
+@timed(CRYPTO_SECONDS, "rsa_encrypt", "pkcs1v15")
 def rsa_encrypt(data, public_key):
     """
     Mã hóa dữ liệu bằng khóa công khai RSA (sử dụng PKCS1_v1_5).
@@ -82,6 +276,7 @@ def rsa_encrypt(data, public_key):
     cipher_rsa = PKCS1_v1_5.new(public_key)
     return cipher_rsa.encrypt(data)
 
+@timed(CRYPTO_SECONDS, "rsa_decrypt", "pkcs1v15")
 def rsa_decrypt(encrypted_data, private_key):
     """
     Giải mã dữ liệu bằng khóa riêng tư RSA (sử dụng PKCS1_v1_5).
@@ -100,6 +295,70 @@ def rsa_decrypt(encrypted_data, private_key):
     # Do đó, chỉ cần truyền dữ liệu mã hóa vào.
     return cipher_rsa.decrypt(encrypted_data, None) # None là random_bytes_generator, không dùng cho decrypt
 
+@timed(CRYPTO_SECONDS, "rsa_encrypt", "oaep-sha512")
+def rsa_oaep_encrypt(data, public_key):
+    """
+    Mã hóa dữ liệu bằng khóa công khai RSA (RSA-OAEP với SHA-512).
+
+    Args:
+        data (bytes): Dữ liệu cần mã hóa (tối đa 126 bytes với khóa 2048 bit).
+        public_key (Crypto.PublicKey.RSA._RSAobj): Đối tượng khóa công khai RSA.
+
+    Returns:
+        bytes: Dữ liệu đã mã hóa.
+    """
+    return PKCS1_OAEP.new(public_key, hashAlgo=SHA512).encrypt(data)
+
+@timed(CRYPTO_SECONDS, "rsa_decrypt", "oaep-sha512")
+def rsa_oaep_decrypt(encrypted_data, private_key):
+    """
+    Giải mã dữ liệu RSA-OAEP (SHA-512) bằng khóa riêng tư RSA.
+
+    Args:
+        encrypted_data (bytes): Dữ liệu đã mã hóa.
+        private_key (Crypto.PublicKey.RSA._RSAobj): Đối tượng khóa riêng tư RSA.
+
+    Returns:
+        bytes or None: Dữ liệu đã giải mã, hoặc None nếu padding không hợp lệ.
+    """
+    try:
+        return PKCS1_OAEP.new(private_key, hashAlgo=SHA512).decrypt(encrypted_data)
+    except ValueError:
+        return None
+
+def derive_session_material(secret, key_size, iv_size, context=b""):
+    """
+    Dẫn xuất khóa phiên và IV từ một bí mật chung bằng HKDF-SHA512.
+
+    Args:
+        secret (bytes): Bí mật đã trao đổi qua RSA.
+        key_size (int): Độ dài khóa phiên cần (bytes).
+        iv_size (int): Độ dài IV cần (bytes).
+        context (bytes): Thông tin gắn vào phép dẫn xuất (ví dụ tên bộ mã hóa).
+
+    Returns:
+        tuple: (session_key, session_iv).
+    """
+    material = HKDF(secret, key_size + iv_size, b"", SHA512, context=b"session-material|" + context)
+    return material[:key_size], material[key_size:]
+
+# Các trường của gói key_exchange chứa dữ liệu đã mã hóa RSA
+KEY_MATERIAL_FIELDS = ("encrypted_session_iv", "encrypted_session_key", "encrypted_session_material")
+
+def key_material_digest(data_packet):
+    """
+    SHA-512 của các trường đã mã hóa RSA (theo thứ tự KEY_MATERIAL_FIELDS) trong gói key_exchange,
+    được ghi vào metadata đã ký để gắn chữ ký với đúng khóa phiên đã gửi.
+
+    Args:
+        data_packet (dict): Gói key_exchange (giá trị các trường là chuỗi Base64).
+
+    Returns:
+        str: Giá trị băm dạng Base64.
+    """
+    return b64encode(compute_sha512(b"", *(b64decode(data_packet[field]) for field in KEY_MATERIAL_FIELDS if data_packet.get(field)))).decode('utf-8')
+
+@timed(CRYPTO_SECONDS, "encrypt", CIPHER_SUITE_3DES_CBC)
 def encrypt_triple_des(data, key, iv, include_iv_in_output=False):
     """
     Mã hóa dữ liệu bằng Triple DES ở chế độ CBC.
@@ -121,6 +380,7 @@ def encrypt_triple_des(data, key, iv, include_iv_in_output=False):
         return iv + ciphertext
     return ciphertext
 
+@timed(CRYPTO_SECONDS, "decrypt", CIPHER_SUITE_3DES_CBC)
 def decrypt_triple_des(encrypted_data, key, iv, unpad_output=False):
     """
     Giải mã dữ liệu bằng Triple DES ở chế độ CBC.
@@ -144,20 +404,423 @@ def decrypt_triple_des(encrypted_data, key, iv, unpad_output=False):
     return decrypted_padded_data
 
 
-def compute_sha512(data):
+class TripleDesCbcSuite:
+    """Triple DES chế độ CBC (tương thích ngược). Toàn vẹn dựa vào SHA-512 của (IV || ciphertext)."""
+    name = CIPHER_SUITE_3DES_CBC
+    key_size = 24
+    iv_size = 8
+    aead = False
+
+    def encrypt(self, data, key, iv, aad=None):
+        return encrypt_triple_des(data, key, iv)
+
+    def decrypt(self, encrypted_data, key, iv, aad=None):
+        return decrypt_triple_des(encrypted_data, key, iv, unpad_output=True)
+
+class _AeadSuite:
+    """Cơ sở cho các bộ mã hóa AEAD: ciphertext được gắn thêm tag 16 bytes ở cuối."""
+    key_size = 32
+    iv_size = 12
+    tag_size = 16
+    aead = True
+
+    def _new(self, key, iv):
+        raise NotImplementedError
+
+    def encrypt(self, data, key, iv, aad=None):
+        with CRYPTO_SECONDS.time("encrypt", self.name):
+            cipher = self._new(key, iv)
+            if aad:
+                cipher.update(aad)
+            ciphertext, tag = cipher.encrypt_and_digest(data)
+            return ciphertext + tag
+
+    def decrypt(self, encrypted_data, key, iv, aad=None):
+        if len(encrypted_data) < self.tag_size:
+            raise ValueError("Dữ liệu mã hóa ngắn hơn tag xác thực.")
+        view = memoryview(encrypted_data)
+        with CRYPTO_SECONDS.time("decrypt", self.name):
+            cipher = self._new(key, iv)
+            if aad:
+                cipher.update(aad)
+            # decrypt_and_verify báo ValueError nếu tag không khớp (dữ liệu bị thay đổi hoặc sai khóa)
+            return cipher.decrypt_and_verify(view[:-self.tag_size], view[-self.tag_size:])
+
+class AesGcmSuite(_AeadSuite):
+    """AES-256-GCM (tăng tốc phần cứng AES-NI): mã hóa và xác thực trong một lượt."""
+    name = CIPHER_SUITE_AES_256_GCM
+
+    def _new(self, key, iv):
+        return AES.new(key, AES.MODE_GCM, nonce=iv)
+
+class ChaCha20Poly1305Suite(_AeadSuite):
+    """ChaCha20-Poly1305: nhanh trên máy không có AES-NI."""
+    name = CIPHER_SUITE_CHACHA20_POLY1305
+
+    def _new(self, key, iv):
+        return ChaCha20_Poly1305.new(key=key, nonce=iv)
+
+CIPHER_SUITES = {suite.name: suite for suite in (AesGcmSuite(), ChaCha20Poly1305Suite(), TripleDesCbcSuite())}
+# Thứ tự ưu tiên khi thương lượng
+SUPPORTED_CIPHER_SUITES = (CIPHER_SUITE_AES_256_GCM, CIPHER_SUITE_CHACHA20_POLY1305, CIPHER_SUITE_3DES_CBC)
+DEFAULT_CIPHER_SUITE = CIPHER_SUITE_AES_256_GCM
+
+def get_cipher_suite(name):
+    """
+    Lấy bộ mã hóa theo tên.
+
+    Args:
+        name (str): Tên bộ mã hóa (ví dụ "aes-256-gcm").
+
+    Returns:
+        Đối tượng bộ mã hóa với encrypt/decrypt, key_size, iv_size, aead.
+    """
+    try:
+        return CIPHER_SUITES[name]
+    except KeyError:
+        raise ValueError(f"Bộ mã hóa không được hỗ trợ: {name}")
+
+def negotiate_cipher_suite(preferred_suites, peer_suites):
+    """
+    Chọn bộ mã hóa đầu tiên theo thứ tự ưu tiên của bên gửi mà bên nhận cũng hỗ trợ.
+
+    Args:
+        preferred_suites (list): Các bộ mã hóa theo thứ tự ưu tiên của bên gửi.
+        peer_suites (list): Các bộ mã hóa bên nhận hỗ trợ. None nghĩa là bên nhận cũ (chỉ có 3DES).
+
+    Returns:
+        str: Tên bộ mã hóa được chọn.
+    """
+    if peer_suites is None:
+        return CIPHER_SUITE_3DES_CBC
+    for name in preferred_suites:
+        if name in peer_suites and name in CIPHER_SUITES:
+            return name
+    raise ValueError("Không có bộ mã hóa chung giữa hai bên.")
+
+def chunk_digest(suite, iv, encrypted_data):
+    """
+    Tính giá trị băm dùng để ký/dựng cây Merkle cho một phần file.
+
+    Với bộ mã hóa thường là SHA-512(IV || ciphertext). Với bộ AEAD, tag đã xác thực toàn bộ
+    ciphertext trong lúc giải mã nên chỉ cần băm (IV || tag), bỏ được lượt băm toàn bộ dữ liệu.
+    Lưu ý: tag là MAC dùng khóa phiên, ai giữ khóa phiên (kể cả bên nhận) đều có thể tạo ciphertext
+    khác cùng tag, nên chữ ký trên hash này chỉ chống chối bỏ với bên thứ ba kém hơn so với 3DES-CBC.
+
+    Args:
+        suite: Bộ mã hóa từ get_cipher_suite.
+        iv (bytes): IV/nonce của phần file.
+        encrypted_data (bytes-like): Ciphertext (đã gồm tag với AEAD).
+
+    Returns:
+        bytes: Giá trị băm SHA-512.
+    """
+    if suite.aead:
+        return compute_sha512(iv, memoryview(encrypted_data)[-suite.tag_size:])
+    return compute_sha512(iv, encrypted_data)
+
+def chunk_aad(file_id, part_number):
+    """Dữ liệu liên kết (AAD) của một phần file: gắn ciphertext với file_id và vị trí phần."""
+    return f"{file_id}:{part_number}".encode('utf-8')
+
+class ZlibCodec:
+    """zlib (DEFLATE), luôn có sẵn trong thư viện chuẩn."""
+    name = COMPRESSION_ZLIB
+
+    def compress(self, data):
+        return zlib.compress(data, 6)
+
+    def decompress(self, data, max_size):
+        decompressor = zlib.decompressobj()
+        output = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError(f"Dữ liệu nén zlib không hợp lệ hoặc vượt quá {max_size} bytes.")
+        return output
+
+class LzmaCodec:
+    """LZMA (xz): tỉ lệ nén cao nhất nhưng chậm, hợp với đường truyền chậm."""
+    name = COMPRESSION_LZMA
+
+    def compress(self, data):
+        return lzma.compress(data)
+
+    def decompress(self, data, max_size):
+        decompressor = lzma.LZMADecompressor()
+        output = decompressor.decompress(data, max_size)
+        if not decompressor.eof or decompressor.unused_data:
+            raise ValueError(f"Dữ liệu nén lzma không hợp lệ hoặc vượt quá {max_size} bytes.")
+        return output
+
+class ZstdCodec:
+    """Zstandard: nén gần bằng zlib nhưng nhanh hơn nhiều (cần gói zstandard)."""
+    name = COMPRESSION_ZSTD
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def decompress(self, data, max_size):
+        data = bytes(data)
+        # Kích thước trong header frame quyết định bộ nhớ cấp phát: kiểm tra trước khi giải nén
+        if zstandard.frame_content_size(data) > max_size:
+            raise ValueError(f"Dữ liệu nén zstd vượt quá {max_size} bytes.")
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+
+COMPRESSION_CODECS = {codec.name: codec for codec in (ZlibCodec(), LzmaCodec()) + ((ZstdCodec(),) if zstandard else ())}
+# Thứ tự ưu tiên của chế độ auto: codec nhanh trước (lzma chỉ dùng khi được chọn rõ ràng)
+AUTO_COMPRESSION_CODECS = (COMPRESSION_ZSTD, COMPRESSION_ZLIB)
+_CHUNK_STORED = 0
+_CHUNK_COMPRESSED = 1
+
+def get_compression_codec(name):
+    """
+    Lấy codec nén theo tên đã khai báo trong metadata.
+
+    Args:
+        name (str): Tên codec, hoặc "none".
+
+    Returns:
+        Đối tượng codec với compress/decompress, hoặc None nếu không nén.
+    """
+    if name in (None, COMPRESSION_NONE):
+        return None
+    try:
+        return COMPRESSION_CODECS[name]
+    except KeyError:
+        raise ValueError(f"Codec nén không được hỗ trợ: {name}")
+
+def compression_ratio(codec, sample):
+    """
+    Tỉ lệ kích thước sau nén / trước nén của một mẫu dữ liệu (1.0 nếu mẫu rỗng).
+
+    Args:
+        codec: Codec từ get_compression_codec.
+        sample (bytes): Dữ liệu mẫu, thường là đầu file.
+
+    Returns:
+        float: Tỉ lệ nén; nhỏ hơn COMPRESSION_MAX_RATIO thì nên bật nén.
+    """
+    if not sample:
+        return 1.0
+    return len(codec.compress(sample)) / len(sample)
+
+def compress_chunk(codec, data):
+    """
+    Nén một phần file trước khi mã hóa.
+
+    Byte đầu tiên cho biết phần có được nén hay không: phần không nhỏ đi (dữ liệu đã nén sẵn,
+    ảnh trong PDF...) được giữ nguyên. Byte này nằm trong bản rõ nên được mã hóa và xác thực cùng dữ liệu.
+
+    Args:
+        codec: Codec từ get_compression_codec.
+        data (bytes): Bản rõ của phần file.
+
+    Returns:
+        bytes: Byte cờ theo sau là dữ liệu (đã nén hoặc nguyên bản).
+    """
+    compressed = codec.compress(data)
+    if len(compressed) < len(data):
+        return bytes([_CHUNK_COMPRESSED]) + compressed
+    return bytes([_CHUNK_STORED]) + data
+
+def decompress_chunk(codec, data, expected_length):
+    """
+    Giải nén một phần file sau khi giải mã (ngược với compress_chunk).
+
+    Args:
+        codec: Codec từ get_compression_codec.
+        data (bytes-like): Dữ liệu đã giải mã, gồm byte cờ ở đầu.
+        expected_length (int): Kích thước bản rõ của phần, dùng để chặn dữ liệu nén phình to bất thường.
+
+    Returns:
+        bytes: Bản rõ của phần file.
+    """
+    view = memoryview(data)
+    if not view:
+        raise ValueError("Phần file nén rỗng.")
+    if view[0] == _CHUNK_STORED:
+        if len(view) - 1 != expected_length:
+            raise ValueError(f"Kích thước phần không nén {len(view) - 1} bytes (dự kiến {expected_length}).")
+        return bytes(view[1:])
+    if view[0] != _CHUNK_COMPRESSED:
+        raise ValueError(f"Cờ nén không hợp lệ: {view[0]}")
+    output = codec.decompress(view[1:], expected_length)
+    if len(output) != expected_length:
+        raise ValueError(f"Kích thước sau giải nén {len(output)} bytes (dự kiến {expected_length}).")
+    return output
+
+@timed(CRYPTO_SECONDS, "hash", "sha512")
+def compute_sha512(data, *more_data):
     """
     Tính toán hàm băm SHA512 của dữ liệu.
 
     Args:
         data (bytes): Dữ liệu cần băm.
+        *more_data (bytes): Các đoạn dữ liệu nối tiếp (băm như data + more_data mà không cần ghép chuỗi).
 
     Returns:
         bytes: Giá trị băm SHA512.
     """
-    h = SHA512.new()
-    h.update(data)
+    # hashlib (OpenSSL) nhanh gấp đôi Crypto.Hash.SHA512 và nhả GIL với dữ liệu lớn, kết quả giống hệt
+    h = hashlib.sha512(data)
+    for extra in more_data:
+        h.update(extra)
     return h.digest()
 
+def stream_sha512(stream, block_size=CONTENT_HASH_BLOCK_SIZE):
+    """
+    Tính SHA-512 của phần còn lại của một luồng, đọc tuần tự từng khối để không giữ cả file trong bộ nhớ.
+
+    Args:
+        stream: Luồng nhị phân đọc được (file, BytesIO...); được đọc từ vị trí hiện tại tới hết.
+        block_size (int): Số byte mỗi lần đọc.
+
+    Returns:
+        str: Giá trị băm SHA-512 dạng hex.
+    """
+    h = hashlib.sha512()
+    for block in iter(lambda: stream.read(block_size), b""):
+        h.update(block)
+    return h.hexdigest()
+
+def delta_block_size(size):
+    """
+    Kích thước khối cho chữ ký của một bản cũ: khoảng căn bậc hai kích thước file (như rsync),
+    không nhỏ hơn DELTA_MIN_BLOCK_SIZE và đủ lớn để không quá DELTA_MAX_BLOCKS khối.
+
+    Args:
+        size (int): Kích thước bản cũ (bytes).
+
+    Returns:
+        int: Kích thước khối (bytes).
+    """
+    return max(DELTA_MIN_BLOCK_SIZE, math.isqrt(size) // 64 * 64, -(-size // DELTA_MAX_BLOCKS))
+
+def _delta_strong_hash(block):
+    return hashlib.blake2b(block, digest_size=DELTA_STRONG_HASH_SIZE).digest()
+
+def delta_signatures(stream, block_size):
+    """
+    Tính chữ ký từng khối của bản cũ trong một lượt đọc tuần tự.
+
+    Args:
+        stream: Luồng nhị phân của bản cũ, đọc từ vị trí hiện tại tới hết.
+        block_size (int): Kích thước khối; khối cuối có thể ngắn hơn.
+
+    Returns:
+        tuple: (list[int] checksum Adler-32 từng khối, bytes các hash mạnh nối liền, str SHA-512 hex của cả bản cũ).
+    """
+    weak, strong = [], []
+    content_hash = hashlib.sha512()
+    for block in iter(lambda: stream.read(block_size), b""):
+        weak.append(zlib.adler32(block))
+        strong.append(_delta_strong_hash(block))
+        content_hash.update(block)
+    return weak, b"".join(strong), content_hash.hexdigest()
+
+def compute_delta(stream, size, block_size, weak, strong, base_size, max_literal):
+    """
+    So khớp bản mới với chữ ký của bản cũ (thuật toán rsync): khi khớp một khối thì nhảy cả khối,
+    không khớp thì cuộn checksum thêm một byte, nên chỉ các vùng đã sửa mới phải duyệt từng byte.
+    Bản mới được đọc tuần tự qua một cửa sổ trượt, không nạp cả file vào bộ nhớ.
+
+    Args:
+        stream: Luồng nhị phân của bản mới, đọc từ vị trí hiện tại (không tự quay lại vị trí ban đầu).
+        size (int): Kích thước bản mới (bytes).
+        block_size (int): Kích thước khối của chữ ký.
+        weak (list[int]): Checksum Adler-32 từng khối của bản cũ.
+        strong (bytes): Hash mạnh từng khối của bản cũ, nối liền.
+        base_size (int): Kích thước bản cũ (để biết độ dài khối cuối).
+        max_literal (int): Dừng sớm khi dữ liệu mới vượt ngưỡng này.
+
+    Returns:
+        tuple | None: (ops, literals) hoặc None nếu dữ liệu mới vượt max_literal hoặc có đoạn không khớp
+        dài hơn DELTA_MAX_UNMATCHED_RUN. ops là danh sách
+        [vị trí trong bản cũ, độ dài] (vị trí None: lấy độ dài đó từ dữ liệu mới, theo thứ tự);
+        literals là danh sách (vị trí trong bản mới, độ dài) của dữ liệu mới cần gửi.
+    """
+    blocks = {}
+    last_block = None
+    for index, checksum in enumerate(weak):
+        if index * block_size + block_size <= base_size:
+            blocks.setdefault(checksum, []).append(index)
+        else:
+            last_block = index  # Khối cuối ngắn hơn chỉ có thể khớp với phần cuối bản mới
+    ops, literals = [], []
+    literal_size = 0
+    # Cửa sổ đọc: buf chứa bản mới từ vị trí buf_start tới buf_end; phần trước literal_start được bỏ đi
+    # (đoạn chưa khớp bị giới hạn bởi DELTA_MAX_UNMATCHED_RUN nên cửa sổ không lớn quá một lần đọc nhiều)
+    buf, buf_start, buf_end = b"", 0, 0
+
+    def fill(end):
+        nonlocal buf, buf_start, buf_end
+        keep = literal_start - buf_start
+        data = stream.read(min(size, max(end, buf_end + DELTA_READ_SIZE)) - buf_end)
+        buf = buf[keep:] + data
+        buf_start = literal_start
+        buf_end += len(data)
+        if buf_end < min(end, size):
+            raise ValueError("Luồng bản mới ngắn hơn kích thước đã khai báo.")
+
+    def emit_literal(start, end):
+        nonlocal literal_size
+        if end > start:
+            ops.append([None, end - start])
+            literals.append((start, end - start))
+            literal_size += end - start
+
+    def emit_copy(offset, length):
+        if ops and ops[-1][0] is not None and ops[-1][0] + ops[-1][1] == offset:
+            ops[-1][1] += length
+        else:
+            ops.append([offset, length])
+
+    def match_at(position, length, candidates):
+        digest = _delta_strong_hash(buf[position - buf_start:position - buf_start + length])
+        for index in candidates:
+            if strong[index * DELTA_STRONG_HASH_SIZE:(index + 1) * DELTA_STRONG_HASH_SIZE] == digest:
+                return index
+        return None
+
+    position = literal_start = 0
+    a = b = None
+    while position + block_size <= size:
+        # Cần thêm một byte sau khối cho lần cuộn tiếp theo
+        if position + block_size + 1 > buf_end and buf_end < size:
+            fill(position + block_size + 1)
+        if a is None:
+            checksum = zlib.adler32(buf[position - buf_start:position - buf_start + block_size])
+            a, b = checksum & 0xffff, checksum >> 16
+        candidates = blocks.get((b << 16) | a)
+        index = match_at(position, block_size, candidates) if candidates else None
+        if index is not None:
+            emit_literal(literal_start, position)
+            emit_copy(index * block_size, block_size)
+            position += block_size
+            literal_start = position
+            a = None
+            continue
+        if literal_size + position + 1 - literal_start > max_literal or position - literal_start >= DELTA_MAX_UNMATCHED_RUN:
+            return None
+        # Cuộn cửa sổ sang phải một byte: bỏ byte đầu, thêm byte kế tiếp
+        if position + block_size < size:
+            removed, added = buf[position - buf_start], buf[position - buf_start + block_size]
+            a = (a - removed + added) % _ADLER_MOD
+            b = (b - block_size * removed + a - 1) % _ADLER_MOD
+        position += 1
+    if last_block is not None:
+        if buf_end < size:
+            fill(size)
+        length = base_size - last_block * block_size
+        if size - length >= literal_start and match_at(size - length, length, [last_block]) is not None:
+            emit_literal(literal_start, size - length)
+            emit_copy(last_block * block_size, length)
+            literal_start = size
+    emit_literal(literal_start, size)
+    if literal_size > max_literal:
+        return None
+    return ops, literals
+
+@timed(CRYPTO_SECONDS, "sign", "rsa-pkcs1v15-sha512")
 def sign_data(data_hash, private_key):
     """
     Ký giá trị băm của dữ liệu bằng khóa riêng tư RSA.
@@ -172,6 +835,7 @@ def sign_data(data_hash, private_key):
     signer = pkcs1_15.new(private_key)
     return signer.sign(SHA512.new(data_hash)) # pkcs1_15.sign mong đợi một đối tượng hash
 
+@timed(CRYPTO_SECONDS, "verify", "rsa-pkcs1v15-sha512")
 def verify_signature(data_hash, signature, public_key):
     """
     Xác minh chữ ký số của dữ liệu bằng khóa công khai RSA.
@@ -191,6 +855,301 @@ def verify_signature(data_hash, signature, public_key):
     except (ValueError, TypeError):
         return False
 
+def public_key_fingerprint(public_key):
+    """
+    Dấu vân tay của khóa công khai RSA: SHA-512 (hex) của khóa dạng DER.
+
+    Args:
+        public_key (Crypto.PublicKey.RSA._RSAobj): Đối tượng khóa công khai RSA.
+
+    Returns:
+        str: Dấu vân tay dạng hex.
+    """
+    return compute_sha512(public_key.export_key(format='DER')).hex()
+
+def _session_mac(session_key, label, parts):
+    mac = HMAC.new(session_key, digestmod=SHA512)
+    mac.update(label)
+    for part in parts:
+        mac.update(part)
+    return mac
+
+def session_proof(session_key, label, *parts):
+    """
+    Bằng chứng sở hữu khóa phiên: HMAC-SHA512 của nhãn và các đoạn dữ liệu đi kèm.
+
+    Args:
+        session_key (bytes): Khóa phiên.
+        label (bytes): Nhãn phân biệt mục đích (ví dụ b"session-resume").
+        *parts (bytes): Dữ liệu được gắn vào bằng chứng (vé phiên, nonce...).
+
+    Returns:
+        bytes: Giá trị HMAC.
+    """
+    return _session_mac(session_key, label, parts).digest()
+
+def verify_session_proof(session_key, proof, label, *parts):
+    """Kiểm tra bằng chứng từ session_proof (so sánh thời gian hằng). Trả về True nếu hợp lệ."""
+    try:
+        _session_mac(session_key, label, parts).verify(proof)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+def seal_session_ticket(ticket_key, ticket_state):
+    """
+    Mã hóa nội dung vé phiên bằng khóa vé của Người nhận (AES-256-GCM).
+
+    Args:
+        ticket_key (bytes): Khóa vé 32 bytes, chỉ Người nhận biết.
+        ticket_state (dict): Nội dung vé (có thể tuần tự hóa JSON).
+
+    Returns:
+        bytes: nonce || ciphertext || tag.
+    """
+    suite = get_cipher_suite(CIPHER_SUITE_AES_256_GCM)
+    nonce = get_random_bytes(suite.iv_size)
+    plaintext = json.dumps(ticket_state, sort_keys=True).encode('utf-8')
+    return nonce + suite.encrypt(plaintext, ticket_key, nonce, _SESSION_TICKET_AAD)
+
+def open_session_ticket(ticket_key, ticket):
+    """
+    Giải mã và xác thực vé phiên do seal_session_ticket tạo.
+
+    Args:
+        ticket_key (bytes): Khóa vé của Người nhận.
+        ticket (bytes): Vé phiên nhận từ Người gửi.
+
+    Returns:
+        dict: Nội dung vé.
+
+    Raises:
+        ValueError: Vé bị sửa đổi, sai khóa hoặc không đúng định dạng.
+    """
+    suite = get_cipher_suite(CIPHER_SUITE_AES_256_GCM)
+    if len(ticket) < suite.iv_size + suite.tag_size:
+        raise ValueError("Vé phiên quá ngắn.")
+    plaintext = suite.decrypt(ticket[suite.iv_size:], ticket_key, ticket[:suite.iv_size], _SESSION_TICKET_AAD)
+    return json.loads(bytes(plaintext).decode('utf-8'))
+
+def _merkle_leaf_node(leaf_hash):
+    # Tiền tố 0x00/0x01 phân biệt nút lá và nút trong, tránh giả mạo nút trong thành nút lá
+    return compute_sha512(b"\x00", leaf_hash)
+
+def _merkle_inner_node(left, right):
+    return compute_sha512(b"\x01", left, right)
+
+def build_merkle_tree(leaf_hashes):
+    """
+    Xây dựng cây Merkle từ giá trị băm SHA-512 của các phần file.
+
+    Args:
+        leaf_hashes (list): Danh sách hash (bytes) của từng phần, theo thứ tự phần.
+
+    Returns:
+        list: Các tầng của cây, tầng 0 là các nút lá, tầng cuối chỉ chứa gốc cây.
+        Nút lẻ ở cuối một tầng được đưa thẳng lên tầng trên (không nhân đôi).
+    """
+    if not leaf_hashes:
+        raise ValueError("Cây Merkle cần ít nhất một phần.")
+    levels = [[_merkle_leaf_node(h) for h in leaf_hashes]]
+    while len(levels[-1]) > 1:
+        current = levels[-1]
+        parent = [_merkle_inner_node(current[i], current[i + 1]) for i in range(0, len(current) - 1, 2)]
+        if len(current) % 2:
+            parent.append(current[-1])
+        levels.append(parent)
+    return levels
+
+def merkle_root(tree):
+    """
+    Lấy gốc của cây Merkle.
+
+    Args:
+        tree (list): Cây Merkle từ build_merkle_tree.
+
+    Returns:
+        bytes: Gốc cây Merkle.
+    """
+    return tree[-1][0]
+
+def merkle_proof(tree, index):
+    """
+    Tạo bằng chứng Merkle cho một phần file.
+
+    Args:
+        tree (list): Cây Merkle từ build_merkle_tree.
+        index (int): Số thứ tự phần (bắt đầu từ 0).
+
+    Returns:
+        list: Danh sách (side, sibling_hash) từ lá lên gốc; side là "L" nếu nút anh em nằm bên trái.
+    """
+    proof = []
+    for level in tree[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(("L" if sibling < index else "R", level[sibling]))
+        index //= 2
+    return proof
+
+def verify_merkle_proof(leaf_hash, proof, root):
+    """
+    Xác minh hash của một phần file thuộc cây Merkle có gốc đã cho.
+
+    Args:
+        leaf_hash (bytes): Hash SHA-512 của phần file (IV || ciphertext).
+        proof (list): Bằng chứng từ merkle_proof.
+        root (bytes): Gốc cây Merkle (đã được xác minh chữ ký).
+
+    Returns:
+        bool: True nếu bằng chứng hợp lệ.
+    """
+    node = _merkle_leaf_node(leaf_hash)
+    for side, sibling in proof:
+        node = _merkle_inner_node(sibling, node) if side == "L" else _merkle_inner_node(node, sibling)
+    return node == root
+
+def encode_merkle_proof(proof):
+    """Chuyển bằng chứng Merkle sang dạng JSON được (hash ở dạng Base64)."""
+    return [[side, b64encode(sibling).decode('utf-8')] for side, sibling in proof]
+
+def decode_merkle_proof(encoded_proof):
+    """Chuyển bằng chứng Merkle dạng JSON (từ encode_merkle_proof) về dạng bytes."""
+    return [(side, b64decode(sibling)) for side, sibling in encoded_proof]
+
+def _manifest_digest(manifest):
+    return compute_sha512(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+
+def sign_transfer_manifest(manifest, private_key):
+    """
+    Ký manifest truyền file (JSON chuẩn hóa với sort_keys, giống cách ký metadata file).
+
+    Args:
+        manifest (dict): Nội dung manifest (chỉ gồm kiểu JSON, bytes đã ở dạng Base64).
+        private_key (RsaKey): Khóa riêng tư của người gửi.
+
+    Returns:
+        dict: {"manifest": manifest, "signature": chữ ký Base64}, là nội dung file manifest được lưu.
+    """
+    signature = sign_data(_manifest_digest(manifest), private_key)
+    return {"manifest": manifest, "signature": b64encode(signature).decode('utf-8')}
+
+def verify_transfer_manifest(signed_manifest, public_key):
+    """
+    Xác minh chữ ký của manifest truyền file (ngược với sign_transfer_manifest).
+
+    Returns:
+        bool: True nếu manifest đúng là do người gửi ký.
+    """
+    try:
+        signature = b64decode(signed_manifest["signature"])
+        return verify_signature(_manifest_digest(signed_manifest["manifest"]), signature, public_key)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+def batch_relative_path(path):
+    """
+    Chuẩn hóa đường dẫn tương đối của một file trong lô (dấu phân cách "/").
+
+    Args:
+        path (str): Đường dẫn tương đối, có thể dùng "\\" hoặc "/".
+
+    Returns:
+        str: Đường dẫn đã chuẩn hóa, ví dụ "hop_dong/2024/a.pdf".
+
+    Raises:
+        ValueError: Nếu đường dẫn rỗng, tuyệt đối hoặc có thành phần ".", ".." (thoát khỏi thư mục lô).
+    """
+    components = str(path).replace("\\", "/").split("/")
+    if not path or any(c in ("", ".", "..") or ":" in c for c in components):
+        raise ValueError(f"Đường dẫn file trong lô không hợp lệ: {path}")
+    return "/".join(components)
+
+class BatchReader:
+    """
+    Luồng chỉ đọc, seek được, nối liền nội dung nhiều file theo thứ tự.
+
+    Mỗi nguồn là đường dẫn (chỉ mở khi đọc tới, nên lô hàng chục nghìn file không giữ hàng chục nghìn
+    file đang mở) hoặc một đối tượng file đã mở và đặt ở đầu nội dung. starts (tùy chọn) cho vị trí bắt đầu
+    của từng nguồn, ví dụ để đọc nhiều đoạn của cùng một file như một luồng liền.
+    """
+    def __init__(self, sources, sizes, starts=None):
+        self.sources = list(sources)
+        self.offsets = list(itertools.accumulate(sizes, initial=0))
+        self.size = self.offsets[-1]
+        self.position = 0
+        self.current_index = None
+        self.current_file = None
+        # Vị trí ban đầu của các nguồn là đối tượng file
+        self.base_positions = dict(enumerate(starts)) if starts is not None else {}
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Vị trí seek âm.")
+        self.position = offset
+        return self.position
+
+    def _open(self, index):
+        if index == self.current_index:
+            return self.current_file
+        self._close_current()
+        source = self.sources[index]
+        if isinstance(source, (str, bytes, os.PathLike)):
+            self.current_file = open(source, "rb")
+            self.base_positions[index] = 0
+        else:
+            self.current_file = source
+            self.base_positions.setdefault(index, source.tell())
+        self.current_index = index
+        return self.current_file
+
+    def _close_current(self):
+        if self.current_file is not None and isinstance(self.sources[self.current_index], (str, bytes, os.PathLike)):
+            self.current_file.close()
+        self.current_index = None
+        self.current_file = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self.position)
+        pieces = []
+        while size > 0 and self.position < self.size:
+            index = bisect_right(self.offsets, self.position) - 1
+            start, end = self.offsets[index], self.offsets[index + 1]
+            f = self._open(index)
+            f.seek(self.base_positions[index] + self.position - start)
+            piece = f.read(min(size, end - self.position))
+            if not piece:
+                raise EOFError(f"File thứ {index + 1} trong lô ngắn hơn kích thước đã khai báo ({end - start} bytes).")
+            pieces.append(piece)
+            self.position += len(piece)
+            size -= len(piece)
+        return b"".join(pieces)
+
+    def close(self):
+        self._close_current()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _record_packet(direction, frame_format, num_bytes, start):
+    PACKET_SECONDS.observe(time.perf_counter() - start, direction, frame_format)
+    PACKETS.inc(1, direction, frame_format)
+    PACKET_BYTES.inc(num_bytes, direction)
+
 def send_data_packet(sock, data_dict):
     """
     Gửi một gói dữ liệu qua socket sau khi mã hóa JSON và thêm tiền tố độ dài.
@@ -199,45 +1158,356 @@ def send_data_packet(sock, data_dict):
         sock (socket.socket): Đối tượng socket đã kết nối.
         data_dict (dict): Dữ liệu Python dictionary cần gửi.
     """
-    json_data = json.dumps(data_dict)
+    start = time.perf_counter()
+    json_data = json.dumps(data_dict).encode('utf-8')
     # Thêm tiền tố độ dài 4 bytes (big-endian) cho gói dữ liệu
     length_prefix = len(json_data).to_bytes(4, 'big')
-    sock.sendall(length_prefix + json_data.encode('utf-8'))
+    sock.sendall(length_prefix + json_data)
+    _record_packet("sent", "json", 4 + len(json_data), start)
 
-def receive_data_packet(sock):
+def encode_binary_frame(data_dict, payload_key=None):
+    """
+    Mã hóa một gói dữ liệu thành khung nhị phân (không base64, không JSON cho dữ liệu thô).
+
+    Args:
+        data_dict (dict): Các trường của gói. Giá trị bytes được giữ nguyên dạng nhị phân.
+        payload_key (str): Tên trường chứa dữ liệu lớn (ví dụ "cipher"), được đặt sau HEADER
+            mà không sao chép vào HEADER.
+
+    Returns:
+        tuple: (header_bytes, payload). header_bytes đã bao gồm MAGIC/VERSION/HEADER_LEN.
+    """
+    fields = []
+    for name, value in data_dict.items():
+        if name == payload_key:
+            continue
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            field_type, raw = _FIELD_BYTES, bytes(value)
+        elif isinstance(value, str):
+            field_type, raw = _FIELD_STR, value.encode('utf-8')
+        elif isinstance(value, int) and not isinstance(value, bool):
+            field_type, raw = _FIELD_INT, value.to_bytes(8, 'big', signed=True)
+        else:
+            field_type, raw = _FIELD_JSON, json.dumps(value).encode('utf-8')
+        name_bytes = name.encode('utf-8')
+        fields.append(bytes([len(name_bytes)]) + name_bytes + _FIELD_PREFIX.pack(field_type, len(raw)) + raw)
+    payload = b""
+    if payload_key is not None:
+        name_bytes = payload_key.encode('utf-8')
+        fields.append(bytes([len(name_bytes)]) + name_bytes + _FIELD_PREFIX.pack(_FIELD_PAYLOAD, 0))
+        payload = data_dict[payload_key]
+    header = b"".join(fields)
+    return _FRAME_PREFIX.pack(BINARY_FRAME_MAGIC, BINARY_FRAME_VERSION, len(header)) + header, payload
+
+def decode_binary_frame(frame):
+    """
+    Giải mã khung nhị phân thành dictionary.
+
+    Args:
+        frame (bytes-like): Toàn bộ khung (không gồm tiền tố độ dài 4 bytes).
+
+    Returns:
+        dict: Các trường của gói. Trường dữ liệu thô là memoryview trỏ thẳng vào bộ đệm nhận.
+    """
+    view = memoryview(frame)
+    magic, version, header_len = _FRAME_PREFIX.unpack_from(view, 0)
+    if magic != BINARY_FRAME_MAGIC or version != BINARY_FRAME_VERSION:
+        raise ValueError(f"Khung nhị phân không được hỗ trợ (magic={magic}, version={version}).")
+    pos = _FRAME_PREFIX.size
+    header_end = pos + header_len
+    if header_end > len(view):
+        raise ValueError("Khung nhị phân bị cắt cụt.")
+    result = {}
+    payload_key = None
+    while pos < header_end:
+        name_len = view[pos]
+        name = bytes(view[pos + 1:pos + 1 + name_len]).decode('utf-8')
+        pos += 1 + name_len
+        field_type, value_len = _FIELD_PREFIX.unpack_from(view, pos)
+        pos += _FIELD_PREFIX.size
+        raw = view[pos:pos + value_len]
+        pos += value_len
+        if field_type == _FIELD_BYTES:
+            result[name] = bytes(raw)
+        elif field_type == _FIELD_STR:
+            result[name] = bytes(raw).decode('utf-8')
+        elif field_type == _FIELD_INT:
+            result[name] = int.from_bytes(raw, 'big', signed=True)
+        elif field_type == _FIELD_JSON:
+            result[name] = json.loads(bytes(raw).decode('utf-8'))
+        elif field_type == _FIELD_PAYLOAD:
+            payload_key = name
+        else:
+            raise ValueError(f"Kiểu trường không hợp lệ trong khung nhị phân: {field_type}")
+    if payload_key is not None:
+        result[payload_key] = view[header_end:]
+    return result
+
+def send_binary_packet(sock, data_dict, payload_key=None):
+    """
+    Gửi một gói dữ liệu dạng khung nhị phân qua socket, với tiền tố độ dài 4 bytes như gói JSON.
+
+    Args:
+        sock (socket.socket): Đối tượng socket đã kết nối.
+        data_dict (dict): Dữ liệu cần gửi.
+        payload_key (str): Tên trường chứa dữ liệu thô lớn (xem encode_binary_frame).
+    """
+    start = time.perf_counter()
+    header, payload = encode_binary_frame(data_dict, payload_key)
+    length_prefix = (len(header) + len(payload)).to_bytes(4, 'big')
+    if len(payload) < _SMALL_PAYLOAD_SIZE:
+        sock.sendall(length_prefix + header + payload)
+    else:
+        # Gửi payload lớn trực tiếp để tránh sao chép khi ghép với header
+        sock.sendall(length_prefix + header)
+        sock.sendall(payload)
+    _record_packet("sent", "binary", 4 + len(header) + len(payload), start)
+
+def negotiate_wire_format(offered_formats):
+    """
+    Chọn định dạng khung tốt nhất mà cả hai bên cùng hỗ trợ.
+
+    Args:
+        offered_formats (list): Danh sách định dạng bên gửi đề xuất (theo thứ tự ưu tiên).
+
+    Returns:
+        str: Định dạng được chọn, mặc định WIRE_FORMAT_JSON.
+    """
+    for wire_format in offered_formats or []:
+        if wire_format in SUPPORTED_WIRE_FORMATS:
+            return wire_format
+    return WIRE_FORMAT_JSON
+
+def packet_bytes(data_dict, key):
+    """
+    Lấy giá trị nhị phân của một trường, bất kể gói đến từ khung JSON (base64) hay khung nhị phân.
+
+    Args:
+        data_dict (dict): Gói dữ liệu đã nhận.
+        key (str): Tên trường.
+
+    Returns:
+        bytes or memoryview or None: Dữ liệu nhị phân của trường.
+    """
+    value = data_dict.get(key)
+    if isinstance(value, str):
+        return b64decode(value)
+    return value
+
+def recv_exact_into(sock, view, buffer_size=BUFFER_SIZE):
+    """
+    Đọc chính xác len(view) bytes từ socket vào bộ đệm có sẵn (không tạo bản sao trung gian).
+
+    Args:
+        sock (socket.socket): Đối tượng socket đã kết nối.
+        view (memoryview): Vùng nhớ ghi được cần lấp đầy.
+        buffer_size (int): Số byte tối đa cho mỗi lần recv_into. None là không giới hạn.
+
+    Returns:
+        bool: True nếu đọc đủ, False nếu kết nối bị đóng giữa chừng.
+    """
+    received = 0
+    total = len(view)
+    while received < total:
+        end = total if not buffer_size else min(total, received + buffer_size)
+        count = sock.recv_into(view[received:end])
+        if count == 0:
+            return False # Kết nối bị đóng
+        received += count
+    return True
+
+def recv_exact(sock, num_bytes, buffer_size=BUFFER_SIZE):
+    """
+    Đọc chính xác num_bytes bytes từ socket vào một bytearray cấp phát trước.
+
+    Args:
+        sock (socket.socket): Đối tượng socket đã kết nối.
+        num_bytes (int): Số byte cần đọc.
+        buffer_size (int): Số byte tối đa cho mỗi lần recv_into.
+
+    Returns:
+        bytearray or None: Dữ liệu đã đọc, hoặc None nếu kết nối bị đóng giữa chừng.
+    """
+    data = bytearray(num_bytes)
+    if not recv_exact_into(sock, memoryview(data), buffer_size):
+        return None
+    return data
+
+def decode_packet(frame):
+    """
+    Giải mã nội dung một gói (không gồm tiền tố độ dài): gói JSON hoặc khung nhị phân.
+
+    Args:
+        frame (bytes or bytearray): Nội dung gói.
+
+    Returns:
+        dict: Dữ liệu đã giải mã.
+    """
+    if frame[:1] == b"{":
+        return json.loads(frame.decode('utf-8'))
+    return decode_binary_frame(frame)
+
+def _decode_received_packet(frame, start):
+    # Thời gian nhận tính từ lúc có tiền tố độ dài (không tính thời gian chờ gói tới) tới khi giải mã xong
+    packet = decode_packet(frame)
+    _record_packet("received", "json" if frame[:1] == b"{" else "binary", 4 + len(frame), start)
+    return packet
+
+async def async_receive_data_packet(reader, max_frame_size=MAX_FRAME_SIZE):
+    """
+    Phiên bản asyncio của receive_data_packet, đọc từ asyncio.StreamReader.
+
+    Args:
+        reader (asyncio.StreamReader): Luồng đọc của kết nối.
+        max_frame_size (int): Kích thước gói tối đa chấp nhận được.
+
+    Returns:
+        dict or None: Dữ liệu đã giải mã, hoặc None nếu có lỗi/kết nối đóng.
+    """
+    import asyncio # Import muộn: chỉ server asyncio cần, tránh làm chậm lúc import utils
+    try:
+        length_bytes = await reader.readexactly(4)
+        data_length = int.from_bytes(length_bytes, 'big')
+        if data_length > max_frame_size:
+            print(f"Gói dữ liệu quá lớn: {data_length} bytes (tối đa {max_frame_size} bytes)")
+            return None
+        start = time.perf_counter()
+        return _decode_received_packet(await reader.readexactly(data_length), start)
+    except asyncio.IncompleteReadError:
+        return None # Kết nối bị đóng giữa chừng
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError, struct.error) as e:
+        print(f"Lỗi giải mã gói dữ liệu JSON/Unicode/nhị phân: {e}")
+        return None
+    except (ConnectionError, OSError) as e:
+        print(f"Lỗi socket khi nhận dữ liệu: {e}")
+        return None
+
+def receive_data_packet(sock, buffer_size=BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
     """
     Nhận một gói dữ liệu từ socket theo định dạng tiền tố độ dài.
 
     Args:
         sock (socket.socket): Đối tượng socket đã kết nối.
+        buffer_size (int): Số byte tối đa cho mỗi lần recv_into.
+        max_frame_size (int): Kích thước gói tối đa chấp nhận được.
 
     Returns:
-        dict or None: Dữ liệu đã giải mã JSON dưới dạng từ điển, hoặc None nếu có lỗi/kết nối đóng.
+        dict or None: Dữ liệu đã giải mã (từ gói JSON hoặc khung nhị phân) dưới dạng từ điển,
+        hoặc None nếu có lỗi/kết nối đóng.
     """
     try:
-        # Nhận 4 bytes đầu tiên để biết độ dài gói dữ liệu
-        length_bytes = sock.recv(4)
-        if not length_bytes:
+        # Nhận đủ 4 bytes đầu tiên để biết độ dài gói dữ liệu (recv(4) có thể trả về ít hơn 4 bytes)
+        length_bytes = recv_exact(sock, 4, buffer_size)
+        if length_bytes is None:
             return None # Kết nối bị đóng hoặc lỗi
-        
+
         data_length = int.from_bytes(length_bytes, 'big')
-        
-        # Nhận đủ dữ liệu theo độ dài đã cho
-        received_data = b""
-        while len(received_data) < data_length:
-            # Đảm bảo không nhận quá nhiều nếu BUFFER_SIZE lớn hơn phần còn lại
-            packet = sock.recv(min(data_length - len(received_data), BUFFER_SIZE))
-            if not packet:
-                return None # Kết nối bị đóng hoặc lỗi
-            received_data += packet
-        
-        return json.loads(received_data.decode('utf-8'))
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
-        print(f"Lỗi giải mã gói dữ liệu JSON/Unicode: {e}")
+        if data_length > max_frame_size:
+            print(f"Gói dữ liệu quá lớn: {data_length} bytes (tối đa {max_frame_size} bytes)")
+            return None
+
+        # Nhận đủ dữ liệu theo độ dài đã cho thẳng vào bộ đệm cấp phát trước
+        start = time.perf_counter()
+        received_data = recv_exact(sock, data_length, buffer_size)
+        if received_data is None:
+            return None # Kết nối bị đóng hoặc lỗi
+
+        return _decode_received_packet(received_data, start)
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError, struct.error) as e:
+        print(f"Lỗi giải mã gói dữ liệu JSON/Unicode/nhị phân: {e}")
         return None
     except socket.error as e:
         print(f"Lỗi socket khi nhận dữ liệu: {e}")
         return None
     except Exception as e:
         print(f"Lỗi không xác định khi nhận dữ liệu: {e}")
-        return None
\ No newline at end of file
+        return None
+
+class ActivityLog:
+    """
+    Nhật ký hoạt động dùng chung cho nhiều luồng, giới hạn ở capacity mục gần nhất.
+
+    Dùng được như danh sách thông điệp cũ (append, duyệt, len, chỉ số); mỗi mục còn mang số thứ tự
+    tăng dần (seq), thời điểm, mức độ, địa chỉ và file_id để /get_logs chỉ trả về các mục mới.
+    """
+    def __init__(self, capacity=ACTIVITY_LOG_CAPACITY):
+        self.entries = deque(maxlen=capacity)
+        self.last_seq = 0
+        self.condition = threading.Condition()
+
+    def append(self, message, level=LOG_INFO, addr=None, file_id=None):
+        with self.condition:
+            self.last_seq += 1
+            self.entries.append({
+                "seq": self.last_seq,
+                "timestamp": datetime.now().isoformat(timespec='milliseconds'),
+                "level": level,
+                "message": message,
+                "addr": f"{addr[0]}:{addr[1]}" if isinstance(addr, tuple) else addr,
+                "file_id": file_id
+            })
+            self.condition.notify_all()
+
+    def since(self, seq=0, limit=GET_LOGS_LIMIT):
+        """
+        Lấy các mục có số thứ tự lớn hơn seq.
+
+        Args:
+            seq (int): Số thứ tự cuối cùng bên gọi đã có (0: lấy từ đầu vòng đệm).
+            limit (int): Số mục tối đa trả về (các mục cũ nhất trước).
+
+        Returns:
+            tuple: (danh sách mục, số mục đã bị đẩy khỏi vòng đệm trước khi kịp lấy).
+        """
+        with self.condition:
+            if seq > self.last_seq:
+                seq = 0 # Bên gọi giữ seq từ trước khi ứng dụng khởi động lại
+            if not self.entries:
+                return [], 0
+            first_seq = self.entries[0]["seq"]
+            start = max(0, seq + 1 - first_seq)
+            dropped = max(0, first_seq - seq - 1)
+            return list(itertools.islice(self.entries, start, start + limit)), dropped
+
+    def wait(self, seq, timeout=None):
+        """Chờ tới khi có mục mới hơn seq hoặc hết thời gian; trả về True nếu có mục mới."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last_seq > seq, timeout)
+
+    def clear(self):
+        with self.condition:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        with self.condition:
+            messages = [entry["message"] for entry in self.entries]
+        return iter(messages)
+
+    def __getitem__(self, index):
+        with self.condition:
+            messages = [entry["message"] for entry in self.entries]
+        return messages[index]
+
+def activity_log_events(activity_log, since=0, keepalive=SSE_KEEPALIVE_SECONDS):
+    """
+    Sinh luồng Server-Sent Events cho nhật ký hoạt động: mỗi mục mới là một sự kiện có id là seq.
+
+    Args:
+        activity_log (ActivityLog): Nhật ký cần theo dõi.
+        since (int): Số thứ tự cuối cùng trình duyệt đã có (Last-Event-ID khi kết nối lại).
+        keepalive (float): Số giây chờ tối đa trước khi gửi dòng chú thích giữ kết nối.
+
+    Yields:
+        str: Các khối văn bản theo định dạng text/event-stream.
+    """
+    while True:
+        entries, _ = activity_log.since(since)
+        if entries:
+            for entry in entries:
+                yield f"id: {entry['seq']}\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+            since = entries[-1]["seq"]
+        elif not activity_log.wait(min(since, activity_log.last_seq), keepalive):
+            yield ": keepalive\n\n"
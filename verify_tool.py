@@ -1,7 +1,303 @@
 import os
+import sys
+import json
+import time
+import argparse
 from base64 import b64decode
+from concurrent.futures import ProcessPoolExecutor
 # Đảm bảo utils.py nằm cùng thư mục hoặc trong PYTHONPATH
-from utils import load_rsa_public_key, verify_signature, compute_sha512 
+from utils import (
+    load_rsa_public_key, verify_signature, compute_sha512,
+    verify_merkle_proof, decode_merkle_proof, build_merkle_tree, merkle_root,
+    part_length, verify_transfer_manifest, MANIFEST_SUFFIX, AUTH_MODE_MERKLE, BatchReader, batch_relative_path,
+    stream_sha512
+)
+
+# Khóa công khai đã tải trong mỗi tiến trình xác minh (đường dẫn -> RsaKey), tránh đọc và phân tích PEM cho từng dòng
+_public_key_cache = {}
+# Số dòng manifest giao cho một tiến trình mỗi lần
+BATCH_CHUNK_SIZE = 64
+
+def verify_merkle_part(leaf_hash, proof, root, root_signature, public_key):
+    """
+    Xác minh một phần file ở chế độ Merkle: hash của phần thuộc cây có gốc đã cho,
+    và gốc cây được ký bởi người gửi.
+
+    Returns:
+        tuple: (bool, str) kết quả và lý do.
+    """
+    if not verify_merkle_proof(leaf_hash, proof, root):
+        return False, "Bằng chứng Merkle không dẫn tới gốc đã cho."
+    if not verify_signature(root, root_signature, public_key):
+        return False, "Chữ ký trên gốc Merkle không hợp lệ."
+    return True, "Hash thuộc cây Merkle và gốc cây được ký hợp lệ."
+
+def verify_received_file(manifest_path, public_key, file_path=None):
+    """
+    Xác minh lại một file đã nhận theo manifest đã ký, trong một lượt đọc file tuần tự.
+
+    Kiểm tra chữ ký manifest và metadata, chữ ký từng phần (hoặc gốc Merkle dựng lại từ hash các phần),
+    rồi băm từng phần của file so với hash bản rõ trong manifest. Không cần kết nối hay khóa phiên.
+
+    Args:
+        manifest_path (str): Đường dẫn file manifest (.manifest.json).
+        public_key (RsaKey): Khóa công khai của người gửi.
+        file_path (str): File đã nhận (thư mục với lô nhiều file); mặc định là manifest_path bỏ hậu tố manifest.
+
+    Returns:
+        tuple: (bool, str, dict) kết quả, lý do và thông tin (file, số phần, số byte đã đọc).
+    """
+    if file_path is None:
+        file_path = manifest_path[:-len(MANIFEST_SUFFIX)] if manifest_path.endswith(MANIFEST_SUFFIX) else manifest_path
+    details = {"file": file_path}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            signed_manifest = json.load(f)
+        if not verify_transfer_manifest(signed_manifest, public_key):
+            return False, "Chữ ký manifest không hợp lệ.", details
+        manifest = signed_manifest["manifest"]
+        metadata = manifest["metadata"]
+        metadata_json = json.dumps(metadata, sort_keys=True).encode('utf-8')
+        if not verify_signature(compute_sha512(metadata_json), b64decode(manifest["signed_metadata"]), public_key):
+            return False, "Chữ ký metadata file không hợp lệ.", details
+        parts = manifest["parts"]
+        num_parts, file_size, chunk_size = metadata["num_parts"], metadata["file_size"], metadata["chunk_size"]
+        details["parts"] = num_parts
+        if len(parts) != num_parts:
+            return False, f"Manifest có {len(parts)} phần, metadata khai báo {num_parts} phần.", details
+        part_hashes = [b64decode(entry["hash"]) for entry in parts]
+        if manifest.get("auth_mode") == AUTH_MODE_MERKLE:
+            root = b64decode(manifest["merkle_root"])
+            if merkle_root(build_merkle_tree(part_hashes)) != root:
+                return False, "Gốc Merkle không khớp với hash các phần trong manifest.", details
+            if not verify_signature(root, b64decode(manifest["root_signature"]), public_key):
+                return False, "Chữ ký gốc Merkle không hợp lệ.", details
+        else:
+            for i, entry in enumerate(parts):
+                if not verify_signature(part_hashes[i], b64decode(entry["signature"]), public_key):
+                    return False, f"Chữ ký phần {i} không hợp lệ.", details
+        if "delta" in metadata:
+            # Gửi phần khác biệt: các phần trong manifest là các đoạn mới, không phải file đã dựng lại.
+            # File được đối chiếu với kích thước và SHA-512 của bản mới trong metadata đã ký.
+            delta = metadata["delta"]
+            with open(file_path, "rb") as f:
+                content_hash = stream_sha512(f)
+                details["bytes"] = f.tell()
+            if details["bytes"] != delta["target_size"] or content_hash != delta["target_sha512"]:
+                return False, "Nội dung file không khớp với hash bản mới trong metadata đã ký.", details
+            return True, "File khớp với hash bản mới đã ký của người gửi (gửi phần khác biệt).", details
+        bytes_read = 0
+        if "batch" in metadata:
+            # Lô nhiều file: đọc các file trong thư mục nối liền theo thứ tự của metadata đã ký
+            paths = [os.path.join(file_path, *batch_relative_path(entry["path"]).split("/")) for entry in metadata["batch"]["files"]]
+            sizes = [entry["size"] for entry in metadata["batch"]["files"]]
+            for path, size in zip(paths, sizes):
+                if os.path.getsize(path) != size:
+                    return False, f"Kích thước file '{path}' không khớp với metadata ({size} bytes).", details
+            details["files"] = len(paths)
+            source = BatchReader(paths, sizes)
+        else:
+            source = open(file_path, "rb")
+        with source as f:
+            for i, entry in enumerate(parts):
+                chunk = f.read(part_length(file_size, chunk_size, i))
+                bytes_read += len(chunk)
+                if compute_sha512(chunk) != b64decode(entry["plaintext_hash"]):
+                    details["bytes"] = bytes_read
+                    return False, f"Nội dung phần {i} của file không khớp với manifest.", details
+            extra = f.read(1)
+        details["bytes"] = bytes_read
+        if bytes_read != file_size or extra:
+            return False, f"Kích thước file không khớp với metadata ({file_size} bytes).", details
+        return True, "File khớp với manifest đã ký của người gửi.", details
+    except KeyError as e:
+        return False, f"Manifest thiếu trường {e}.", details
+    except (OSError, ValueError, TypeError) as e:
+        return False, f"Lỗi khi xác minh: {e}", details
+
+def _input_b64(prompt, label):
+    value = input(prompt).strip()
+    if not value:
+        print(f"Lỗi: Chuỗi {label} không được để trống.")
+        return None
+    try:
+        decoded = b64decode(value)
+        print(f"Đã giải mã chuỗi {label} Base64.")
+        return decoded
+    except Exception as e:
+        print(f"Lỗi: Chuỗi {label} Base64 không hợp lệ. {e}")
+        return None
+
+def run_merkle_verification(sender_public_key):
+    print("\n--- Xác minh bằng chứng Merkle ---")
+    print("Sao chép từ log của Người gửi (mức DEBUG, ví dụ cli.py send -v): Hash (Base64) của phần,")
+    print("Bằng chứng Merkle (JSON) của phần, Gốc Merkle (Base64) và Chữ ký gốc Merkle (Base64).")
+    print("------------------------\n")
+    leaf_hash = _input_b64("Nhập chuỗi Base64 của HASH phần file: ", "hash")
+    if leaf_hash is None:
+        return
+    proof_json = input("Nhập BẰNG CHỨNG MERKLE (JSON) của phần file: ").strip()
+    try:
+        proof = decode_merkle_proof(json.loads(proof_json))
+    except Exception as e:
+        print(f"Lỗi: Bằng chứng Merkle không hợp lệ. {e}")
+        return
+    root = _input_b64("Nhập chuỗi Base64 của GỐC MERKLE: ", "gốc Merkle")
+    if root is None:
+        return
+    root_signature = _input_b64("Nhập chuỗi Base64 của CHỮ KÝ GỐC MERKLE: ", "chữ ký")
+    if root_signature is None:
+        return
+
+    print("\nĐang thực hiện xác minh...")
+    valid, reason = verify_merkle_part(leaf_hash, proof, root, root_signature, sender_public_key)
+    if valid:
+        print("\n[THÀNH CÔNG] Bằng chứng Merkle và chữ ký gốc hợp lệ!")
+        print("=> Điều này xác nhận (IV || Ciphertext) của phần file tương ứng do người gửi ký.")
+    else:
+        print(f"\n[THẤT BẠI] {reason}")
+
+def _cached_public_key(public_key_path):
+    if public_key_path not in _public_key_cache:
+        public_key = load_rsa_public_key(public_key_path)
+        if not public_key:
+            raise ValueError(f"Không thể tải khóa công khai từ: {public_key_path}")
+        _public_key_cache[public_key_path] = public_key
+    return _public_key_cache[public_key_path]
+
+def verify_manifest_entry(entry, default_public_key_path=None):
+    """
+    Xác minh một dòng manifest (chạy trong tiến trình của pool).
+
+    Dòng chữ ký từng phần gồm "hash" và "signature"; dòng Merkle gồm "hash", "proof",
+    "merkle_root" và "root_signature" (đều Base64, proof theo định dạng trong log Người gửi).
+    "public_key" là đường dẫn khóa công khai, mặc định là khóa truyền qua dòng lệnh.
+
+    Returns:
+        dict: Kết quả gồm valid, reason và elapsed_ms (thời gian xác minh dòng này).
+    """
+    start = time.perf_counter()
+    result = {key: entry[key] for key in ("file", "file_id", "part") if key in entry}
+    try:
+        public_key_path = entry.get("public_key") or default_public_key_path
+        if not public_key_path:
+            raise ValueError("Thiếu đường dẫn khóa công khai.")
+        public_key = _cached_public_key(public_key_path)
+        leaf_hash = b64decode(entry["hash"])
+        if "proof" in entry:
+            valid, reason = verify_merkle_part(
+                leaf_hash, decode_merkle_proof(entry["proof"]), b64decode(entry["merkle_root"]),
+                b64decode(entry["root_signature"]), public_key
+            )
+        elif verify_signature(leaf_hash, b64decode(entry["signature"]), public_key):
+            valid, reason = True, "Chữ ký hợp lệ."
+        else:
+            valid, reason = False, "Chữ ký không hợp lệ."
+    except KeyError as e:
+        valid, reason = False, f"Dòng manifest thiếu trường {e}."
+    except Exception as e:
+        valid, reason = False, f"Lỗi khi xác minh: {e}"
+    result.update(valid=valid, reason=reason, elapsed_ms=round((time.perf_counter() - start) * 1000, 3))
+    return result
+
+def _verify_transfer_manifest(source, default_public_key_path):
+    start = time.perf_counter()
+    try:
+        if not default_public_key_path:
+            raise ValueError("Thiếu đường dẫn khóa công khai (--public-key).")
+        valid, reason, details = verify_received_file(source, _cached_public_key(default_public_key_path))
+    except ValueError as e:
+        valid, reason, details = False, str(e), {}
+    except Exception as e:
+        valid, reason, details = False, f"Lỗi khi xác minh: {e}", {}
+    return {"manifest": source, **details, "valid": valid, "reason": reason,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+def _verify_job(job):
+    # Mỗi việc là (hàm xác minh, tham số): hàm ở mức module nên gửi được sang tiến trình của pool
+    function, args = job
+    return function(*args)
+
+def _verify_manifest_line(source, line_number, line, default_public_key_path):
+    try:
+        entry = json.loads(line)
+        if not isinstance(entry, dict):
+            raise ValueError("dòng không phải đối tượng JSON")
+    except ValueError as e:
+        result = {"valid": False, "reason": f"Dòng manifest không hợp lệ: {e}", "elapsed_ms": 0.0}
+    else:
+        result = verify_manifest_entry(entry, default_public_key_path)
+    return {"manifest": source, "line": line_number, **result}
+
+def _manifest_paths(paths):
+    # Thư mục được thay bằng mọi file manifest (.jsonl hoặc manifest truyền file) trong đó, theo thứ tự tên
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".jsonl") or name.endswith(MANIFEST_SUFFIX):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def _manifest_jobs(paths, default_public_key_path):
+    for path in _manifest_paths(paths):
+        if path.endswith(MANIFEST_SUFFIX):
+            # Manifest truyền file: một kết quả cho cả file
+            yield _verify_transfer_manifest, (path, default_public_key_path)
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield _verify_manifest_line, (path, line_number, line, default_public_key_path)
+
+def run_batch_verification(paths, public_key_path=None, workers=None, output=None):
+    """
+    Xác minh không tương tác mọi dòng của các manifest JSONL và mọi manifest truyền file
+    (cùng file đã nhận nằm cạnh nó), song song trên nhiều tiến trình.
+
+    Mỗi dòng kết quả được ghi ra output dưới dạng JSON, dòng cuối cùng là {"summary": ...}
+    với số dòng hợp lệ/không hợp lệ và thời gian chạy.
+
+    Returns:
+        dict: Bản tóm tắt (total, valid, invalid, elapsed_s, entries_per_s).
+    """
+    output = output or sys.stdout
+    start = time.perf_counter()
+    total = valid = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_verify_job, _manifest_jobs(paths, public_key_path), chunksize=BATCH_CHUNK_SIZE):
+            total += 1
+            valid += result["valid"]
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    elapsed = time.perf_counter() - start
+    summary = {
+        "total": total,
+        "valid": valid,
+        "invalid": total - valid,
+        "elapsed_s": round(elapsed, 3),
+        "entries_per_s": round(total / elapsed, 1) if elapsed > 0 else None
+    }
+    output.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+    output.flush()
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xác minh chữ ký phần file. Không có tham số: chạy chế độ tương tác.")
+    parser.add_argument("manifests", nargs="*", help="File manifest JSONL, manifest truyền file (.manifest.json) hoặc thư mục chứa chúng")
+    parser.add_argument("--public-key", help="Khóa công khai mặc định của người gửi (cho các dòng không có public_key)")
+    parser.add_argument("--workers", type=int, default=None, help="Số tiến trình xác minh (mặc định: số lõi CPU)")
+    parser.add_argument("--output", help="Ghi kết quả JSONL ra file thay vì stdout")
+    args = parser.parse_args(argv)
+    if not args.manifests:
+        run_verification_tool()
+        return 0
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            summary = run_batch_verification(args.manifests, args.public_key, args.workers, output)
+    else:
+        summary = run_batch_verification(args.manifests, args.public_key, args.workers)
+    # Mã thoát khác 0 khi có dòng không hợp lệ, để dùng được trong script kiểm toán
+    return 0 if summary["invalid"] == 0 else 1
 
 def run_verification_tool():
     print("\n--- Công cụ Xác minh Chữ ký File (Offline) ---")
@@ -19,6 +315,8 @@ def run_verification_tool():
     if not os.path.exists(file_path):
         print(f"Cảnh báo: Không tìm thấy file tại đường dẫn: {file_path}. Công cụ sẽ không thể đọc nội dung file.")
         # Không return, vì có thể người dùng chỉ muốn xác minh hash trực tiếp.
+    elif os.path.isdir(file_path):
+        print(f"Đã chọn thư mục lô: {file_path} (chỉ xác minh được theo manifest, chế độ 3).")
     else:
         try:
             with open(file_path, 'rb') as f:
@@ -36,8 +334,20 @@ def run_verification_tool():
         return
     print(f"Đã tải khóa công khai từ: {os.path.basename(public_key_path)}")
 
+    mode = input("Chọn chế độ xác minh (1: chữ ký từng phần, 2: bằng chứng Merkle, 3: manifest của file đã nhận) [1]: ").strip() or "1"
+    if mode == "2":
+        run_merkle_verification(sender_public_key)
+        return
+    if mode == "3":
+        manifest_path = file_path + MANIFEST_SUFFIX
+        print(f"\nĐang xác minh file theo manifest: {manifest_path}")
+        valid, reason, details = verify_received_file(manifest_path, sender_public_key, file_path)
+        print(f"\n[{'THÀNH CÔNG' if valid else 'THẤT BẠI'}] {reason}")
+        return
+
     print("\n--- Lưu ý quan trọng ---")
     print("Công cụ này được điều chỉnh để xác minh hash của (IV || ciphertext) của MỘT PHẦN file.")
+    print("Với bộ mã hóa AEAD (aes-256-gcm, chacha20-poly1305), hash là của (IV || tag xác thực).")
     print("Đảm bảo bạn sao chép đúng 'Hash (Base64)' và 'Chữ ký (Base64)' từ log của Người gửi.")
     print("------------------------\n")
 
@@ -84,4 +394,4 @@ def run_verification_tool():
         print(f"\nLỗi trong quá trình xác minh: {e}")
 
 if __name__ == "__main__":
-    run_verification_tool()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file